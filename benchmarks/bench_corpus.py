@@ -0,0 +1,69 @@
+"""Parse the recorded snapshots of an exam page corpus and report exams per second and peak memory.
+
+Record a snapshot with `EXAM_SCRAPER_MODE=record`. Run with `python benchmarks/bench_corpus.py` from the root of
+the repository.
+"""
+import argparse
+import importlib.util
+import os
+import time
+import tracemalloc
+
+from loguru import logger
+
+from fishing_exam_alert.corpus import ExamPageCorpus
+from fishing_exam_alert.models import ExamTableScraper
+from fishing_exam_alert.parser import PARSER_BACKENDS
+
+DEFAULT_CORPUS_DIR = os.path.join(os.path.dirname(__file__), "..", "tests", "fixtures", "corpus")
+
+
+def is_installed(backend: str) -> bool:
+    optional_backends = ["lxml", "selectolax"]
+    return backend not in optional_backends or importlib.util.find_spec(backend) is not None
+
+
+def measure(scraper: ExamTableScraper, repeat: int):
+    """Get the number of exams, the best exams per second and the peak memory [bytes] of parsing all exams."""
+    best_seconds = float("inf")
+    exams_count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        exams_count = sum(1 for _ in scraper.iter_exams())
+        best_seconds = min(best_seconds, time.perf_counter() - start)
+
+    # measure the memory separately, tracemalloc slows down the parsing
+    tracemalloc.start()
+    for _ in scraper.iter_exams():
+        pass
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return exams_count, exams_count / best_seconds, peak_bytes
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--corpus-dir", default=DEFAULT_CORPUS_DIR, help="directory of the corpus")
+    arg_parser.add_argument("--backend", choices=list(PARSER_BACKENDS), help="only benchmark this parser backend")
+    arg_parser.add_argument("--repeat", type=int, default=5, help="number of measurements (the best one is reported)")
+    args = arg_parser.parse_args()
+
+    logger.disable("fishing_exam_alert")
+    corpus = ExamPageCorpus(args.corpus_dir)
+    backends = [args.backend] if args.backend else list(PARSER_BACKENDS)
+
+    print(f"{'snapshot':<18} {'backend':<12} {'exams':>6} {'exams/s':>10} {'peak [KiB]':>11}")
+    for snapshot in corpus.list_snapshots():
+        for backend in backends:
+            if not is_installed(backend):
+                print(f"{snapshot:<18} {backend:<12} {'not installed':>29}")
+                continue
+
+            scraper = ExamTableScraper(parser_backend=backend, mode="replay", corpus=corpus, snapshot=snapshot)
+            exams_count, exams_per_second, peak_bytes = measure(scraper, args.repeat)
+            print(f"{snapshot:<18} {backend:<12} {exams_count:>6} {exams_per_second:>10.0f} {peak_bytes / 1024:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
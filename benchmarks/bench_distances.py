@@ -0,0 +1,61 @@
+"""Compare resolving the travel distances pair by pair and in Distance Matrix blocks, sequentially and concurrently,
+against a local fake Maps API.
+
+Run with `python benchmarks/bench_distances.py` from the root of the repository.
+"""
+import argparse
+import time
+
+from loguru import logger
+from sqlmodel import Session, SQLModel, create_engine
+
+from fishing_exam_alert.distances import DistanceCache, DistanceMatrixResolver
+from fishing_exam_alert.rate_limit import TokenBucket
+from fishing_exam_alert.settings import setting
+from tests.fake_maps_api import FakeMapsApi
+
+
+def measure(resolver: DistanceMatrixResolver, pairs) -> float:
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    start = time.perf_counter()
+    with Session(engine) as session:
+        resolver.resolve(session, pairs)
+    return time.perf_counter() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--users", type=int, default=20, help="number of distinct user addresses")
+    arg_parser.add_argument("--exams", type=int, default=30, help="number of distinct exam addresses")
+    arg_parser.add_argument("--latency", type=float, default=0.02, help="latency of the fake API in seconds")
+    args = arg_parser.parse_args()
+
+    logger.disable("fishing_exam_alert")
+    setting.DISTANCE_THRESHOLD = 10**9  # don't notify the admin about the fake distances
+    fake_maps_api = FakeMapsApi(latency_seconds=args.latency)
+    pairs = {(f"{80000 + i}, Deutschland", f"Prüfungsort {j}") for i in range(args.users) for j in range(args.exams)}
+
+    print(f"{'mode':<20} {'pairs':>6} {'requests':>9} {'seconds':>8}")
+    for name, max_workers, block_size in (
+        ("per pair", 1, 1),
+        ("per pair, threads", setting.GMAP_MAX_WORKERS, 1),
+        ("batched", 1, None),
+        ("batched, threads", setting.GMAP_MAX_WORKERS, None),
+    ):
+        resolver = DistanceMatrixResolver(
+            client=fake_maps_api.get_client(),
+            cache=DistanceCache(),
+            rate_limiter=TokenBucket(rate=setting.GMAP_QUERIES_PER_SECOND),
+            max_workers=max_workers,
+        )
+        if block_size:
+            resolver.max_origins = resolver.max_destinations = resolver.max_elements = block_size
+        seconds = measure(resolver, pairs)
+        print(f"{name:<20} {len(pairs):>6} {resolver.requests_count:>9} {seconds:>8.2f}")
+
+    fake_maps_api.shutdown()
+
+
+if __name__ == "__main__":
+    main()
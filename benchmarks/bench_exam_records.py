@@ -0,0 +1,61 @@
+"""Compare the cost of building the scraped exams as `ExamRecord` tuples and as validated `Exam` models.
+
+Run with `python benchmarks/bench_exam_records.py` from the root of the repository.
+"""
+import argparse
+import timeit
+import tracemalloc
+from datetime import datetime
+
+from fishing_exam_alert.models import District, Exam, ExamRecord
+
+EXAM_VALUES = dict(
+    exam_id="4711",
+    name="BFZ Bayreuth",
+    street="Hauptstraße",
+    street_number="12",
+    city="Bayreuth",
+    postal_code="95444",
+    district=District.Oberfranken,
+    exam_start=datetime(2023, 2, 19, 14, 15),
+    min_participants=10,
+    max_participants=40,
+    current_participants=27,
+    status="Frei",
+    disabled_access=True,
+    headphones=False,
+)
+
+
+def build_records(count: int):
+    return [ExamRecord(**EXAM_VALUES) for _ in range(count)]
+
+
+def build_models(count: int):
+    return [Exam(**EXAM_VALUES) for _ in range(count)]
+
+
+def measure_peak_bytes(build, count: int) -> int:
+    tracemalloc.start()
+    exams = build(count)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del exams
+    return peak_bytes
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--count", type=int, default=10_000, help="number of exams per measurement")
+    arg_parser.add_argument("--repeat", type=int, default=5, help="number of measurements (the best one is reported)")
+    args = arg_parser.parse_args()
+
+    print(f"{'type':<12} {'per exam [µs]':>14} {'peak [KiB]':>11}")
+    for name, build in (("ExamRecord", build_records), ("Exam", build_models)):
+        seconds = min(timeit.repeat(lambda: build(args.count), repeat=args.repeat, number=1))
+        peak_bytes = measure_peak_bytes(build, args.count)
+        print(f"{name:<12} {seconds / args.count * 1e6:>14.2f} {peak_bytes / 1024:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
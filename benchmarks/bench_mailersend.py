@@ -0,0 +1,52 @@
+"""Compare the messages per second of one mailersend request per mail with the bulk sending.
+
+The mails are sent to the local fake mailersend API. Run with `python benchmarks/bench_mailersend.py` from the
+root of the repository.
+"""
+import argparse
+import time
+
+from loguru import logger
+
+from fishing_exam_alert import notifier
+from fishing_exam_alert.settings import setting
+from tests.fake_mailersend_api import FakeMailersendApi
+
+
+def send_per_mail(mails_count: int) -> None:
+    for i in range(mails_count):
+        notifier.send_mail_with_mailersend(f"user{i}@example.com", "Test", "Test " * 200, "<p>Test</p>" * 200)
+
+
+def send_bulk(mails_count: int) -> None:
+    batch = notifier.MailersendBatch(poll_interval_seconds=0.01)
+    for i in range(mails_count):
+        batch.add(f"user{i}@example.com", "Test", "Test " * 200, "<p>Test</p>" * 200)
+    batch.flush()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--mails", type=int, default=1000, help="number of mails")
+    arg_parser.add_argument("--latency", type=float, default=0.02, help="latency of the fake API in seconds")
+    args = arg_parser.parse_args()
+
+    logger.disable("fishing_exam_alert")
+    fake_mailersend_api = FakeMailersendApi(latency_seconds=args.latency)
+    setting.MAILERSEND_API_BASE = fake_mailersend_api.api_base
+
+    print(f"{'mode':<10} {'mails':>6} {'requests':>9} {'seconds':>8} {'mails/s':>8}")
+    for name, send in (("per mail", send_per_mail), ("bulk", send_bulk)):
+        fake_mailersend_api.clear()
+        start = time.perf_counter()
+        send(args.mails)
+        seconds = time.perf_counter() - start
+        assert len(fake_mailersend_api.sent) == args.mails
+        requests_count = len(fake_mailersend_api.requests)
+        print(f"{name:<10} {args.mails:>6} {requests_count:>9} {seconds:>8.2f} {args.mails / seconds:>8.0f}")
+
+    fake_mailersend_api.shutdown()
+
+
+if __name__ == "__main__":
+    main()
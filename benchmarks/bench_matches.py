@@ -0,0 +1,71 @@
+"""Compare a full rematch of all users with the incremental update of the materialized `user_exam_match` rows.
+
+Run with `python benchmarks/bench_matches.py` from the root of the repository.
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from faker import Faker
+from loguru import logger
+from sqlmodel import Session, SQLModel, create_engine
+
+from fishing_exam_alert import matching, models
+from tests.utils import get_random_exam, get_random_user
+
+
+def measure(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--users", type=int, default=5000, help="number of active users")
+    arg_parser.add_argument("--exams", type=int, default=200, help="number of free exams")
+    args = arg_parser.parse_args()
+
+    logger.disable("fishing_exam_alert")
+    random.seed(0)
+    Faker.seed(0)
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        # users without a max. travel duration, so no Maps API is needed
+        users = [
+            get_random_user(email=f"user{i}@example.com", postal_code="80331", active=True) for i in range(args.users)
+        ]
+        for user in users:
+            user.max_travel_duration = 0
+        session.add_all(users)
+        exam_start = datetime.utcnow() + timedelta(days=7)
+        exams = [
+            get_random_exam(exam_id=str(i), postal_code="80331", status="Frei", exam_start=exam_start)
+            for i in range(args.exams)
+        ]
+        session.add_all(exams)
+        session.commit()
+        # loaded in a session of their own like in `main.run`, so the commits of the updates don't expire them
+        users = models.User.get_multi_by_active(session, active=True)
+        exams = models.Exam.get_multi(session)
+
+    with Session(engine) as session:
+        print(f"{'step':<40} {'seconds':>8}")
+        matched_exams, seconds = measure(matching.match_users, session, users)
+        print(f"{'full rematch (match_users)':<40} {seconds:>8.3f}")
+        _, seconds = measure(matching.update_matches, session, users)
+        print(f"{'full rebuild of user_exam_match':<40} {seconds:>8.3f}")
+        _, seconds = measure(matching.update_matches, session, users, exams=exams[:1], reset_notified=True)
+        print(f"{'update for 1 changed exam':<40} {seconds:>8.3f}")
+        _, seconds = measure(matching.update_matches, session, users[:1])
+        print(f"{'update for 1 changed user':<40} {seconds:>8.3f}")
+        user_ids, seconds = measure(models.UserExamMatch.get_pending_user_ids, session)
+        print(f"{f'read {len(user_ids)} pending users':<40} {seconds:>8.3f}")
+        _, seconds = measure(matching.get_user_matches, session, users[0])
+        print(f"{'read the matches of 1 user':<40} {seconds:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
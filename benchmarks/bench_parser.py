@@ -0,0 +1,49 @@
+"""Compare the HTML parser backends of the exam scraper.
+
+Run with `python benchmarks/bench_parser.py` from the root of the repository.
+"""
+import argparse
+import importlib.util
+import os
+import timeit
+
+from fishing_exam_alert.parser import PARSER_BACKENDS, get_exam_parser
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "..", "tests", "fixtures")
+
+
+def read_fixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURES_DIR, name), "rb") as f:
+        return f.read()
+
+
+def is_installed(backend: str) -> bool:
+    optional_backends = ["lxml", "selectolax"]
+    return backend not in optional_backends or importlib.util.find_spec(backend) is not None
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--number", type=int, default=50, help="number of parses per measurement")
+    arg_parser.add_argument("--repeat", type=int, default=5, help="number of measurements (the best one is reported)")
+    args = arg_parser.parse_args()
+
+    overview_content = read_fixture("exam_overview.html")
+    detail_content = read_fixture("exam_detail.html")
+
+    print(f"{'backend':<12} {'overview [ms]':>14} {'detail [ms]':>12}")
+    for backend in PARSER_BACKENDS:
+        if not is_installed(backend):
+            print(f"{backend:<12} {'not installed':>27}")
+            continue
+
+        parser = get_exam_parser(backend)
+        timer_overview = timeit.Timer(lambda: parser.extract_overview_table(overview_content))
+        timer_detail = timeit.Timer(lambda: parser.extract_detail_tables(detail_content))
+        overview_ms = min(timer_overview.repeat(repeat=args.repeat, number=args.number)) / args.number * 1000
+        detail_ms = min(timer_detail.repeat(repeat=args.repeat, number=args.number)) / args.number * 1000
+        print(f"{backend:<12} {overview_ms:>14.2f} {detail_ms:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
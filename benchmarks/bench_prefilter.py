@@ -0,0 +1,80 @@
+"""Compare the travel distance requests of matching with and without the geographic prefilter.
+
+The exams and users are spread over Bavaria by the local fake Maps API. Run with
+`python benchmarks/bench_prefilter.py` from the root of the repository.
+"""
+import argparse
+import random
+import time
+
+from faker import Faker
+from loguru import logger
+from sqlmodel import Session, SQLModel, create_engine
+
+from fishing_exam_alert import matching, models
+from fishing_exam_alert.distances import DistanceCache, DistanceMatrixResolver
+from fishing_exam_alert.geo import Geocoder
+from fishing_exam_alert.settings import setting
+from tests.fake_maps_api import FakeMapsApi
+from tests.utils import create_random_exam, get_random_user
+
+
+def measure(fake_maps_api: FakeMapsApi, geocoder: Geocoder, users, exams_count: int, max_speed_kmh: int):
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    setting.PREFILTER_MAX_SPEED_KMH = max_speed_kmh
+    resolver = DistanceMatrixResolver(client=fake_maps_api.get_client(), cache=DistanceCache())
+    geocodings_count = geocoder.requests_count
+
+    with Session(engine) as session:
+        random.seed(0)  # the same exams for each run
+        Faker.seed(0)
+        for i in range(exams_count):
+            create_random_exam(session, exam_id=str(i), street=f"Prüfungsweg {i}", status="Frei", district=None)
+        fake_maps_api.requests.clear()
+
+        start = time.perf_counter()
+        matched_exams = matching.match_users(session, users, resolver=resolver, geocoder=geocoder)
+        seconds = time.perf_counter() - start
+
+    elements = sum(
+        len(request["origins"]) * len(request["destinations"])
+        for request in fake_maps_api.requests
+        if "origins" in request
+    )
+    matches = sum(len(user_exams) for user_exams in matched_exams.values())
+    return elements, resolver.requests_count, geocoder.requests_count - geocodings_count, matches, seconds
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--users", type=int, default=100, help="number of users with a max. travel duration")
+    arg_parser.add_argument("--exams", type=int, default=60, help="number of free exams")
+    arg_parser.add_argument("--latency", type=float, default=0.02, help="latency of the fake API in seconds")
+    args = arg_parser.parse_args()
+
+    logger.disable("fishing_exam_alert")
+    setting.DISTANCE_THRESHOLD = 10**9  # don't notify the admin about the fake distances
+    fake_maps_api = FakeMapsApi(latency_seconds=args.latency)
+    all_districts = ",".join(models.District)
+    users = [
+        get_random_user(
+            id=i, postal_code=str(80000 + i * 97), max_travel_duration=30, districts=all_districts, active=True
+        )
+        for i in range(args.users)
+    ]
+
+    # the addresses are geocoded once by the first run with the prefilter
+    geocoder = Geocoder(client=fake_maps_api.get_client(), centroids={})
+    print(f"{'prefilter':<10} {'elements':>9} {'matrix requests':>16} {'geocodings':>11} {'matches':>8} {'seconds':>8}")
+    for name, max_speed_kmh in (("off", 0), ("on", 130), ("on again", 130)):
+        elements, matrix_requests, geocodings, matches, seconds = measure(
+            fake_maps_api, geocoder, users, args.exams, max_speed_kmh
+        )
+        print(f"{name:<10} {elements:>9} {matrix_requests:>16} {geocodings:>11} {matches:>8} {seconds:>8.2f}")
+
+    fake_maps_api.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Compare the notification mails rendered per second with pandas per mail and with the cached exam fragments.
+
+Each user matched a few exams of a shared pool, with travel columns. Run with `python benchmarks/bench_render.py`
+from the root of the repository.
+"""
+import argparse
+import random
+import time
+from urllib.parse import quote_plus
+
+import pandas as pd
+
+from fishing_exam_alert import matching
+from fishing_exam_alert.render import MailRenderer
+from tests.utils import get_random_exam
+
+
+def transform_db_dataframe_for_mail(df: pd.DataFrame) -> pd.DataFrame:
+    """The former transformation of the matches into the German table of the mail."""
+    transformed_df = df.copy()
+    german_mapping = {
+        "exam_id": "Prüfungs-Nr",
+        "name": "Prüfungslokal",
+        "address_line": "Adresse",
+        "district": "Regierungsbezirk",
+        "exam_start_german_time": "Prüfungsbeginn",
+        "min_participants": "Min. Teilnehmer",
+        "participants": "Belegte Plätze",  # calculated row in this func
+        "status": "Status",
+        "disabled_access": "Behindertengerecht",
+        "headphones": "Kopfhörer",
+        "address_line": "Adresse",
+        "travel_duration_in_min": "Entfernung Fahrzeit [min]",  # calculated row in this func
+        "travel_distance_in_km": "Entfernung [km]",  # calculated row in this func
+        "directions_url": "Route",  # calculated row in this func
+    }
+    if "travel_duration" in transformed_df:  # transform duration from second to minute
+        transformed_df["travel_duration_in_min"] = transformed_df["travel_duration"].apply(lambda x: int(x / 60))
+    if "travel_distance" in transformed_df:  # transform distance from meter to kilometer
+        transformed_df["travel_distance_in_km"] = transformed_df["travel_distance"].apply(lambda x: int(x / 1000))
+
+    # combine participant occupancy to one column
+    transformed_df["participants"] = transformed_df.apply(
+        lambda row: f"{row.current_participants} / {row.max_participants}", axis=1
+    )
+
+    # create directions link
+    if "start_address_line" in transformed_df and "address_line" in transformed_df:
+        transformed_df["directions_url"] = transformed_df.apply(
+            lambda row: f"https://www.google.com/maps/dir/{quote_plus(row.start_address_line)}/{quote_plus(row.address_line)}",
+            axis=1,
+        )
+
+    # transform datetime
+    transformed_df["exam_start_german_time"] = transformed_df["exam_start"].dt.strftime("%d.%m.%Y %H:%M")
+
+    # drop all columns that are not translated
+    cols_to_drop = list(set(transformed_df) - set(german_mapping))
+    transformed_df.drop(cols_to_drop, axis=1, inplace=True)
+
+    # rename the columns
+    transformed_df.rename(columns=german_mapping, inplace=True)
+
+    # reorder the columns
+    cols_to_reorder = list(set(german_mapping.values()) & set(transformed_df))
+    transformed_df = transformed_df[cols_to_reorder]
+
+    return transformed_df
+
+
+def render_with_pandas(email_to, exams):
+    exams = transform_db_dataframe_for_mail(exams)
+    subject = f"Fischerprüfung Updates - Es gibt {len(exams)} freie Termine!"
+    return subject, exams.to_string(), exams.to_html(render_links=True, col_space=100)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--users", type=int, default=5000, help="number of users")
+    arg_parser.add_argument("--exams", type=int, default=50, help="number of exams in the pool")
+    arg_parser.add_argument("--matches", type=int, default=5, help="number of matched exams per user")
+    args = arg_parser.parse_args()
+
+    random.seed(0)
+    pool = matching.get_exams_dataframe(
+        [get_random_exam(id=i + 1, exam_id=str(i), postal_code="95444", status="Frei") for i in range(args.exams)]
+    )
+    mails = list()
+    for i in range(args.users):
+        exams = pool.sample(n=args.matches, random_state=i).reset_index(drop=True)
+        exams["start_address_line"] = "80331, Deutschland"
+        exams["travel_duration"] = [random.randint(600, 7200) for _ in range(args.matches)]
+        exams["travel_distance"] = [random.randint(5000, 150000) for _ in range(args.matches)]
+        mails.append((f"user{i}@example.com", exams))
+
+    print(f"{'mode':<10} {'mails':>6} {'seconds':>8} {'mails/s':>8}")
+    for name, render in (("pandas", render_with_pandas), ("fragments", MailRenderer().render)):
+        start = time.perf_counter()
+        for email_to, exams in mails:
+            render(email_to, exams)
+        seconds = time.perf_counter() - start
+        print(f"{name:<10} {len(mails):>6} {seconds:>8.2f} {len(mails) / seconds:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
 from loguru import logger
+from sqlmodel import Session
 
-from fishing_exam_alert.models import GSheetTable
+from fishing_exam_alert import db
+from fishing_exam_alert.distances import get_failing_addresses_report
+from fishing_exam_alert.models import Distance, GSheetTable
 from fishing_exam_alert.notifier import send_confirmation_mail, send_mail
 from fishing_exam_alert.settings import setting
 
@@ -17,6 +20,12 @@ def send_test_mail(subject: str = "") -> None:
         send_mail(setting.NOTIFY_MAIL_FROM, "Test", "Test")
 
 
+def get_failing_distances_report() -> str:
+    with Session(db.engine) as session:
+        failing_distances = Distance.get_multi_failing(session)
+        return get_failing_addresses_report(failing_distances)
+
+
 if __name__ == "__main__":
     logger.info("Check access to GSheet...", end="")
     gsheet_len = get_length_of_gsheet()
@@ -30,3 +39,5 @@ if __name__ == "__main__":
     test_filters = {"Teilnehmer": "Frei", "Regierungsbezirk": ["Oberbayern"]}
     send_confirmation_mail(setting.NOTIFY_MAIL_FROM, test_filters)
     logger.info("Done!")
+
+    logger.info(f"Address pairs whose last lookups failed:\n{get_failing_distances_report() or 'None'}")
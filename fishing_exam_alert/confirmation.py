@@ -2,7 +2,7 @@ import time
 
 from loguru import logger
 
-from fishing_exam_alert import db, models, notifier
+from fishing_exam_alert import migrations, models, notifier
 from fishing_exam_alert.settings import setting
 
 
@@ -36,7 +36,7 @@ def main():
 
 
 if __name__ == "__main__":
-    db.SQLModel.metadata.create_all(db.engine)  # init db
+    migrations.init_db()
     while True:
         main()
         logger.info(f"Sleep for {setting.CONFIRMATION_INTERVAL_SECONDS} seconds...")
@@ -0,0 +1,78 @@
+import gzip
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from typing import IO, List, Optional, Tuple
+
+from loguru import logger
+
+from fishing_exam_alert.settings import setting
+
+
+class ExamPageCorpus:
+    """A compressed on-disk corpus of scraped (overview, detail) page pairs.
+
+    Every snapshot is a directory named by the time of recording that contains the gzipped pages:
+
+        <corpus_dir>/<snapshot>/overview.html.gz
+        <corpus_dir>/<snapshot>/detail.html.gz
+    """
+
+    page_names = ("overview", "detail")
+    page_suffix = ".html.gz"
+    snapshot_name_format = "%Y%m%dT%H%M%S"
+
+    def __init__(self, corpus_dir: Optional[str] = None):
+        self.corpus_dir = corpus_dir or setting.EXAM_CORPUS_DIR
+
+    def list_snapshots(self) -> List[str]:
+        """Get the names of all complete snapshots, the oldest first."""
+        if not os.path.isdir(self.corpus_dir):
+            return list()
+
+        return sorted(
+            name
+            for name in os.listdir(self.corpus_dir)
+            if all(os.path.isfile(self._get_page_path(name, page_name)) for page_name in self.page_names)
+        )
+
+    def get_latest_snapshot(self) -> str:
+        snapshots = self.list_snapshots()
+        if not snapshots:
+            raise FileNotFoundError(f"There are no snapshots in the corpus {self.corpus_dir}!")
+        return snapshots[-1]
+
+    def save_snapshot(self, overview_page: IO[bytes], detail_page: IO[bytes], name: Optional[str] = None) -> str:
+        """Save the pages as a new snapshot and return its name. The pages are copied chunk by chunk."""
+        name = name or datetime.utcnow().strftime(self.snapshot_name_format)
+        snapshot_dir = os.path.join(self.corpus_dir, name)
+        os.makedirs(snapshot_dir, exist_ok=True)
+
+        for page_name, page in zip(self.page_names, (overview_page, detail_page)):
+            page.seek(0)
+            with gzip.open(self._get_page_path(name, page_name), "wb") as f:
+                shutil.copyfileobj(page, f)
+            page.seek(0)
+
+        logger.info(f"Recorded exam pages to {snapshot_dir}")
+        return name
+
+    def open_snapshot(self, name: Optional[str] = None) -> Tuple[IO[bytes], IO[bytes]]:
+        """Get the (overview, detail) pages of a snapshot (by default the latest one) as temporary files."""
+        name = name or self.get_latest_snapshot()
+        logger.info(f"Replay exam pages from {os.path.join(self.corpus_dir, name)}")
+
+        pages = list()
+        for page_name in self.page_names:
+            page = tempfile.SpooledTemporaryFile(max_size=setting.EXAM_PAGE_MAX_MEMORY_BYTES)
+            with gzip.open(self._get_page_path(name, page_name), "rb") as f:
+                shutil.copyfileobj(f, page)
+            page.seek(0)
+            pages.append(page)
+
+        overview_page, detail_page = pages
+        return overview_page, detail_page  # type: ignore # SpooledTemporaryFile behaves like IO[bytes]
+
+    def _get_page_path(self, name: str, page_name: str) -> str:
+        return os.path.join(self.corpus_dir, name, page_name + self.page_suffix)
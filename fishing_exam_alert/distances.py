@@ -0,0 +1,318 @@
+import itertools
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import googlemaps
+import sqlmodel
+from loguru import logger
+
+from fishing_exam_alert import models, utils
+from fishing_exam_alert.quota import QuotaManager, quota_manager
+from fishing_exam_alert.rate_limit import TokenBucket, maps_rate_limiter
+from fishing_exam_alert.settings import setting
+
+AddressPair = Tuple[str, str]  # (start address, end address)
+Priority = Tuple[int, ...]  # lower values are resolved first, e.g. (days until the exam starts, candidates of the user)
+
+
+class TravelDistance(NamedTuple):
+    distance: int  # in meters
+    duration: int  # in seconds
+
+
+class DistanceCache:
+    """An in-process LRU cache of the resolved distances by normalized address pair.
+
+    It serves the repeated lookups of a run (and of the following runs) without touching the database. `hits` and
+    `misses` are counted to size it (DISTANCE_CACHE_SIZE).
+    """
+
+    def __init__(self, maxsize: int = setting.DISTANCE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[AddressPair, TravelDistance]" = OrderedDict()
+
+    def get(self, pair: AddressPair) -> Optional[TravelDistance]:
+        travel_distance = self._entries.get(pair)
+        if travel_distance is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(pair)
+        return travel_distance
+
+    def put(self, pair: AddressPair, travel_distance: TravelDistance) -> None:
+        self._entries[pair] = travel_distance
+        self._entries.move_to_end(pair)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "maxsize": self.maxsize}
+
+
+distance_cache = DistanceCache()
+
+
+class DistanceMatrixResolver:
+    """Resolves the distances of many address pairs with as few Distance Matrix requests as possible.
+
+    The addresses are normalized. The pairs are looked up in the in-process cache first, then in the database;
+    the missing pairs are requested in blocks of origins x destinations within the limits of the Distance Matrix
+    API and the results are written back as `Distance` rows in bulk.
+
+    The blocks are requested concurrently by `max_workers` threads that share a token bucket matched to the
+    quota of the API key. Only the calling thread touches the database, so the writes stay serialized.
+    """
+
+    # limits of the Distance Matrix API per request
+    max_origins = 25
+    max_destinations = 25
+    max_elements = 100
+
+    def __init__(
+        self,
+        client: Optional[googlemaps.Client] = None,
+        cache: Optional[DistanceCache] = None,
+        rate_limiter: Optional[TokenBucket] = None,
+        max_workers: int = setting.GMAP_MAX_WORKERS,
+        quota: Optional[QuotaManager] = None,
+    ):
+        self.client = client
+        self.cache = cache if cache is not None else distance_cache
+        self.rate_limiter = rate_limiter if rate_limiter is not None else maps_rate_limiter
+        self.quota = quota if quota is not None else quota_manager
+        self.max_workers = max_workers
+        self.requests_count = 0
+
+    def resolve(
+        self,
+        db: sqlmodel.Session,
+        pairs: Iterable[AddressPair],
+        priorities: Optional[Dict[AddressPair, Priority]] = None,
+    ) -> Dict[AddressPair, TravelDistance]:
+        """Get the distances of the pairs. Pairs without a route or whose lookup failed are left out.
+
+        Failed lookups are saved with their error class and skipped until its TTL expired (see
+        `Distance.is_failure_cached`), so a failing pair neither costs requests nor aborts the matching.
+        If the daily budget of the quota manager doesn't cover all missing pairs, the pairs with the lowest
+        priority (default: last) are deferred to the next run and left out as well.
+        """
+        keys = {pair: (utils.normalize_address(pair[0]), utils.normalize_address(pair[1])) for pair in set(pairs)}
+
+        travel_distances: Dict[AddressPair, TravelDistance] = dict()
+        missing_keys = set()
+        for key in set(keys.values()):
+            travel_distance = self.cache.get(key)
+            if travel_distance is None:
+                missing_keys.add(key)
+            else:
+                travel_distances[key] = travel_distance
+
+        if missing_keys:
+            saved_distances = {
+                (distance.start_address, distance.end_address): distance
+                for distance in models.Distance.get_multi_by_addresses(db, missing_keys)
+            }
+            failed_keys = set()
+            for key, distance in saved_distances.items():
+                if distance.duration is not None:
+                    travel_distances[key] = TravelDistance(distance=distance.distance, duration=distance.duration)
+                elif distance.is_failure_cached():
+                    failed_keys.add(key)
+            if failed_keys:
+                logger.debug(f"Skip {len(failed_keys)} address pairs whose lookup failed recently")
+
+            unresolved_keys = missing_keys - set(travel_distances) - failed_keys
+            if unresolved_keys:
+                key_priorities: Dict[AddressPair, Priority] = dict()
+                for pair, priority in (priorities or dict()).items():
+                    key = keys.get(pair)
+                    if key is not None:
+                        key_priorities[key] = min(priority, key_priorities.get(key, priority))
+                ordered_keys = sorted(
+                    unresolved_keys, key=lambda key: (key not in key_priorities, key_priorities.get(key, ()), key)
+                )
+
+                selected_keys, blocks = self._select_within_budget(db, ordered_keys)
+                if len(selected_keys) < len(ordered_keys):
+                    logger.warning(
+                        f"Defer {len(ordered_keys) - len(selected_keys)} of {len(ordered_keys)} distance lookups "
+                        "to the next run, the daily Google Maps budget is used up"
+                    )
+                    self.quota.defer(db, len(ordered_keys) - len(selected_keys))
+                if selected_keys:
+                    self._resolve_missing(db, set(selected_keys), blocks, saved_distances, travel_distances)
+
+            for key in missing_keys & set(travel_distances):
+                self.cache.put(key, travel_distances[key])
+
+        return {pair: travel_distances[key] for pair, key in keys.items() if key in travel_distances}
+
+    def get_blocks(self, pairs: Set[AddressPair]) -> List[Tuple[List[str], List[str]]]:
+        """Split the pairs into (origins, destinations) blocks that cover exactly the pairs.
+
+        Every element of a block is billed, so the origins are grouped by their destinations and a block has no
+        elements that were not asked for. A full matrix of pairs still takes the fewest requests.
+        """
+        destinations_by_origin: Dict[str, Set[str]] = defaultdict(set)
+        for start_address, end_address in pairs:
+            destinations_by_origin[start_address].add(end_address)
+        origins_by_destinations: Dict[Tuple[str, ...], List[str]] = defaultdict(list)
+        for origin, destinations in destinations_by_origin.items():
+            origins_by_destinations[tuple(sorted(destinations))].append(origin)
+
+        blocks = list()
+        for destinations, origins in sorted(origins_by_destinations.items()):
+            origins.sort()
+            for i in range(0, len(destinations), self.max_destinations):
+                block_destinations = list(destinations[i : i + self.max_destinations])
+                origins_size = min(self.max_origins, self.max_elements // len(block_destinations))
+                for j in range(0, len(origins), origins_size):
+                    blocks.append((origins[j : j + origins_size], block_destinations))
+        return blocks
+
+    def _select_within_budget(
+        self, db: sqlmodel.Session, ordered_pairs: List[AddressPair]
+    ) -> Tuple[List[AddressPair], List[Tuple[List[str], List[str]]]]:
+        """Get the leading pairs whose blocks fit into the remaining budget and their blocks.
+
+        The blocks are billed by element; as they have no unneeded elements, the budget covers one pair per unit.
+        """
+        remaining = self.quota.get_remaining(db)
+        count = len(ordered_pairs) if remaining is None else min(len(ordered_pairs), remaining)
+        while count > 0:
+            blocks = self.get_blocks(set(ordered_pairs[:count]))
+            elements_count = sum(len(origins) * len(destinations) for origins, destinations in blocks)
+            if remaining is None or elements_count <= remaining:
+                return ordered_pairs[:count], blocks
+            count = min(count - 1, count * remaining // elements_count)
+        return [], []
+
+    def _resolve_missing(
+        self,
+        db: sqlmodel.Session,
+        missing_pairs: Set[AddressPair],
+        blocks: List[Tuple[List[str], List[str]]],
+        saved_distances: Dict[AddressPair, models.Distance],
+        travel_distances: Dict[AddressPair, TravelDistance],
+    ) -> None:
+        client = self.client or utils.get_gmaps_client()
+        self.quota.consume(db, sum(len(origins) * len(destinations) for origins, destinations in blocks))
+        logger.info(f"Resolve {len(missing_pairs)} distances with {len(blocks)} Distance Matrix requests...")
+
+        resolved_distances = list()
+        failed_distances = list()
+        new_distances = list()
+
+        def get_distance(pair: AddressPair) -> models.Distance:
+            distance = saved_distances.get(pair)
+            if distance is None:
+                distance = models.Distance(start_address=pair[0], end_address=pair[1])
+                new_distances.append(distance)
+            else:
+                db.add(distance)
+            return distance
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(blocks))) as executor:
+            futures = {
+                executor.submit(self._request_block, client, origins, destinations): (origins, destinations)
+                for origins, destinations in blocks
+            }
+            for future in as_completed(futures):
+                origins, destinations = futures[future]
+                self.requests_count += 1
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"Distance Matrix request for {len(origins)} x {len(destinations)} pairs failed: {e}")
+                    for pair in itertools.product(origins, destinations):
+                        if pair in missing_pairs:
+                            distance = get_distance(pair)
+                            distance.set_failure(models.DistanceErrorClass.request_failed, f"{type(e).__name__}: {e}")
+                            failed_distances.append(distance)
+                    continue
+
+                for origin, row in zip(origins, result["rows"]):
+                    for destination, element in zip(destinations, row["elements"]):
+                        pair = (origin, destination)
+                        if pair not in missing_pairs:
+                            continue
+
+                        distance = get_distance(pair)
+                        if element["status"] != "OK":
+                            distance.set_failure(models.DistanceErrorClass.no_route, element["status"])
+                            failed_distances.append(distance)
+                            continue
+
+                        distance.set_values_from_matrix_element(element)
+                        travel_distances[pair] = TravelDistance(distance=distance.distance, duration=distance.duration)
+                        resolved_distances.append(distance)
+
+        models.Distance.bulk_insert(db, new_distances)
+        db.commit()
+
+        if failed_distances:
+            errors_count = Counter(distance.error for distance in failed_distances)
+            logger.warning(
+                f"The lookup of {len(failed_distances)} address pairs failed: "
+                + ", ".join(f"{error} ({count}x)" for error, count in errors_count.most_common())
+            )
+        self._report_long_distances(resolved_distances)
+        self._report_failing_distances(failed_distances)
+
+    def _request_block(self, client: googlemaps.Client, origins: List[str], destinations: List[str]) -> dict:
+        """Request the distances of a block. Runs in a worker thread, so it must not touch the database."""
+        self.rate_limiter.acquire()
+        return client.distance_matrix(origins, destinations)  # type: ignore # distance_matrix is member of gmaps
+
+    def _report_long_distances(self, distances: List[models.Distance]) -> None:
+        long_distances = [distance for distance in distances if distance.distance > setting.DISTANCE_THRESHOLD]
+        if not long_distances:
+            return
+
+        message = (
+            f"{len(long_distances)} resolved distances exceed the threshold of {setting.DISTANCE_THRESHOLD} meters:\n"
+            + "\n".join(
+                f"{distance.start_address} -> {distance.end_address}: {distance.distance} meters"
+                for distance in long_distances
+            )
+        )
+        logger.warning(message)
+        utils.notify_admin_via_gchat(message)
+
+    def _report_failing_distances(self, distances: List[models.Distance]) -> None:
+        # report each pair once, when it failed DISTANCE_FAILURE_REPORT_COUNT times in a row
+        failing_distances = [
+            distance for distance in distances if distance.failure_count == setting.DISTANCE_FAILURE_REPORT_COUNT
+        ]
+        if not failing_distances:
+            return
+
+        message = (
+            f"The lookup of {len(failing_distances)} address pairs failed {setting.DISTANCE_FAILURE_REPORT_COUNT} "
+            f"times in a row:\n" + get_failing_addresses_report(failing_distances)
+        )
+        logger.warning(message)
+        utils.notify_admin_via_gchat(message)
+
+
+def get_failing_addresses_report(distances: List[models.Distance]) -> str:
+    """Summarize failing pairs by address; an address in many failing pairs is likely wrong."""
+    addresses_count = Counter(
+        address for distance in distances for address in (distance.start_address, distance.end_address)
+    )
+    lines = [f"{address}: {count} failing pairs" for address, count in addresses_count.most_common() if count > 1]
+    lines += [
+        f"{distance.start_address} -> {distance.end_address}: {distance.error} ({distance.failure_count} times)"
+        for distance in distances
+    ]
+    return "\n".join(lines)
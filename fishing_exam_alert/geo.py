@@ -0,0 +1,177 @@
+import csv
+import os
+import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import googlemaps
+import numpy as np
+import sqlmodel
+from loguru import logger
+
+from fishing_exam_alert import models, utils
+from fishing_exam_alert.quota import QuotaManager, quota_manager
+from fishing_exam_alert.rate_limit import TokenBucket, maps_rate_limiter
+from fishing_exam_alert.settings import setting
+
+Coordinates = Tuple[float, float]  # (latitude, longitude)
+
+EARTH_RADIUS_KM = 6371.0
+POSTAL_CODE_ADDRESS_PATTERN = re.compile(r"^(\d{5}), deutschland$")  # a normalized `User.get_address_line`
+
+
+def haversine_km(
+    latitudes_1: np.ndarray, longitudes_1: np.ndarray, latitudes_2: np.ndarray, longitudes_2: np.ndarray
+) -> np.ndarray:
+    """Get the great-circle distances in km. The arrays are broadcast against each other."""
+    latitudes_1, longitudes_1, latitudes_2, longitudes_2 = map(
+        np.radians, (latitudes_1, longitudes_1, latitudes_2, longitudes_2)
+    )
+    a = (
+        np.sin((latitudes_2 - latitudes_1) / 2) ** 2
+        + np.cos(latitudes_1) * np.cos(latitudes_2) * np.sin((longitudes_2 - longitudes_1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def load_postal_code_centroids(path: str) -> Dict[str, Coordinates]:
+    """Load the centroids of the postal codes from a GeoNames postal code file (tab-separated, without header).
+
+    Postal codes with several places get the mean of their coordinates.
+    """
+    coordinates: Dict[str, List[Coordinates]] = defaultdict(list)
+    with open(path, encoding="utf-8", newline="") as f:
+        for row in csv.reader(f, delimiter="\t"):
+            # country code, postal code, place name, 3 x (admin name, admin code), latitude, longitude, accuracy
+            coordinates[row[1]].append((float(row[9]), float(row[10])))
+
+    return {
+        postal_code: (
+            sum(latitude for latitude, _ in postal_code_coordinates) / len(postal_code_coordinates),
+            sum(longitude for _, longitude in postal_code_coordinates) / len(postal_code_coordinates),
+        )
+        for postal_code, postal_code_coordinates in coordinates.items()
+    }
+
+
+@lru_cache(maxsize=None)
+def get_postal_code_centroids() -> Dict[str, Coordinates]:
+    if not setting.PLZ_CENTROIDS_FILE:
+        return dict()
+    if not os.path.isfile(setting.PLZ_CENTROIDS_FILE):
+        logger.warning(f"PLZ_CENTROIDS_FILE {setting.PLZ_CENTROIDS_FILE} does not exist. Geocode postal codes...")
+        return dict()
+
+    centroids = load_postal_code_centroids(setting.PLZ_CENTROIDS_FILE)
+    logger.info(f"Loaded {len(centroids)} postal code centroids from {setting.PLZ_CENTROIDS_FILE}")
+    return centroids
+
+
+class Geocoder:
+    """Gets the coordinates of addresses. Every address is geocoded only once.
+
+    Addresses that consist of a postal code only are looked up in the postal code centroids. All other
+    addresses are looked up in memory, then in the `Location` table and are geocoded with Google Maps otherwise,
+    concurrently and rate-limited like the distances (see `DistanceMatrixResolver`). Addresses beyond the daily
+    budget of the quota manager are deferred to the next run and get no coordinates until then, like addresses
+    whose request failed.
+    """
+
+    def __init__(
+        self,
+        client: Optional[googlemaps.Client] = None,
+        centroids: Optional[Dict[str, Coordinates]] = None,
+        rate_limiter: Optional[TokenBucket] = None,
+        max_workers: int = setting.GMAP_MAX_WORKERS,
+        quota: Optional[QuotaManager] = None,
+    ):
+        self.client = client
+        self._centroids = centroids
+        self.rate_limiter = rate_limiter if rate_limiter is not None else maps_rate_limiter
+        self.quota = quota if quota is not None else quota_manager
+        self.max_workers = max_workers
+        self.requests_count = 0
+        self._coordinates: Dict[str, Optional[Coordinates]] = dict()
+
+    @property
+    def centroids(self) -> Dict[str, Coordinates]:
+        return self._centroids if self._centroids is not None else get_postal_code_centroids()
+
+    def geocode(self, db: sqlmodel.Session, addresses: Iterable[str]) -> Dict[str, Optional[Coordinates]]:
+        """Get the coordinates by address; None if the address can't be geocoded."""
+        keys = {address: utils.normalize_address(address) for address in set(addresses)}
+
+        missing_keys = set()
+        for key in set(keys.values()):
+            if key in self._coordinates:
+                continue
+
+            postal_code_match = POSTAL_CODE_ADDRESS_PATTERN.match(key)
+            if postal_code_match and postal_code_match.group(1) in self.centroids:
+                self._coordinates[key] = self.centroids[postal_code_match.group(1)]
+            else:
+                missing_keys.add(key)
+
+        if missing_keys:
+            self._geocode_missing(db, missing_keys)
+
+        return {address: self._coordinates.get(key) for address, key in keys.items()}
+
+    def _geocode_missing(self, db: sqlmodel.Session, missing_keys: Set[str]) -> None:
+        for location in models.Location.get_multi_by_addresses(db, missing_keys):
+            self._coordinates[location.address] = (
+                (location.latitude, location.longitude) if location.latitude is not None else None
+            )
+            missing_keys.discard(location.address)
+
+        if not missing_keys:
+            return
+
+        keys = sorted(missing_keys)
+        remaining = self.quota.get_remaining(db)
+        if remaining is not None and remaining < len(keys):
+            logger.warning(
+                f"Defer geocoding {len(keys) - remaining} of {len(keys)} addresses to the next run, "
+                "the daily Google Maps budget is used up"
+            )
+            self.quota.defer(db, len(keys) - remaining)
+            keys = keys[:remaining]
+            if not keys:
+                return
+
+        logger.info(f"Geocode {len(keys)} addresses...")
+        client = self.client or utils.get_gmaps_client()
+        new_locations = list()
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(keys))) as executor:
+            futures = {executor.submit(self._request_geocode, client, key): key for key in keys}
+            for future in as_completed(futures):
+                key = futures[future]
+                self.requests_count += 1
+                try:
+                    results = future.result()
+                except Exception as e:
+                    # neither saved nor kept, so the address is geocoded again later
+                    logger.error(f"Geocoding {key} failed: {type(e).__name__}: {e}")
+                    continue
+
+                location = models.Location(address=key)
+                if results:
+                    location.latitude = results[0]["geometry"]["location"]["lat"]
+                    location.longitude = results[0]["geometry"]["location"]["lng"]
+                else:
+                    logger.warning(f"Could not geocode {key}")
+                new_locations.append(location)
+                self._coordinates[key] = (location.latitude, location.longitude) if results else None
+
+        models.Location.bulk_insert(db, new_locations)
+        # only the successful requests are charged, in one commit with their locations; failed ones are retried
+        self.quota.consume(db, len(new_locations))  # commits the session
+
+    def _request_geocode(self, client: googlemaps.Client, key: str) -> List[dict]:
+        self.rate_limiter.acquire()
+        return client.geocode(key, region="de")  # type: ignore # geocode is member of gmaps
+
+
+geocoder = Geocoder()
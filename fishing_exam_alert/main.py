@@ -1,108 +1,180 @@
 import time
 from datetime import datetime
+from typing import List, Set
 
 import pandas as pd
 from loguru import logger
 from sqlmodel import Session
 
-from fishing_exam_alert import db, models, notifier, utils
+from fishing_exam_alert import (
+    db,
+    matching,
+    migrations,
+    models,
+    notifier,
+    outbox,
+    scheduler,
+    utils,
+)
+from fishing_exam_alert.quota import quota_manager
+from fishing_exam_alert.render import MailRenderer
 from fishing_exam_alert.settings import setting
 
+MATCHING_CHECKPOINT_KEY = "matching.last_exam_event_id"
 
-def sync_users_from_gsheet() -> None:
+
+def sync_users_from_gsheet() -> Set[str]:
+    """Sync the users from the Google Sheet. Returns the emails of the users that were created or changed."""
     gsheet = models.GSheetTable(setting.GSHEET_SPREADSHEET_ID)
     user_updates = gsheet.get_record_updates()
 
+    changed_user_emails = set()
     with Session(db.engine) as session:
         for _, row in user_updates.iterrows():
             active = row["An- oder Abmeldung?"] == "Anmeldung / Aktualisierung"
             defaults = {
                 "active": active,
-                "districts": row["Welche Bezirke kommen für dich in Frage?"],
+                "district_mask": models.District.get_mask(
+                    models.District.parse_list(row["Welche Bezirke kommen für dich in Frage?"])
+                ),
                 "max_travel_duration": int(row["Maximale Fahrzeit zur Prüfung (in Minuten)?"] or "0"),
                 "postal_code": row["Deine PLZ"],
                 "need_headphones": "Kopfhörer" in row["Welche Ausstattung soll der Prüfungsort erfüllen?"],
                 "need_disabled_access": "Behindertengerecht"
                 in row["Welche Ausstattung soll der Prüfungsort erfüllen?"],
             }
+            user = models.User.get_by_mail(session, email=row["E-Mail-Adresse"])
+            if not user or any(getattr(user, k) != v for k, v in defaults.items()):
+                changed_user_emails.add(row["E-Mail-Adresse"])
             models.User.update_or_create(session, email=row["E-Mail-Adresse"], defaults=defaults)
 
     # login to google again
     gsheet.gc.login()
 
+    return changed_user_emails
+
 
-def sync_exams() -> None:
+def sync_exams() -> bool:
+    """Sync the exams from the exam site. Returns False if the site content did not change since the last sync."""
     exam_scraper = models.ExamTableScraper()
     with Session(db.engine) as session:
+        if not exam_scraper.has_changed(session):
+            skipped_runs = exam_scraper.count_skipped_run(session)
+            logger.info(f"Exam site content did not change. Skip parsing ({skipped_runs} skipped runs in total)...")
+            return False
+
         exam_scraper.sync_exams_to_db(session)
+        exam_scraper.save_fingerprint(session)
+    return True
 
 
 def get_active_exams(db: Session, user: models.User) -> pd.DataFrame:
-    # filter the exams for the user settings
-    filtered_exams = models.Exam.get_multi(
-        db=db,
-        status="Frei",
-        exam_start__min=datetime.utcnow(),
-        districts__in=user.district_list or None,
-        disabled_access=user.need_disabled_access or None,
-        headphones=user.need_headphones or None,
-    )
-
-    # check if the user wants the exams filtered by travel duration
-    exams_for_user = list()
-    if user.max_travel_duration and user.get_address_line():
-
-        for exam in filtered_exams:
-            distance_in, _ = models.Distance.get_or_create(
-                db, start_address=user.get_address_line(), end_address=exam.get_address_line()
-            )
-            travel_duration = distance_in.get_duration(db=db)
-            travel_distance = distance_in.get_distance(db=db)
-
-            # if the duration is smaller than the user's max travel duration, add the exam to the list
-            cutoff_travel_duration_for_user_in_minutes = user.max_travel_duration + 10  # 10 minutes buffer
-            if travel_duration < cutoff_travel_duration_for_user_in_minutes * 60:  # for comparison convert to seconds
-                exams_for_user.append(
-                    exam.dict()
-                    | {
-                        "start_address_line": user.get_address_line(),
-                        "address_line": exam.get_address_line(),
-                        "travel_duration": travel_duration,
-                        "travel_distance": travel_distance,
-                    }
-                )
-    else:
-        exams_for_user = [exam.dict() | {"address_line": exam.get_address_line()} for exam in filtered_exams]
-
-    return pd.DataFrame.from_records(exams_for_user)
+    """Get the exams that match the filters of a single user. Use `matching.match_users` for several users."""
+    return matching.match_users(db, [user])[user.email]
+
+
+def notify_pending_users(db: Session) -> int:
+    """Enqueue the notifications of the users with eligible matches that were not notified yet.
+
+    Each mail is committed together with marking its matches as notified. Returns the number of notified users.
+    """
+    user_ids = models.UserExamMatch.get_pending_user_ids(db)
+    renderer = MailRenderer()  # renders each exam once for all users
+    for user_id in user_ids:
+        user = models.User.get(db, id=user_id)
+        active_exams = matching.get_user_matches(db, user)
+        logger.info(f"Notify {user.email} about {len(active_exams)} exams...")
+        notifier.notify(db, user, active_exams, renderer=renderer)
+        models.UserExamMatch.set_notified(db, user_id=user_id, exam_ids=[int(i) for i in active_exams["id"]])
+    if user_ids:
+        logger.debug(f"Rendered the mails with {renderer.misses} exam renders and {renderer.hits} cache hits")
+    return len(user_ids)
+
+
+def deliver_notifications() -> None:
+    """Send the mails of the outbox, including the retries of earlier runs."""
+    start = time.perf_counter()
+    with Session(db.engine) as session:
+        results = outbox.OutboxDelivery().drain(session)
+    if results:
+        logger.info(
+            f"Delivered the outbox in {time.perf_counter() - start:.1f} s: "
+            + ", ".join(f"{count} {status.value}" for status, count in results.items())
+        )
 
 
-def run():
-    sync_users_from_gsheet()
+def match_users_and_enqueue_notifications():
+    changed_user_emails = sync_users_from_gsheet()
     sync_exams()
 
     with Session(db.engine) as session:
+        checkpoint = models.AppState.get_value(session, key=MATCHING_CHECKPOINT_KEY)
+        exam_events = models.ExamEvent.get_since(session, last_event_id=int(checkpoint or "0"))
+        last_event_id = exam_events[-1].id if exam_events else models.ExamEvent.get_last_id(session)
+        changed_exam_ids = {event.exam_id for event in exam_events}
+        # the exams with other events than `modified` (e.g. freed seats) are notified again
+        renotified_exam_ids = {
+            event.exam_id for event in exam_events if event.event_type != models.ExamEventType.modified
+        }
+        changed_exams = models.Exam.get_multi_by_exam_ids(session, exam_ids=list(changed_exam_ids))
         active_users = models.User.get_multi_by_active(db=session, active=True)
+        # lookups deferred by the Google Maps budget or whose failure expired are retried by rematching their users;
+        # the resolver skips the failures that are still cached
+        deferred_lookups = quota_manager.pop_deferred(session)
+        unresolved_user_ids = set(models.UserExamMatch.get_unresolved_user_ids(session))
+
+    if checkpoint and not changed_user_emails and not exam_events and not unresolved_user_ids:
+        logger.info("Neither users nor exams changed since the last run. Skip matching...")
+        return
 
     if not len(active_users):
         logger.info("No active users found. Exiting run script...")
         return
 
-    for user in active_users:
+    # update the materialized matches of the changed users and exams only
+    with Session(db.engine) as session:
+        if checkpoint:
+            logger.info(
+                f"Got {len(exam_events)} exam events and {len(changed_user_emails)} changed users since last run."
+            )
+            if unresolved_user_ids:
+                logger.info(
+                    f"Retry the unresolved distances of {len(unresolved_user_ids)} users "
+                    f"({deferred_lookups} lookups were deferred)."
+                )
+            changed_users = [
+                user for user in active_users if user.email in changed_user_emails or user.id in unresolved_user_ids
+            ]
+            if changed_users:
+                matching.update_matches(session, changed_users)
+            modified_exams = [exam for exam in changed_exams if exam.exam_id not in renotified_exam_ids]
+            renotified_exams = [exam for exam in changed_exams if exam.exam_id in renotified_exam_ids]
+            if modified_exams:
+                matching.update_matches(session, active_users, exams=modified_exams)
+            if renotified_exams:
+                matching.update_matches(session, active_users, exams=renotified_exams, reset_notified=True)
+        else:
+            logger.info("No matching checkpoint found. Match all active users...")
+            matching.update_matches(session, active_users)
+
+        notified_users_count = notify_pending_users(session)
+    logger.info(f"Enqueued notifications of {notified_users_count} of {len(active_users)} active users")
+
+    # all events until here are handled
+    with Session(db.engine) as session:
+        models.AppState.set_value(session, key=MATCHING_CHECKPOINT_KEY, value=str(last_event_id))
 
-        logger.debug(f"Get exams for user {user.email}...")
-        with Session(db.engine) as session:
-            active_exams = get_active_exams(session, user)
 
-        logger.debug(f"Found {len(active_exams)} exam matches!")
-        if len(active_exams):
-            logger.info(f"Notify {user.email}...")
-            mail_friendly_exams = utils.transform_db_dataframe_for_mail(active_exams)
-            notifier.notify(user.email, mail_friendly_exams)
+def run():
+    start = time.perf_counter()
+    match_users_and_enqueue_notifications()
+    logger.info(f"Matching took {time.perf_counter() - start:.1f} s")
+    deliver_notifications()
 
 
 if __name__ == "__main__":
-    db.SQLModel.metadata.create_all(db.engine)  # init db
+    migrations.init_db()
+    poll_scheduler = scheduler.PollScheduler()
     while True:
         try:
             run()
@@ -111,5 +183,7 @@ if __name__ == "__main__":
             utils.notify_admin_via_gchat(f"<users/all> An error occurred:\n\n{e}")
             raise e
 
-        logger.info(f"Sleeping for {setting.RUN_INTERVAL_MINUTES} minutes...")
-        time.sleep(60 * setting.RUN_INTERVAL_MINUTES)  # sleep in seconds
+        with Session(db.engine) as session:
+            interval = poll_scheduler.get_next_interval(session)
+        logger.info(f"Sleeping for {interval.total_seconds() / 60:.0f} minutes...")
+        time.sleep(interval.total_seconds())
@@ -0,0 +1,287 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import sqlmodel
+from loguru import logger
+
+from fishing_exam_alert import geo, models
+from fishing_exam_alert.distances import (
+    AddressPair,
+    DistanceMatrixResolver,
+    TravelDistance,
+)
+from fishing_exam_alert.settings import setting
+
+EXAM_COLUMNS = list(models.Exam.__fields__)
+TRAVEL_DURATION_BUFFER_MINUTES = 10  # added to the max. travel duration of the users
+
+
+def get_exams_dataframe(exams: List[models.Exam]) -> pd.DataFrame:
+    """Get the exams as rows with their address line and district bit."""
+    exams_df = pd.DataFrame.from_records([exam.dict() for exam in exams], columns=EXAM_COLUMNS)
+    exams_df["address_line"] = [exam.get_address_line() for exam in exams]
+    exams_df["district_bit"] = np.array([models.District(exam.district).bit for exam in exams], dtype=np.int64)
+    return exams_df
+
+
+def get_users_dataframe(users: List[models.User]) -> pd.DataFrame:
+    """Get the exam filters of the users as columns: the district mask and the equipment needs."""
+    users_df = pd.DataFrame({"district_mask": np.array([user.district_mask for user in users], dtype=np.int64)})
+    users_df["need_headphones"] = np.array([bool(user.need_headphones) for user in users], dtype=bool)
+    users_df["need_disabled_access"] = np.array([bool(user.need_disabled_access) for user in users], dtype=bool)
+    return users_df
+
+
+def get_eligibility_matrix(users_df: pd.DataFrame, exams_df: pd.DataFrame) -> np.ndarray:
+    """Get a boolean matrix of shape (users, exams) that is True where the exam passes the filters of the user.
+
+    The exams must already be free and in the future.
+    """
+    # a user without districts (mask 0) accepts all districts
+    district_masks = users_df["district_mask"].to_numpy(dtype=np.int64)[:, np.newaxis]
+    eligible = (district_masks == 0) | (district_masks & exams_df["district_bit"].to_numpy(dtype=np.int64) != 0)
+
+    need_headphones = users_df["need_headphones"].to_numpy(dtype=bool)[:, np.newaxis]
+    need_disabled_access = users_df["need_disabled_access"].to_numpy(dtype=bool)[:, np.newaxis]
+    eligible &= ~need_headphones | exams_df["headphones"].to_numpy(dtype=bool)[np.newaxis, :]
+    eligible &= ~need_disabled_access | exams_df["disabled_access"].to_numpy(dtype=bool)[np.newaxis, :]
+    return eligible
+
+
+def get_reachable_matrix(
+    db: sqlmodel.Session, users: List[models.User], exams_df: pd.DataFrame, geocoder: geo.Geocoder
+) -> np.ndarray:
+    """Get a boolean matrix of shape (users, exams) that is False where the exam is too far away for the user.
+
+    An exam is too far away if even the straight-line distance can't be travelled within the max. travel duration
+    at PREFILTER_MAX_SPEED_KMH. Pairs with unknown coordinates are kept.
+    """
+    user_address_lines = [user.get_address_line() for user in users]
+    coordinates = geocoder.geocode(db, set(user_address_lines) | set(exams_df["address_line"]))
+    unknown_coordinates = (np.nan, np.nan)
+    user_coordinates = np.array(
+        [coordinates[address_line] or unknown_coordinates for address_line in user_address_lines], dtype=float
+    ).reshape(-1, 2)
+    exam_coordinates = np.array(
+        [coordinates[address_line] or unknown_coordinates for address_line in exams_df["address_line"]], dtype=float
+    ).reshape(-1, 2)
+
+    distances_km = geo.haversine_km(
+        user_coordinates[:, 0, np.newaxis],
+        user_coordinates[:, 1, np.newaxis],
+        exam_coordinates[np.newaxis, :, 0],
+        exam_coordinates[np.newaxis, :, 1],
+    )
+    max_travel_minutes = np.array([user.max_travel_duration for user in users], dtype=float)
+    max_distances_km = setting.PREFILTER_MAX_SPEED_KMH * (max_travel_minutes + TRAVEL_DURATION_BUFFER_MINUTES) / 60
+    return np.isnan(distances_km) | (distances_km <= max_distances_km[:, np.newaxis])
+
+
+def is_within_travel_duration(user: models.User, travel_distance: TravelDistance) -> bool:
+    """Whether the travel duration is within the max. travel duration of the user plus the buffer."""
+    cutoff_travel_duration_for_user_in_minutes = user.max_travel_duration + TRAVEL_DURATION_BUFFER_MINUTES
+    return travel_distance.duration < cutoff_travel_duration_for_user_in_minutes * 60  # compare in seconds
+
+
+def filter_by_travel_duration(
+    user: models.User, exams_df: pd.DataFrame, distances: Dict[AddressPair, TravelDistance]
+) -> pd.DataFrame:
+    """Keep the exams within the max. travel duration of the user and add the travel columns.
+
+    Exams without a resolved distance are left out.
+    """
+    start_address_line = user.get_address_line()
+    rows = list()
+    for exam in exams_df.to_dict("records"):
+        distance_in = distances.get((start_address_line, exam["address_line"]))
+        if distance_in is None:
+            continue
+
+        if is_within_travel_duration(user, distance_in):
+            rows.append(
+                exam
+                | {
+                    "start_address_line": start_address_line,
+                    "travel_duration": distance_in.duration,
+                    "travel_distance": distance_in.distance,
+                }
+            )
+
+    return pd.DataFrame.from_records(rows)
+
+
+def has_travel_filter(user: models.User) -> bool:
+    return bool(user.max_travel_duration and user.get_address_line())
+
+
+def get_candidates(
+    db: sqlmodel.Session,
+    users: List[models.User],
+    exams: List[models.Exam],
+    geocoder: Optional[geo.Geocoder] = None,
+) -> Tuple[pd.DataFrame, np.ndarray]:
+    """Get the exams as dataframe and the (users x exams) matrix of the candidates.
+
+    The filters (district, headphones, disabled access) are evaluated as one vectorized matrix. Exams that are too
+    far away by the straight-line distance are dropped for the users with a max. travel duration.
+    """
+    exams_df = get_exams_dataframe(exams)
+    users_df = get_users_dataframe(users)
+    eligible = get_eligibility_matrix(users_df, exams_df)
+    logger.debug(f"Matched {len(users)} users against {len(exams)} exams: {eligible.sum()} eligible pairs")
+
+    # prefilter the exams of the users with a max. travel duration by the straight-line distance
+    travel_user_indices = [i for i, user in enumerate(users) if has_travel_filter(user)]
+    if travel_user_indices and len(exams) and setting.PREFILTER_MAX_SPEED_KMH:
+        travel_users = [users[i] for i in travel_user_indices]
+        reachable = get_reachable_matrix(db, travel_users, exams_df, geocoder or geo.geocoder)
+        eligible_count = eligible[travel_user_indices].sum()
+        eligible[travel_user_indices] &= reachable
+        logger.debug(f"Prefiltered {eligible_count} eligible pairs to {eligible[travel_user_indices].sum()}")
+
+    return exams_df, eligible
+
+
+def resolve_travel_distances(
+    db: sqlmodel.Session,
+    users: List[models.User],
+    exams_df: pd.DataFrame,
+    candidates: np.ndarray,
+    resolver: Optional[DistanceMatrixResolver] = None,
+) -> Dict[AddressPair, TravelDistance]:
+    """Resolve the travel distances of the candidates of the users with a max. travel duration in one batch.
+
+    If the Google Maps budget runs short, the pairs of exams that start soon and of users with few candidates
+    are resolved first (see `get_priorities`).
+    """
+    address_lines = exams_df["address_line"].to_numpy()
+    address_pairs = {
+        (user.get_address_line(), address_line)
+        for user, user_candidates in zip(users, candidates)
+        if has_travel_filter(user)
+        for address_line in address_lines[user_candidates]
+    }
+    resolver = resolver or DistanceMatrixResolver()
+    distances = (
+        resolver.resolve(db, address_pairs, priorities=get_priorities(users, exams_df, candidates))
+        if address_pairs
+        else dict()
+    )
+    logger.debug(f"Resolved {len(distances)} of {len(address_pairs)} distances (cache: {resolver.cache.get_stats()})")
+    return distances
+
+
+def get_priorities(
+    users: List[models.User], exams_df: pd.DataFrame, candidates: np.ndarray, now: Optional[datetime] = None
+) -> Dict[AddressPair, Tuple[int, int]]:
+    """Get the priority of the address pairs of the users with a max. travel duration; lower is more urgent.
+
+    A pair is ranked by the days until the exam starts, then by the number of candidates of the user, so the
+    exams that start soon and the users that have few exams to choose from are resolved first. A pair shared
+    by several users gets the most urgent priority.
+    """
+    address_lines = exams_df["address_line"].to_numpy()
+    now = now or datetime.utcnow()
+    days_until_start = np.array([(exam_start - now).days for exam_start in exams_df["exam_start"]], dtype=np.int64)
+
+    priorities: Dict[AddressPair, Tuple[int, int]] = dict()
+    for user, user_candidates in zip(users, candidates):
+        if not has_travel_filter(user):
+            continue
+        start_address_line = user.get_address_line()
+        candidates_count = int(user_candidates.sum())
+        for address_line, days in zip(address_lines[user_candidates], days_until_start[user_candidates].tolist()):
+            pair = (start_address_line, address_line)
+            priorities[pair] = min(priorities.get(pair, (days, candidates_count)), (days, candidates_count))
+    return priorities
+
+
+def match_users(
+    db: sqlmodel.Session,
+    users: List[models.User],
+    exam_start__min: Optional[datetime] = None,
+    resolver: Optional[DistanceMatrixResolver] = None,
+    geocoder: Optional[geo.Geocoder] = None,
+) -> Dict[str, pd.DataFrame]:
+    """Match the users against all free future exams at once. Returns the matched exams by the email of the user.
+
+    The exams are loaded with one query, the candidates are found by `get_candidates` and the travel durations of
+    the candidates are resolved in one batch.
+    """
+    exams = models.Exam.get_multi(db=db, status="Frei", exam_start__min=exam_start__min or datetime.utcnow())
+    exams_df, candidates = get_candidates(db, users, exams, geocoder=geocoder)
+    distances = resolve_travel_distances(db, users, exams_df, candidates, resolver=resolver)
+
+    matched_exams = dict()
+    for user, user_candidates in zip(users, candidates):
+        matched_exams[user.email] = exams_df[user_candidates].reset_index(drop=True)
+        # filter by the travel duration of the users that set one
+        if has_travel_filter(user) and len(matched_exams[user.email]):
+            matched_exams[user.email] = filter_by_travel_duration(user, matched_exams[user.email], distances)
+
+    return matched_exams
+
+
+def update_matches(
+    db: sqlmodel.Session,
+    users: List[models.User],
+    exams: Optional[List[models.Exam]] = None,
+    reset_notified: bool = False,
+    resolver: Optional[DistanceMatrixResolver] = None,
+    geocoder: Optional[geo.Geocoder] = None,
+) -> int:
+    """Recompute the `UserExamMatch` rows of the users against the exams (default: all free future exams).
+
+    Only the rows of these users and exams are replaced, so a changed user or a changed exam costs one row per
+    candidate instead of a full rematch. Taken, cancelled or past exams lose their rows. Returns the number of
+    saved candidates. The changes are committed.
+    """
+    now = datetime.utcnow()
+    exam_ids = [exam.id for exam in exams] if exams is not None else None
+    if exams is None:
+        exams = models.Exam.get_multi(db=db, status="Frei", exam_start__min=now)
+    open_exams = [exam for exam in exams if exam.status == "Frei" and exam.exam_start >= now]
+
+    exams_df, candidates = get_candidates(db, users, open_exams, geocoder=geocoder)
+    distances = resolve_travel_distances(db, users, exams_df, candidates, resolver=resolver)
+
+    rows = list()
+    address_lines = exams_df["address_line"].to_numpy()
+    ids = exams_df["id"].to_numpy()
+    for user, user_candidates in zip(users, candidates):
+        start_address_line = user.get_address_line() if has_travel_filter(user) else None
+        for exam_id, address_line in zip(ids[user_candidates].tolist(), address_lines[user_candidates]):
+            row = dict(
+                user_id=user.id,
+                exam_id=exam_id,
+                eligible=True,
+                travel_duration=None,
+                travel_distance=None,
+                start_address_line=start_address_line,
+                updated_at=now,
+            )
+            if start_address_line:
+                travel_distance = distances.get((start_address_line, address_line))
+                row["eligible"] = travel_distance is not None and is_within_travel_duration(user, travel_distance)
+                if travel_distance is not None:
+                    row["travel_duration"], row["travel_distance"] = travel_distance.duration, travel_distance.distance
+            rows.append(row)
+
+    user_ids = [user.id for user in users]
+    models.UserExamMatch.replace(db, rows, user_ids, exam_ids=exam_ids, reset_notified=reset_notified)
+    db.commit()
+    logger.debug(f"Saved {len(rows)} candidates of {len(users)} users and {len(open_exams)} exams")
+    return len(rows)
+
+
+def get_user_matches(db: sqlmodel.Session, user: models.User, now: Optional[datetime] = None) -> pd.DataFrame:
+    """Get the eligible free future exams of the user from the `UserExamMatch` rows, like `match_users` does."""
+    rows = models.UserExamMatch.get_eligible_by_user(db, user_id=user.id, now=now)  # type: ignore
+    exams_df = get_exams_dataframe([exam for _, exam in rows])
+    if has_travel_filter(user) and rows:
+        exams_df["start_address_line"] = [match.start_address_line for match, _ in rows]
+        exams_df["travel_duration"] = [match.travel_duration for match, _ in rows]
+        exams_df["travel_distance"] = [match.travel_distance for match, _ in rows]
+    return exams_df
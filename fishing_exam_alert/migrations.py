@@ -0,0 +1,179 @@
+"""Schema changes for existing databases.
+
+`SQLModel.metadata.create_all` only creates missing tables, so changes to existing tables
+(e.g. new indexes) are applied here. Every migration must be idempotent, because all
+migrations run on every start.
+"""
+from typing import Callable, List
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from fishing_exam_alert import db, models, utils
+from fishing_exam_alert.settings import setting
+
+
+def add_unique_index_on_exam_id(connection: Connection) -> None:
+    # keep only the latest row of duplicated exams, otherwise the unique index can't be created
+    connection.execute(text("DELETE FROM exam WHERE id NOT IN (SELECT MAX(id) FROM exam GROUP BY exam_id)"))
+    connection.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_exam_exam_id ON exam (exam_id)"))
+
+
+def add_district_mask_to_user(connection: Connection) -> None:
+    # replaces the comma-separated "districts" column, which is emptied after it was migrated
+    columns = {row[1] for row in connection.execute(text('PRAGMA table_info("user")'))}
+    if "district_mask" not in columns:
+        connection.execute(text('ALTER TABLE "user" ADD COLUMN district_mask INTEGER NOT NULL DEFAULT 0'))
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_user_district_mask ON "user" (district_mask)'))
+
+    if "districts" in columns:
+        rows = connection.execute(
+            text("""SELECT id, districts FROM "user" WHERE districts IS NOT NULL AND districts != ''""")
+        )
+        for user_id, districts in rows.all():
+            district_mask = models.District.get_mask(models.District.parse_list(districts))
+            connection.execute(
+                text('UPDATE "user" SET district_mask = :district_mask, districts = NULL WHERE id = :id'),
+                {"district_mask": district_mask, "id": user_id},
+            )
+
+
+def add_unique_index_on_distance_addresses(connection: Connection) -> None:
+    index_exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'ix_distance_start_address_end_address'")
+    ).first()
+    if index_exists:
+        return
+
+    # normalize the addresses and keep only one row per pair (the latest resolved one), then create the index
+    rows = connection.execute(
+        text("SELECT id, start_address, end_address FROM distance ORDER BY duration IS NULL, id DESC")
+    ).all()
+    kept_keys = set()
+    for distance_id, start_address, end_address in rows:
+        key = (utils.normalize_address(start_address), utils.normalize_address(end_address))
+        if key in kept_keys:
+            connection.execute(text("DELETE FROM distance WHERE id = :id"), {"id": distance_id})
+            continue
+
+        kept_keys.add(key)
+        if key != (start_address, end_address):
+            connection.execute(
+                text("UPDATE distance SET start_address = :start_address, end_address = :end_address WHERE id = :id"),
+                {"start_address": key[0], "end_address": key[1], "id": distance_id},
+            )
+    connection.execute(
+        text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_distance_start_address_end_address "
+            "ON distance (start_address, end_address)"
+        )
+    )
+
+
+def add_failure_columns_to_distance(connection: Connection) -> None:
+    # failed lookups are recorded, so they are not repeated in every run
+    columns = {row[1] for row in connection.execute(text("PRAGMA table_info(distance)"))}
+    for column, definition in (
+        ("error_class", "VARCHAR(14)"),
+        ("error", "VARCHAR"),
+        ("failed_at", "DATETIME"),
+        ("failure_count", "INTEGER NOT NULL DEFAULT 0"),
+    ):
+        if column not in columns:
+            connection.execute(text(f"ALTER TABLE distance ADD COLUMN {column} {definition}"))
+
+
+def add_fingerprint_to_email_log(connection: Connection) -> None:
+    # notifications are deduplicated by the fingerprint of their exams instead of the rendered content
+    for table in ("emaillog", "outbox_message"):
+        columns = {row[1] for row in connection.execute(text(f"PRAGMA table_info({table})"))}
+        if "fingerprint" not in columns:
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN fingerprint VARCHAR"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_emaillog_fingerprint ON emaillog (fingerprint)"))
+    connection.execute(
+        text("CREATE INDEX IF NOT EXISTS ix_emaillog_user_id_created_at ON emaillog (user_id, created_at)")
+    )
+
+
+def add_bulk_email_to_outbox_message(connection: Connection) -> None:
+    # messages accepted by a mailersend bulk email are polled instead of sent again
+    columns = {row[1] for row in connection.execute(text("PRAGMA table_info(outbox_message)"))}
+    for column, definition in (("bulk_email_id", "VARCHAR"), ("bulk_email_index", "INTEGER")):
+        if column not in columns:
+            connection.execute(text(f"ALTER TABLE outbox_message ADD COLUMN {column} {definition}"))
+
+
+def add_exam_ids_to_outbox_message(connection: Connection) -> None:
+    # the matches of a dead-lettered notification are notified again
+    columns = {row[1] for row in connection.execute(text("PRAGMA table_info(outbox_message)"))}
+    if "exam_ids" not in columns:
+        connection.execute(text("ALTER TABLE outbox_message ADD COLUMN exam_ids VARCHAR"))
+
+
+def compact_distance_details(connection: Connection, batch_size: int = 500) -> None:
+    # re-encode the details by DISTANCE_DETAILS_MODE; older versions stored the full Directions response
+    if setting.DISTANCE_DETAILS_MODE == "off":
+        connection.execute(text("UPDATE distance SET details = NULL WHERE details IS NOT NULL"))
+        return
+
+    if setting.DISTANCE_DETAILS_MODE == "zlib":
+        condition = "details NOT LIKE :zlib_prefix"
+    else:
+        # summaries are flat objects of texts, so they contain no nested objects or lists
+        condition = "(details LIKE :zlib_prefix OR details LIKE '[%' OR details LIKE '%{%{%')"
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            text(
+                f"SELECT id, details FROM distance WHERE id > :last_id AND details IS NOT NULL AND {condition} "
+                "ORDER BY id LIMIT :batch_size"
+            ),
+            {"last_id": last_id, "zlib_prefix": f"{models.DISTANCE_DETAILS_ZLIB_PREFIX}%", "batch_size": batch_size},
+        ).all()
+        if not rows:
+            return
+
+        connection.execute(
+            text("UPDATE distance SET details = :details WHERE id = :id"),
+            [{"id": distance_id, "details": models.Distance.compact_details(details)} for distance_id, details in rows],
+        )
+        last_id = rows[-1][0]
+
+
+MIGRATIONS: List[Callable[[Connection], None]] = [
+    add_unique_index_on_exam_id,
+    add_district_mask_to_user,
+    add_unique_index_on_distance_addresses,
+    compact_distance_details,
+    add_failure_columns_to_distance,
+    add_fingerprint_to_email_log,
+    add_bulk_email_to_outbox_message,
+    add_exam_ids_to_outbox_message,
+]
+
+
+def migrate() -> None:
+    with db.engine.begin() as connection:
+        for migration in MIGRATIONS:
+            logger.debug(f"Apply migration {migration.__name__}...")
+            migration(connection)
+
+
+def vacuum_if_fragmented(max_free_ratio: float = 0.25) -> None:
+    """Rebuild the database file if more than `max_free_ratio` of its pages are free, e.g. after a compaction."""
+    with db.engine.connect() as connection:
+        page_count = connection.execute(text("PRAGMA page_count")).scalar()
+        free_count = connection.execute(text("PRAGMA freelist_count")).scalar()
+        if not page_count or free_count / page_count <= max_free_ratio:
+            return
+
+        logger.info(f"Vacuum the database: {free_count} of {page_count} pages are free...")
+        connection.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+
+
+def init_db() -> None:
+    """Create the missing tables, apply the migrations and reclaim the space they freed."""
+    db.SQLModel.metadata.create_all(db.engine)
+    migrate()
+    vacuum_if_fragmented()
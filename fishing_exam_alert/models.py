@@ -1,22 +1,42 @@
+import base64
 import enum
+import hashlib
 import json
 import os
-from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple
+import re
+import tempfile
+import zlib
+from datetime import datetime, timedelta
+from typing import (
+    IO,
+    Any,
+    ClassVar,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+from urllib.parse import urljoin
 
 import gspread
 import pandas as pd
-import requests
 import sqlmodel
-from bs4 import BeautifulSoup
 from gspread import Spreadsheet
 from loguru import logger
 from pandas import DataFrame
 from requests import Response
 from sqlalchemy import types
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlmodel.sql.expression import Select, SelectOfScalar
 
 from fishing_exam_alert import utils
+from fishing_exam_alert.corpus import ExamPageCorpus
+from fishing_exam_alert.parser import get_exam_parser
+from fishing_exam_alert.scraper_client import ScraperClient, scraper_client
 from fishing_exam_alert.settings import setting
 
 DIRNAME = os.path.dirname(__file__)
@@ -35,13 +55,40 @@ class District(str, enum.Enum):
     Mittelfranken = "Mittelfranken"
     Oberfranken = "Oberfranken"
 
+    @property
+    def bit(self) -> int:
+        """The bit of the district in a district mask."""
+        return DISTRICT_BITS[self]
+
+    @classmethod
+    def parse_list(cls, value: Optional[str]) -> List["District"]:
+        """Parse a comma-separated string of districts, e.g. from the Google Sheet."""
+        if not value:
+            return []
+        return [cls(d.strip()) for d in value.split(",")]
+
+    @classmethod
+    def get_mask(cls, districts: Iterable["District"]) -> int:
+        mask = 0
+        for district in districts:
+            mask |= district.bit
+        return mask
+
+    @classmethod
+    def from_mask(cls, mask: int) -> List["District"]:
+        return [district for district in cls if mask & district.bit]
+
+
+# the bits are stored in the database: only append new districts, never reorder them
+DISTRICT_BITS: Dict[District, int] = {district: 1 << i for i, district in enumerate(District)}
+
 
 class User(sqlmodel.SQLModel, table=True):
     id: Optional[int] = sqlmodel.Field(default=None, primary_key=True)
     email: str = sqlmodel.Field(sa_column=sqlmodel.Column("email", sqlmodel.String, unique=True))
     max_travel_duration: Optional[int] = sqlmodel.Field(default=None)  # in minutes
     postal_code: Optional[str] = ""
-    districts: Optional[str] = ""  # a stringified repr. of List[District]
+    district_mask: int = sqlmodel.Field(default=0, index=True)  # the bits of the districts; 0 for all districts
     need_headphones: bool = False
     need_disabled_access: bool = False
     active: bool = True
@@ -62,9 +109,7 @@ class User(sqlmodel.SQLModel, table=True):
 
     @property
     def district_list(self) -> List[District]:
-        if not self.districts:
-            return []
-        return [District(d.strip()) for d in self.districts.split(",")]
+        return District.from_mask(self.district_mask)
 
     @classmethod
     def get(cls, db: sqlmodel.Session, id: int) -> "User":
@@ -137,9 +182,13 @@ class EmailLogCategory(str, enum.Enum):
 
 
 class EmailLog(sqlmodel.SQLModel, table=True):
+    __table_args__ = (sqlmodel.Index("ix_emaillog_user_id_created_at", "user_id", "created_at"),)
+
     id: Optional[int] = sqlmodel.Field(default=None, primary_key=True)
     category: EmailLogCategory = sqlmodel.Field(sa_column=sqlmodel.Column(types.Enum(EmailLogCategory)))
     content: str
+    # the exams a notification reported, see `notifier.get_exams_fingerprint`
+    fingerprint: Optional[str] = sqlmodel.Field(default=None, index=True)
     created_at: Optional[datetime] = sqlmodel.Field(
         sa_column=sqlmodel.Column(
             sqlmodel.DateTime,
@@ -158,6 +207,63 @@ class EmailLog(sqlmodel.SQLModel, table=True):
         results = db.exec(statement)
         return results.first()
 
+    @classmethod
+    def get_latest_fingerprint(
+        cls, db: sqlmodel.Session, user_id: int, category: "EmailLogCategory" = EmailLogCategory.notification
+    ) -> Optional[str]:
+        """Get the fingerprint of the latest mail of the category to the user with one indexed lookup."""
+        statement = (
+            sqlmodel.select(cls.fingerprint)
+            .where(cls.user_id == user_id, cls.category == category)
+            .order_by(cls.created_at.desc())  # type: ignore
+            .limit(1)
+        )
+        results = db.exec(statement)
+        return results.first()
+
+
+class AppState(sqlmodel.SQLModel, table=True):
+    """A key-value store for values that have to survive between runs (e.g. fingerprints or counters)."""
+
+    id: Optional[int] = sqlmodel.Field(default=None, primary_key=True)
+    key: str = sqlmodel.Field(sa_column=sqlmodel.Column("key", sqlmodel.String, unique=True))
+    value: str = ""
+    updated_at: Optional[datetime] = sqlmodel.Field(
+        sa_column=sqlmodel.Column(
+            sqlmodel.DateTime,
+            default=datetime.utcnow,
+            onupdate=datetime.utcnow,
+        )
+    )
+
+    @classmethod
+    def get_by_key(cls, db: sqlmodel.Session, key: str) -> Optional["AppState"]:
+        statement = sqlmodel.select(cls).where(cls.key == key)
+        results = db.exec(statement)
+        return results.first()
+
+    @classmethod
+    def get_value(cls, db: sqlmodel.Session, key: str, default: str = "") -> str:
+        state = cls.get_by_key(db, key=key)
+        if not state:
+            return default
+        return state.value
+
+    @classmethod
+    def set_value(cls, db: sqlmodel.Session, key: str, value: str) -> "AppState":
+        state = cls.get_by_key(db, key=key) or cls(key=key)
+        state.value = value
+        db.add(state)
+        db.commit()
+        return state
+
+    @classmethod
+    def increment(cls, db: sqlmodel.Session, key: str, by: int = 1) -> int:
+        """Increment the counter stored at `key` and return the new value."""
+        value = int(cls.get_value(db, key=key, default="0")) + by
+        cls.set_value(db, key=key, value=str(value))
+        return value
+
 
 class Exam(sqlmodel.SQLModel, table=True):
     """A fishing license exam.
@@ -166,8 +272,12 @@ class Exam(sqlmodel.SQLModel, table=True):
     https://fischerpruefung-online.bayern.de/fprApp/verwaltung/Pruefungssuche.
     """
 
+    cancelled_status: ClassVar[str] = "Abgesagt"  # set by the sync if the exam is no longer listed
+
     id: Optional[int] = sqlmodel.Field(default=None, primary_key=True)
-    exam_id: str
+    exam_id: str = sqlmodel.Field(
+        sa_column=sqlmodel.Column("exam_id", sqlmodel.String, nullable=False, unique=True, index=True)
+    )
     name: str
     street: str
     street_number: str
@@ -229,6 +339,55 @@ class Exam(sqlmodel.SQLModel, table=True):
             db.commit()
         return exam, created
 
+    @classmethod
+    def get_multi_by_exam_ids(cls, db: sqlmodel.Session, exam_ids: List[str]) -> List["Exam"]:
+        statement = sqlmodel.select(cls).where(cls.exam_id.in_(exam_ids))  # type: ignore
+        results = db.exec(statement)
+        return results.all()
+
+    @classmethod
+    def get_multi_not_listed(
+        cls, db: sqlmodel.Session, listed_exam_ids: Set[str], exam_start__min: datetime
+    ) -> List["Exam"]:
+        """Get the exams starting after `exam_start__min` that are not cancelled and not in `listed_exam_ids`."""
+        statement = sqlmodel.select(cls).where(
+            cls.exam_id.notin_(listed_exam_ids),  # type: ignore
+            cls.status != cls.cancelled_status,
+            cls.exam_start >= exam_start__min,
+        )
+        results = db.exec(statement)
+        return results.all()
+
+    @classmethod
+    def get_next_start(cls, db: sqlmodel.Session, status: str, exam_start__min: datetime) -> Optional[datetime]:
+        """Get the start of the next exam with the status."""
+        statement = sqlmodel.select(sqlmodel.func.min(cls.exam_start)).where(
+            cls.status == status, cls.exam_start >= exam_start__min
+        )
+        results = db.exec(statement)
+        return results.one()
+
+    @classmethod
+    def bulk_upsert(cls, db: sqlmodel.Session, exams: List[Dict[str, Any]]) -> None:
+        """Insert the exams or update them by their `exam_id` with one `INSERT ... ON CONFLICT DO UPDATE` statement.
+
+        The changes are not committed, so several batches can be written in one transaction.
+        """
+        if not exams:
+            return
+
+        now = datetime.utcnow()
+        rows = [{**exam, "created_at": now, "updated_at": now} for exam in exams]
+
+        statement = sqlite_insert(cls.__table__)
+        update_columns = {
+            column.name: statement.excluded[column.name]
+            for column in cls.__table__.columns
+            if column.name not in ("id", "exam_id", "created_at")
+        }
+        statement = statement.on_conflict_do_update(index_elements=["exam_id"], set_=update_columns)
+        db.execute(statement, rows)
+
     @classmethod
     def get_multi_as_dataframe(
         cls,
@@ -237,14 +396,14 @@ class Exam(sqlmodel.SQLModel, table=True):
         disabled_access: Optional[bool] = None,
         headphones: Optional[bool] = None,
         exam_start__min: Optional[datetime] = None,
-        districts__in: Optional[List[District]] = None,
+        district_mask: Optional[int] = None,
     ) -> DataFrame:
         statement = cls.get_multi_statement(
             status=status,
             disabled_access=disabled_access,
             headphones=headphones,
             exam_start__min=exam_start__min,
-            districts__in=districts__in,
+            district_mask=district_mask,
         )
         return pd.read_sql(statement, db.connection())
 
@@ -256,14 +415,14 @@ class Exam(sqlmodel.SQLModel, table=True):
         disabled_access: Optional[bool] = None,
         headphones: Optional[bool] = None,
         exam_start__min: Optional[datetime] = None,
-        districts__in: Optional[List[District]] = None,
+        district_mask: Optional[int] = None,
     ) -> List["Exam"]:
         statement = cls.get_multi_statement(
             status=status,
             disabled_access=disabled_access,
             headphones=headphones,
             exam_start__min=exam_start__min,
-            districts__in=districts__in,
+            district_mask=district_mask,
         )
 
         results = db.exec(statement)
@@ -276,7 +435,7 @@ class Exam(sqlmodel.SQLModel, table=True):
         disabled_access: Optional[bool] = None,
         headphones: Optional[bool] = None,
         exam_start__min: Optional[datetime] = None,
-        districts__in: Optional[List[District]] = None,
+        district_mask: Optional[int] = None,
     ):
         statement = sqlmodel.select(cls)
 
@@ -292,27 +451,163 @@ class Exam(sqlmodel.SQLModel, table=True):
         if exam_start__min:
             statement = statement.where(cls.exam_start >= exam_start__min)
 
-        if districts__in:
-            statement = statement.where(cls.district.in_(districts__in))
+        if district_mask:
+            statement = statement.where(cls.get_district_bit_expression().op("&")(district_mask) != 0)
 
         return statement
 
+    @classmethod
+    def get_district_bit_expression(cls):
+        """Get the bit of the exam district as SQL expression, so it can be matched against a district mask."""
+        return sqlmodel.case({district.name: district.bit for district in District}, value=cls.district, else_=0)
+
     def get_address_line(self) -> str:
         return f"{self.street} {self.street_number}, {self.postal_code} {self.city}, Deutschland"
 
 
+class ExamRecord(NamedTuple):
+    """A scraped exam. Lightweight and not validated; it is only converted to an `Exam` row at the DB boundary."""
+
+    exam_id: str
+    name: str
+    street: str
+    street_number: str
+    city: str
+    postal_code: str
+    district: District
+    exam_start: datetime
+    min_participants: int
+    max_participants: int
+    current_participants: int
+    status: str
+    disabled_access: bool
+    headphones: bool
+
+    def to_row(self) -> Dict[str, Any]:
+        """Get the values of the `Exam` columns."""
+        return self._asdict()
+
+    def to_exam(self) -> Exam:
+        return Exam(**self._asdict())
+
+
+class ExamEventType(str, enum.Enum):
+    new = "new"
+    seats_freed = "seats_freed"
+    status_free = "status_free"
+    cancelled = "cancelled"
+    start_moved = "start_moved"
+    modified = "modified"  # any other change, e.g. of the district or the address; doesn't notify again
+
+
+class ExamEvent(sqlmodel.SQLModel, table=True):
+    """A change of an exam found by the exam sync. The matching only has to react to these changes."""
+
+    id: Optional[int] = sqlmodel.Field(default=None, primary_key=True)
+    event_type: ExamEventType = sqlmodel.Field(sa_column=sqlmodel.Column(types.Enum(ExamEventType)))
+    exam_id: str = sqlmodel.Field(index=True)
+    details: str = ""  # e.g. the old and new value
+    created_at: Optional[datetime] = sqlmodel.Field(
+        sa_column=sqlmodel.Column(
+            sqlmodel.DateTime,
+            default=datetime.utcnow,
+            nullable=False,
+        )
+    )
+
+    @classmethod
+    def get_since(cls, db: sqlmodel.Session, last_event_id: int) -> List["ExamEvent"]:
+        statement = sqlmodel.select(cls).where(cls.id > last_event_id).order_by(cls.id)
+        results = db.exec(statement)
+        return results.all()
+
+    @classmethod
+    def get_last_id(cls, db: sqlmodel.Session) -> int:
+        statement = sqlmodel.select(sqlmodel.func.max(cls.id))
+        results = db.exec(statement)
+        return results.one() or 0
+
+    @classmethod
+    def from_changes(
+        cls, exam_id: str, old_values: Optional[Dict[str, Any]], new_values: Dict[str, Any]
+    ) -> List["ExamEvent"]:
+        """Create the events for the changes between the old and new values of an exam."""
+        if not old_values:
+            return [cls(event_type=ExamEventType.new, exam_id=exam_id)]
+
+        events = list()
+        if new_values["current_participants"] < old_values["current_participants"]:
+            details = f'{old_values["current_participants"]} -> {new_values["current_participants"]}'
+            events.append(cls(event_type=ExamEventType.seats_freed, exam_id=exam_id, details=details))
+        if new_values["status"] == "Frei" and old_values["status"] != "Frei":
+            details = f'{old_values["status"]} -> {new_values["status"]}'
+            events.append(cls(event_type=ExamEventType.status_free, exam_id=exam_id, details=details))
+        if new_values["exam_start"] != old_values["exam_start"]:
+            details = f'{old_values["exam_start"]:%d.%m.%Y %H:%M} -> {new_values["exam_start"]:%d.%m.%Y %H:%M}'
+            events.append(cls(event_type=ExamEventType.start_moved, exam_id=exam_id, details=details))
+        if not events:
+            changed_columns = [column for column, value in new_values.items() if value != old_values.get(column)]
+            if changed_columns:
+                details = ", ".join(changed_columns)
+                events.append(cls(event_type=ExamEventType.modified, exam_id=exam_id, details=details))
+        return events
+
+
+class DistanceErrorClass(str, enum.Enum):
+    no_route = "no_route"  # the api found no route, e.g. NOT_FOUND or ZERO_RESULTS
+    request_failed = "request_failed"  # the request failed, e.g. a timeout or an exceeded quota
+
+
+DISTANCE_DETAILS_ZLIB_PREFIX = "zlib:"
+
+
+def summarize_route_details(details: Any) -> Dict[str, str]:
+    """Trim route details to the texts of the distance and duration.
+
+    `details` is a Distance Matrix element, a Directions response (stored by older versions) or a summary.
+    """
+    summary = dict()
+    if isinstance(details, list):  # Directions response: the shortest leg of the first route
+        route = details[0] if details else {}
+        if route.get("summary"):
+            summary["route"] = route["summary"]
+        legs = sorted(route.get("legs", []), key=lambda leg: leg["distance"]["value"])
+        details = legs[0] if legs else {}
+    elif details.get("route"):
+        summary["route"] = details["route"]
+
+    for key in ("distance", "duration"):
+        if key in details:
+            summary[key] = details[key]["text"] if isinstance(details[key], dict) else details[key]
+    return summary
+
+
 class Distance(sqlmodel.SQLModel, table=True):
+    """The travel distance between two addresses. The addresses are normalized by `utils.normalize_address`."""
+
+    __table_args__ = (
+        sqlmodel.Index("ix_distance_start_address_end_address", "start_address", "end_address", unique=True),
+    )
+
     id: Optional[int] = sqlmodel.Field(default=None, primary_key=True)
     distance: Optional[int] = sqlmodel.Field(default=None)  # in meters
     duration: Optional[int] = sqlmodel.Field(default=None)  # in seconds
-    details: Optional[str] = sqlmodel.Field(default=None)  # full api response
+    details: Optional[str] = sqlmodel.Field(default=None)  # api response by DISTANCE_DETAILS_MODE, see `get_details`
     start_address: str
     end_address: str
+    # set if the last lookup failed; the pair is not looked up again until the TTL of the error class expired
+    error_class: Optional[DistanceErrorClass] = sqlmodel.Field(
+        sa_column=sqlmodel.Column(types.Enum(DistanceErrorClass), nullable=True)
+    )
+    error: Optional[str] = sqlmodel.Field(default=None)  # status or exception of the failed lookup
+    failed_at: Optional[datetime] = sqlmodel.Field(default=None)
+    failure_count: int = sqlmodel.Field(default=0)  # failed lookups in a row
 
     @classmethod
     def get_by_start_and_end_address(
         cls, db: sqlmodel.Session, start_address: str, end_address: str
     ) -> Optional["Distance"]:
+        start_address, end_address = utils.normalize_address(start_address), utils.normalize_address(end_address)
         statement = sqlmodel.select(cls).where(cls.start_address == start_address, cls.end_address == end_address)
         results = db.exec(statement)
         return results.first()
@@ -323,7 +618,9 @@ class Distance(sqlmodel.SQLModel, table=True):
         created = False
 
         if not distance:
-            distance = cls(start_address=start_address, end_address=end_address)
+            distance = cls(
+                start_address=utils.normalize_address(start_address), end_address=utils.normalize_address(end_address)
+            )
             db.add(distance)
             db.commit()
 
@@ -331,128 +628,681 @@ class Distance(sqlmodel.SQLModel, table=True):
 
         return distance, created
 
-    def get_distance(self, db: sqlmodel.Session) -> int:
-        """Get the distance in meters.
+    def set_values_from_matrix_element(self, element: Dict[str, Any]) -> None:
+        """Set the values 'distance', 'duration' and 'details' from an element of a Distance Matrix response."""
+        if element["status"] != "OK":
+            raise ValueError(f"No route from {self.start_address} to {self.end_address}: {element['status']}")
+
+        self.details = self.encode_details(element)
+        self.duration = element["duration"]["value"]
+        self.distance = element["distance"]["value"]
+        self.error_class = self.error = self.failed_at = None
+        self.failure_count = 0
+
+    def set_failure(self, error_class: DistanceErrorClass, error: str, now: Optional[datetime] = None) -> None:
+        """Record a failed lookup, so the pair is skipped until the TTL of the error class expired."""
+        self.error_class = error_class
+        self.error = error[:255]
+        self.failed_at = now or datetime.utcnow()
+        self.failure_count = (self.failure_count or 0) + 1
+
+    @staticmethod
+    def get_failure_ttl(error_class: DistanceErrorClass) -> timedelta:
+        if error_class == DistanceErrorClass.no_route:
+            return timedelta(hours=setting.DISTANCE_NO_ROUTE_TTL_HOURS)
+        return timedelta(hours=setting.DISTANCE_REQUEST_FAILED_TTL_HOURS)
+
+    def is_failure_cached(self, now: Optional[datetime] = None) -> bool:
+        """Whether the last lookup failed and the TTL of its error class didn't expire yet."""
+        if self.error_class is None or self.failed_at is None:
+            return False
+        return (now or datetime.utcnow()) < self.failed_at + self.get_failure_ttl(DistanceErrorClass(self.error_class))
+
+    @classmethod
+    def get_multi_failing(cls, db: sqlmodel.Session, failure_count__min: int = 1) -> List["Distance"]:
+        """Get the pairs whose last lookups failed at least `failure_count__min` times in a row."""
+        statement = (
+            sqlmodel.select(cls)
+            .where(cls.error_class != None, cls.failure_count >= failure_count__min)  # noqa: E711
+            .order_by(cls.failure_count.desc())  # type: ignore
+        )
+        results = db.exec(statement)
+        return results.all()
 
-        Must be called within the context of a database session.
+    @staticmethod
+    def encode_details(details: Any, mode: Optional[str] = None) -> Optional[str]:
+        """Encode the api response for the details column by the mode (default: DISTANCE_DETAILS_MODE).
+
+        off: not stored, summary: the texts of distance and duration (see `summarize_route_details`),
+        zlib: the full response as compressed JSON.
         """
-        if self.distance:
-            return self.distance
+        mode = mode or setting.DISTANCE_DETAILS_MODE
+        if mode == "off":
+            return None
+        if mode == "summary":
+            return json.dumps(summarize_route_details(details), separators=(",", ":"), ensure_ascii=False)
+        compressed = zlib.compress(json.dumps(details, separators=(",", ":")).encode(), 9)
+        return DISTANCE_DETAILS_ZLIB_PREFIX + base64.b64encode(compressed).decode("ascii")
 
-        self._set_values_from_gmap_api()  # will set distance
+    @staticmethod
+    def decode_details(details: Optional[str]) -> Any:
+        if details is None:
+            return None
+        if details.startswith(DISTANCE_DETAILS_ZLIB_PREFIX):
+            details = zlib.decompress(base64.b64decode(details[len(DISTANCE_DETAILS_ZLIB_PREFIX) :])).decode()
+        return json.loads(details)
 
-        db.add(self)
+    @classmethod
+    def compact_details(cls, details: Optional[str], mode: Optional[str] = None) -> Optional[str]:
+        """Re-encode stored details (in any mode) by the mode (default: DISTANCE_DETAILS_MODE)."""
+        mode = mode or setting.DISTANCE_DETAILS_MODE
+        if details is None or (mode == "zlib" and details.startswith(DISTANCE_DETAILS_ZLIB_PREFIX)):
+            return details
+        return cls.encode_details(cls.decode_details(details), mode=mode)
+
+    def get_details(self) -> Any:
+        """Get the decoded details: the api response, a summary of it or None."""
+        return self.decode_details(self.details)
+
+    @classmethod
+    def get_multi_by_addresses(cls, db: sqlmodel.Session, addresses: Set[Tuple[str, str]]) -> List["Distance"]:
+        """Get the distances of the normalized (start address, end address) pairs."""
+        if not addresses:
+            return []
+
+        start_addresses = {start_address for start_address, _ in addresses}
+        end_addresses = {end_address for _, end_address in addresses}
+        statement = sqlmodel.select(cls).where(
+            cls.start_address.in_(start_addresses), cls.end_address.in_(end_addresses)  # type: ignore
+        )
+        results = db.exec(statement)
+        return [distance for distance in results.all() if (distance.start_address, distance.end_address) in addresses]
+
+    @classmethod
+    def bulk_insert(cls, db: sqlmodel.Session, distances: List["Distance"]) -> None:
+        """Insert the distances with one executemany statement. The changes are not committed."""
+        if not distances:
+            return
+
+        rows = [distance.dict(exclude={"id"}) for distance in distances]
+        db.execute(sqlmodel.insert(cls.__table__), rows)
+
+
+class Location(sqlmodel.SQLModel, table=True):
+    """The geocoded coordinates of a normalized address. Without coordinates if the address was not found."""
+
+    id: Optional[int] = sqlmodel.Field(default=None, primary_key=True)
+    address: str = sqlmodel.Field(
+        sa_column=sqlmodel.Column("address", sqlmodel.String, nullable=False, unique=True, index=True)
+    )
+    latitude: Optional[float] = sqlmodel.Field(default=None)
+    longitude: Optional[float] = sqlmodel.Field(default=None)
+    created_at: Optional[datetime] = sqlmodel.Field(
+        sa_column=sqlmodel.Column(
+            sqlmodel.DateTime,
+            default=datetime.utcnow,
+            nullable=False,
+        )
+    )
+
+    @classmethod
+    def get_multi_by_addresses(cls, db: sqlmodel.Session, addresses: Set[str]) -> List["Location"]:
+        if not addresses:
+            return []
+
+        statement = sqlmodel.select(cls).where(cls.address.in_(addresses))  # type: ignore
+        results = db.exec(statement)
+        return results.all()
+
+    @classmethod
+    def bulk_insert(cls, db: sqlmodel.Session, locations: List["Location"]) -> None:
+        """Insert the locations with one executemany statement. The changes are not committed."""
+        if not locations:
+            return
+
+        now = datetime.utcnow()
+        rows = [location.dict(exclude={"id"}) | {"created_at": now} for location in locations]
+        db.execute(sqlmodel.insert(cls.__table__), rows)
+
+
+class UserExamMatch(sqlmodel.SQLModel, table=True):
+    """A materialized (user, exam) candidate: the exam is free, in the future and passes the filters of the user.
+
+    `eligible` is False if the exam is beyond the max. travel duration of the user (or the distance couldn't be
+    resolved). The rows are maintained incrementally by `matching.update_matches` for changed users and exams, so
+    the notification only reads the eligible rows that were not notified yet.
+    """
+
+    __tablename__ = "user_exam_match"
+    __table_args__ = (
+        sqlmodel.Index("ix_user_exam_match_user_id_exam_id", "user_id", "exam_id", unique=True),
+        sqlmodel.Index("ix_user_exam_match_pending", "eligible", "notified_at", "user_id"),
+    )
+
+    id: Optional[int] = sqlmodel.Field(default=None, primary_key=True)
+    user_id: int = sqlmodel.Field(foreign_key="user.id")
+    exam_id: int = sqlmodel.Field(foreign_key="exam.id", index=True)
+    eligible: bool
+    travel_duration: Optional[int] = sqlmodel.Field(default=None)  # in seconds
+    travel_distance: Optional[int] = sqlmodel.Field(default=None)  # in meters
+    start_address_line: Optional[str] = sqlmodel.Field(default=None)
+    notified_at: Optional[datetime] = sqlmodel.Field(default=None)
+    updated_at: Optional[datetime] = sqlmodel.Field(default=None)
+
+    # max. number of ids per IN clause, below the limit of bound parameters of SQLite
+    chunk_size: ClassVar[int] = 500
+
+    @classmethod
+    def replace(
+        cls,
+        db: sqlmodel.Session,
+        rows: List[Dict[str, Any]],
+        user_ids: List[int],
+        exam_ids: Optional[List[int]] = None,
+        reset_notified: bool = False,
+    ) -> None:
+        """Replace the rows of the users (and exams, if given) by the new rows. The changes are not committed.
+
+        The rows are plain dicts of the columns, so many rows are inserted without building models. The notification
+        time of a kept (user, exam) pair is carried over unless `reset_notified` is set, e.g. if the exam has free
+        seats again.
+        """
+        notified_at_by_pair = dict()
+        for i in range(0, len(user_ids), cls.chunk_size):
+            condition = cls.user_id.in_(user_ids[i : i + cls.chunk_size])  # type: ignore
+            if exam_ids is not None:
+                condition = sqlmodel.and_(condition, cls.exam_id.in_(exam_ids))  # type: ignore
+            if not reset_notified:
+                statement = sqlmodel.select(cls.user_id, cls.exam_id, cls.notified_at).where(
+                    condition, cls.notified_at != None  # noqa: E711
+                )
+                notified_at_by_pair.update(
+                    {(user_id, exam_id): notified_at for user_id, exam_id, notified_at in db.exec(statement)}
+                )
+            db.execute(sqlmodel.delete(cls).where(condition))
+
+        if not rows:
+            return
+
+        for row in rows:
+            row["notified_at"] = notified_at_by_pair.get((row["user_id"], row["exam_id"]))
+        db.execute(sqlmodel.insert(cls.__table__), rows)
+
+    @classmethod
+    def get_pending_statement(cls, now: Optional[datetime] = None):
+        """Get the eligible matches of active users with free future exams that were not notified yet."""
+        return (
+            sqlmodel.select(cls)
+            .join(Exam, Exam.id == cls.exam_id)  # type: ignore
+            .join(User, User.id == cls.user_id)  # type: ignore
+            .where(
+                cls.eligible == True,  # noqa: E712
+                cls.notified_at == None,  # noqa: E711
+                Exam.status == "Frei",
+                Exam.exam_start >= (now or datetime.utcnow()),
+                User.active == True,  # noqa: E712
+            )
+        )
+
+    @classmethod
+    def get_pending_user_ids(cls, db: sqlmodel.Session, now: Optional[datetime] = None) -> List[int]:
+        statement = cls.get_pending_statement(now=now).with_only_columns(cls.user_id).distinct()  # type: ignore
+        results = db.exec(statement)
+        return list(results.all())
+
+    @classmethod
+    def get_unresolved_user_ids(cls, db: sqlmodel.Session, now: Optional[datetime] = None) -> List[int]:
+        """Get the users with candidates whose travel duration is missing and may be resolved by a rematch.
+
+        That is, the lookup was deferred (no `Distance` yet), the failure of the last lookup expired or the pair was
+        resolved meanwhile. Candidates whose failure is still cached are left out, so they don't trigger a rematch.
+        """
+        statement = (
+            sqlmodel.select(cls.user_id, cls.start_address_line, Exam)
+            .join(Exam, Exam.id == cls.exam_id)
+            .where(cls.start_address_line != None, cls.travel_duration == None)  # noqa: E711
+        )
+        results = db.exec(statement)
+        user_keys = [
+            (user_id, (utils.normalize_address(start_address_line), utils.normalize_address(exam.get_address_line())))
+            for user_id, start_address_line, exam in results.all()
+        ]
+        distances = {
+            (distance.start_address, distance.end_address): distance
+            for distance in Distance.get_multi_by_addresses(db, {key for _, key in user_keys})
+        }
+        now = now or datetime.utcnow()
+        return sorted(
+            {user_id for user_id, key in user_keys if key not in distances or not distances[key].is_failure_cached(now)}
+        )
+
+    @classmethod
+    def get_eligible_by_user(
+        cls, db: sqlmodel.Session, user_id: int, now: Optional[datetime] = None
+    ) -> List[Tuple["UserExamMatch", Exam]]:
+        """Get the eligible matches of the user with free future exams, ordered by the exam start."""
+        statement = (
+            sqlmodel.select(cls, Exam)
+            .join(Exam, Exam.id == cls.exam_id)  # type: ignore
+            .where(
+                cls.user_id == user_id,
+                cls.eligible == True,  # noqa: E712
+                Exam.status == "Frei",
+                Exam.exam_start >= (now or datetime.utcnow()),
+            )
+            .order_by(Exam.exam_start)
+        )
+        results = db.exec(statement)
+        return list(results.all())
+
+    @classmethod
+    def set_notified(cls, db: sqlmodel.Session, user_id: int, exam_ids: List[int], now: Optional[datetime] = None):
+        """Mark the matches of the user as notified and commit."""
+        statement = (
+            sqlmodel.update(cls)
+            .where(cls.user_id == user_id, cls.exam_id.in_(exam_ids))  # type: ignore
+            .values(notified_at=now or datetime.utcnow())
+        )
+        db.execute(statement)
         db.commit()
 
-        if self.distance > setting.DISTANCE_THRESHOLD:
-            message = f"Distance between {self.start_address} and {self.end_address} is {self.distance} meters, which exceeds the threshold of {setting.DISTANCE_THRESHOLD} meters."
-            logger.warning(message)
-            utils.notify_admin_via_gchat(message)
+    @classmethod
+    def reset_notified(cls, db: sqlmodel.Session, user_id: int, exam_ids: List[int]) -> None:
+        """Mark the matches of the user as not notified, so they are notified again. The changes are not committed."""
+        statement = (
+            sqlmodel.update(cls)
+            .where(cls.user_id == user_id, cls.exam_id.in_(exam_ids))  # type: ignore
+            .values(notified_at=None)
+        )
+        db.execute(statement)
+
+
+class OutboxStatus(str, enum.Enum):
+    pending = "pending"  # waits for its first or next attempt
+    sending = "sending"  # claimed by a delivery
+    submitted = "submitted"  # accepted by a mailersend bulk email, its result is polled by the next deliveries
+    sent = "sent"
+    dead = "dead"  # gave up after the max. attempts
 
-        return self.distance  # type: ignore # value is set by _set_values_from_gmap_api
 
-    def get_duration(self, db: sqlmodel.Session) -> int:
-        """Get the duration in seconds
+class OutboxMessage(sqlmodel.SQLModel, table=True):
+    """A rendered mail in the outbox. The matching enqueues the mails, the delivery drains the outbox.
 
-        Must be called within the context of a database session.
+    A message is enqueued in the same transaction that marks its matches as notified, so a crash loses neither.
+    A message that stays claimed longer than the lease (the delivery crashed) is released for another attempt.
+    A submitted message is never sent again; only the result of its bulk email is polled.
+    """
+
+    __tablename__ = "outbox_message"
+    __table_args__ = (sqlmodel.Index("ix_outbox_message_due", "status", "next_attempt_at"),)
+
+    id: Optional[int] = sqlmodel.Field(default=None, primary_key=True)
+    user_id: Optional[int] = sqlmodel.Field(default=None, foreign_key="user.id")
+    email_to: str
+    subject: str
+    content: str
+    html_content: str = ""
+    category: EmailLogCategory = sqlmodel.Field(sa_column=sqlmodel.Column(types.Enum(EmailLogCategory), nullable=False))
+    status: OutboxStatus = sqlmodel.Field(
+        default=OutboxStatus.pending, sa_column=sqlmodel.Column(types.Enum(OutboxStatus), nullable=False)
+    )
+    attempts: int = 0
+    fingerprint: Optional[str] = None  # copied to the `EmailLog` once sent
+    exam_ids: Optional[str] = None  # comma-separated ids of the notified exams
+    bulk_email_id: Optional[str] = None  # the mailersend bulk email and the index of the message within it
+    bulk_email_index: Optional[int] = None
+    last_error: Optional[str] = None
+    next_attempt_at: datetime = sqlmodel.Field(default_factory=datetime.utcnow)
+    claimed_at: Optional[datetime] = None
+    sent_at: Optional[datetime] = None
+    created_at: Optional[datetime] = sqlmodel.Field(
+        sa_column=sqlmodel.Column(
+            sqlmodel.DateTime,
+            default=datetime.utcnow,
+            nullable=False,
+        )
+    )
+
+    @classmethod
+    def enqueue(
+        cls,
+        db: sqlmodel.Session,
+        email_to: str,
+        subject: str,
+        content: str,
+        html_content: str = "",
+        category: EmailLogCategory = EmailLogCategory.notification,
+        user_id: Optional[int] = None,
+        fingerprint: Optional[str] = None,
+        exam_ids: Optional[List[int]] = None,
+    ) -> "OutboxMessage":
+        """Add a message to the outbox. The changes are not committed.
+
+        The matches of the user with the exams are notified again if the message is dead-lettered.
         """
-        if self.duration:
-            return self.duration
+        if user_id is None:
+            user = User.get_by_mail(db, email=email_to)
+            user_id = user.id if user else None
+        message = cls(
+            user_id=user_id,
+            email_to=email_to,
+            subject=subject,
+            content=content,
+            html_content=html_content,
+            category=category,
+            fingerprint=fingerprint,
+            exam_ids=",".join(str(exam_id) for exam_id in exam_ids) if exam_ids else None,
+        )
+        db.add(message)
+        return message
 
-        self._set_values_from_gmap_api()
+    @classmethod
+    def claim_due(cls, db: sqlmodel.Session, limit: int, now: Optional[datetime] = None) -> List["OutboxMessage"]:
+        """Claim the pending messages that are due for an attempt, oldest first, and commit."""
+        now = now or datetime.utcnow()
+        statement = (
+            sqlmodel.select(cls)
+            .where(cls.status == OutboxStatus.pending, cls.next_attempt_at <= now)
+            .order_by(cls.id)
+            .limit(limit)
+        )
+        messages = db.exec(statement).all()
+        for message in messages:
+            message.status = OutboxStatus.sending
+            message.claimed_at = now
+            message.attempts += 1
+            db.add(message)
+        db.commit()
+        return messages
 
-        db.add(self)
+    @classmethod
+    def release_stale(cls, db: sqlmodel.Session, lease: timedelta, now: Optional[datetime] = None) -> int:
+        """Release the messages claimed longer than the lease ago for another attempt and commit."""
+        now = now or datetime.utcnow()
+        statement = (
+            sqlmodel.update(cls)
+            .where(cls.status == OutboxStatus.sending, cls.claimed_at < now - lease)  # type: ignore
+            .values(status=OutboxStatus.pending, next_attempt_at=now)
+        )
+        released = db.execute(statement).rowcount
         db.commit()
+        return released
 
-        return self.duration  # type: ignore # value is set by _set_values_from_gmap_api
+    @classmethod
+    def get_submitted(cls, db: sqlmodel.Session) -> List["OutboxMessage"]:
+        statement = sqlmodel.select(cls).where(cls.status == OutboxStatus.submitted).order_by(cls.id)
+        return db.exec(statement).all()
 
-    def _set_values_from_gmap_api(self) -> None:
-        """Set the values 'distance', 'duration' and 'details' from Google Maps API."""
-        gmap_res = utils.get_distance_from_gmaps(self.start_address, self.end_address)
-        self.details = json.dumps(gmap_res)
+    @classmethod
+    def count_by_status(cls, db: sqlmodel.Session) -> Dict[OutboxStatus, int]:
+        statement = sqlmodel.select(cls.status, sqlmodel.func.count()).group_by(cls.status)  # type: ignore
+        return {status: count for status, count in db.exec(statement).all()}
+
+    def set_sent(self, db: sqlmodel.Session, now: Optional[datetime] = None) -> None:
+        """Mark the message as sent and log it as mail of the user. The changes are not committed."""
+        self.status = OutboxStatus.sent
+        self.sent_at = now or datetime.utcnow()
+        self.last_error = None
+        db.add(self)
+        db.add(
+            EmailLog(category=self.category, content=self.content, user_id=self.user_id, fingerprint=self.fingerprint)
+        )
 
-        # get the gmap legs (more info: )
-        legs = gmap_res[0]["legs"]
+    def set_submitted(self, db: sqlmodel.Session, bulk_email_id: str, bulk_email_index: int) -> None:
+        """Mark the message as accepted by a bulk email whose result is not known yet. The changes are not committed."""
+        self.status = OutboxStatus.submitted
+        self.bulk_email_id = bulk_email_id
+        self.bulk_email_index = bulk_email_index
+        db.add(self)
 
-        # sort by shortest distance
-        legs.sort(key=lambda x: x["distance"]["value"])
+    def get_exam_ids(self) -> List[int]:
+        return [int(exam_id) for exam_id in self.exam_ids.split(",")] if self.exam_ids else []
 
-        self.duration = legs[0]["duration"]["value"]
-        self.distance = legs[0]["distance"]["value"]
+    def set_dead(self, db: sqlmodel.Session, error: str) -> None:
+        """Give up the message without another attempt (dead letter). The changes are not committed.
+
+        Unlike `set_failed`, the matches stay notified: the message may have been sent.
+        """
+        self.status = OutboxStatus.dead
+        self.last_error = error
+        db.add(self)
+
+    def set_failed(
+        self, db: sqlmodel.Session, error: str, max_attempts: int, backoff: timedelta, now: Optional[datetime] = None
+    ) -> None:
+        """Schedule the next attempt with exponential backoff or give up after the max. attempts (dead letter).
+
+        The matches of a dead-lettered message are marked as not notified, so the next run notifies the user again.
+        The changes are not committed.
+        """
+        self.last_error = error
+        self.bulk_email_id, self.bulk_email_index = None, None
+        if self.attempts >= max_attempts:
+            self.status = OutboxStatus.dead
+            if self.user_id is not None and self.exam_ids:
+                UserExamMatch.reset_notified(db, user_id=self.user_id, exam_ids=self.get_exam_ids())
+        else:
+            self.status = OutboxStatus.pending
+            self.next_attempt_at = (now or datetime.utcnow()) + backoff * 2 ** (self.attempts - 1)
+        db.add(self)
 
 
 class ExamTableScraper:
     exam_url = setting.EXAM_SCRAP_URL
-    exam_overview_response: Optional[requests.Response] = None
-    exam_detail_response: Optional[requests.Response] = None
-    exam_overview_columns: List[str] = ["", "Prüfungstermin", "Prüfungslokal", "Ort", "Regierungsbezirk", "Teilnehmer"]
-
-    def __init__(self):
-        self.set_responses()
-        self.exams = self._parse_exam_tables()
-
-    def get_exam_responses(self) -> List[Response]:
-        # use a session to store cookie
-        logger.info("Get exam responses...")
-
-        responses = list()
-        with requests.Session() as s:
-            logger.info(f"Get cookie and CSRF-Token from {self.exam_url} ...")
-            res_exam_url = s.get(self.exam_url)
-            responses.append(res_exam_url)
-
-            soup = BeautifulSoup(res_exam_url.content.decode("utf-8"), "html.parser")
-
-            # get the CSRF-Token
-            logger.debug("Search for cookie in response...")
-            csrf_input_field = soup.find("input", {"name": "_csrf"})
-            if not csrf_input_field:
-                raise Exception("CSRF input field not found!")
-            csrf_token = csrf_input_field["value"]
-            logger.debug("Found cookie in response!")
-
-            # get the printed view of the exam table (contains more info on exams)
-            submit_btn_tag = soup.find("input", {"type": "submit", "value": "Druckansicht"})
-            if not submit_btn_tag:
-                raise Exception("Submit button not found!")
-            submit_btn_tag_name = submit_btn_tag.attrs["name"]  # e.g. pruefungsterminSearch:j_idt195
-            data = {
-                "pruefungsterminSearch": "pruefungsterminSearch",
-                "_csrf": csrf_token,
-                submit_btn_tag_name: "Druckansicht",
-                "javax.faces.ViewState": "e1s1",
-            }
-            printed_res = s.post(f"{self.exam_url}?execution=e1s1", data=data)
-            responses.append(printed_res)
-
-        return responses
-
-    def set_responses(self) -> None:
-        self.exam_overview_response, self.exam_detail_response = self.get_exam_responses()
+    # the pages are spooled to temporary files that are only kept in memory up to EXAM_PAGE_MAX_MEMORY_BYTES
+    exam_overview_page: Optional[IO[bytes]] = None
+    exam_detail_page: Optional[IO[bytes]] = None
+    page_chunk_size = 64 * 1024
+    sync_batch_size = 500
+    fingerprint_state_key = "exam_scraper.fingerprint"
+    skipped_runs_state_key = "exam_scraper.skipped_runs"
+    # values that change with every request (session, CSRF-Token, JSF view state, generated ids) but not the exams
+    volatile_content_patterns: List[re.Pattern] = [
+        re.compile(rb'(name="_csrf" value=")[^"]*'),
+        re.compile(rb'(id="javax\.faces\.ViewState" value=")[^"]*'),
+        re.compile(rb"(execution=)e\d+s\d+"),
+        re.compile(rb"(;jsessionid=)[\w.\-]+"),
+        re.compile(rb"(j_idt)\d+"),
+    ]
+    whitespace_pattern = re.compile(rb"\s+")
+
+    def __init__(
+        self,
+        parser_backend: Optional[str] = None,
+        client: Optional[ScraperClient] = None,
+        mode: Optional[str] = None,
+        corpus: Optional[ExamPageCorpus] = None,
+        snapshot: Optional[str] = None,
+    ):
+        self.parser = get_exam_parser(parser_backend or setting.EXAM_PARSER_BACKEND)
+        self.client = client or scraper_client
+        self.mode = mode or setting.EXAM_SCRAPER_MODE
+        self.corpus = corpus or ExamPageCorpus()
+        self.snapshot = snapshot or setting.EXAM_CORPUS_SNAPSHOT or None  # the snapshot to replay
+        self.set_pages()
+        self.fingerprint = self.get_fingerprint()
+        self._exams: Optional[List[ExamRecord]] = None
+        self.unmatched_exam_ids: Set[str] = set()  # exams of the detail tables that are not in the overview table
+
+    @property
+    def exams(self) -> List[ExamRecord]:
+        """All parsed exams. Use `iter_exams` to parse the exams one by one instead."""
+        if self._exams is None:
+            self._exams = list(self.iter_exams())
+        return self._exams
+
+    def get_exam_pages(self) -> List[IO[bytes]]:
+        # the client keeps the session cookie and the connections between runs
+        logger.info("Get exam pages...")
+
+        pages = list()
+        logger.info(f"Get cookie and CSRF-Token from {self.exam_url} ...")
+        # always fetched fresh: the CSRF-Token and the view state of its search form belong to the server session
+        res_exam_url = self.client.get(self.exam_url, stream=True)
+        overview_page = self._spool_response(res_exam_url)
+        pages.append(overview_page)
+
+        # get the CSRF-Token and the button for the printed view of the exam table (contains more info on exams)
+        logger.debug("Search for cookie in response...")
+        search_form = self.parser.extract_search_form_from_chunks(self._iter_page_chunks(overview_page))
+        logger.debug("Found cookie in response!")
+
+        data = {
+            "pruefungsterminSearch": "pruefungsterminSearch",
+            "_csrf": search_form.csrf_token,
+            search_form.submit_btn_name: "Druckansicht",
+            "javax.faces.ViewState": search_form.view_state,
+        }
+        printed_res = self.client.post(urljoin(self.exam_url, search_form.action), data=data, stream=True)
+        pages.append(self._spool_response(printed_res))
+
+        return pages
+
+    def set_pages(self) -> None:
+        if self.mode == "replay":
+            self.exam_overview_page, self.exam_detail_page = self.corpus.open_snapshot(self.snapshot)
+            return
+
+        self.exam_overview_page, self.exam_detail_page = self.get_exam_pages()
+        if self.mode == "record":
+            self.corpus.save_snapshot(self.exam_overview_page, self.exam_detail_page)
+
+    def _spool_response(self, response: Response) -> IO[bytes]:
+        """Write the body of a streamed response chunk by chunk to a temporary file."""
+        page = tempfile.SpooledTemporaryFile(max_size=setting.EXAM_PAGE_MAX_MEMORY_BYTES)
+        for chunk in response.iter_content(chunk_size=self.page_chunk_size):
+            page.write(chunk)
+        response.close()
+        page.seek(0)
+        return page  # type: ignore # SpooledTemporaryFile behaves like IO[bytes]
+
+    def _iter_page_chunks(self, page: IO[bytes]) -> Iterator[bytes]:
+        page.seek(0)
+        while True:
+            chunk = page.read(self.page_chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def get_fingerprint(self) -> str:
+        """Get a hash of the normalized overview and detail page. The pages are read line by line."""
+        fingerprint = hashlib.sha256()
+        for page in (self.exam_overview_page, self.exam_detail_page):
+            page.seek(0)
+            for line in page:
+                normalized_line = self._normalize_content(line)
+                if normalized_line:
+                    fingerprint.update(normalized_line + b" ")
+            fingerprint.update(b"\0")
+        return fingerprint.hexdigest()
+
+    def has_changed(self, db: sqlmodel.Session) -> bool:
+        """Check if the content of the exam site changed since the last saved fingerprint."""
+        return AppState.get_value(db, key=self.fingerprint_state_key) != self.fingerprint
+
+    def save_fingerprint(self, db: sqlmodel.Session) -> None:
+        """Save the fingerprint. Should only be called after the exams were synced successfully."""
+        AppState.set_value(db, key=self.fingerprint_state_key, value=self.fingerprint)
+
+    def count_skipped_run(self, db: sqlmodel.Session) -> int:
+        """Count a run that was skipped because the content did not change. Returns the total of skipped runs."""
+        return AppState.increment(db, key=self.skipped_runs_state_key)
+
+    def _normalize_content(self, content: bytes) -> bytes:
+        for pattern in self.volatile_content_patterns:
+            content = pattern.sub(rb"\1", content)
+        return self.whitespace_pattern.sub(b" ", content).strip()
 
     def sync_exams_to_db(self, db: sqlmodel.Session) -> None:
-        for exam in self.exams:
-            exam_in, _ = Exam.update_or_create(
-                db, exam_id=exam.exam_id, defaults=exam.dict(exclude_unset=True, exclude_defaults=True)
-            )
+        """Write the new and changed exams in batches within one transaction. Unchanged exams are not written.
 
-    def _parse_exam_tables(self) -> List[Exam]:
-        logger.info("Parse exam overview table...")
-        soup_overview = BeautifulSoup(self.exam_overview_response.content.decode("utf-8"), "html.parser")
-        overview_values = self._extract_overview_table(soup_overview)
-        logger.info("Parsed exam overview table!")
+        For every change an `ExamEvent` is written in the same transaction. Future exams that are no longer
+        listed on the exam site are marked as cancelled.
+        """
+        batch: List[ExamRecord] = list()
+        scraped_exam_ids = set()
+        written_count = 0
+        self.unmatched_exam_ids = set()
+        for exam in self.iter_exams():
+            batch.append(exam)
+            scraped_exam_ids.add(exam.exam_id)
+            if len(batch) >= self.sync_batch_size:
+                written_count += self._sync_batch(db, batch)
+                batch = list()
+        written_count += self._sync_batch(db, batch)
+        cancelled_count = self._sync_cancelled_exams(db, scraped_exam_ids | self.unmatched_exam_ids)
+        db.commit()
+
+        logger.info(
+            f"Synced {len(scraped_exam_ids)} exams: {written_count} new or changed, {cancelled_count} cancelled."
+        )
+
+    def _sync_batch(self, db: sqlmodel.Session, exams: List[ExamRecord]) -> int:
+        """Upsert the exams of the batch that are new or changed. Returns the number of written exams."""
+        synced_columns = set(ExamRecord._fields)
+        existing_exams = {
+            exam.exam_id: exam.dict(include=synced_columns)
+            for exam in Exam.get_multi_by_exam_ids(db, exam_ids=[exam.exam_id for exam in exams])
+        }
+
+        changed_exams = dict()
+        for exam in exams:
+            exam_values = exam.to_row()
+            if existing_exams.get(exam.exam_id) != exam_values:
+                changed_exams[exam.exam_id] = exam_values  # the last one wins if an exam is listed twice
+
+        Exam.bulk_upsert(db, list(changed_exams.values()))
+        for exam_id, exam_values in changed_exams.items():
+            db.add_all(ExamEvent.from_changes(exam_id, existing_exams.get(exam_id), exam_values))
+
+        return len(changed_exams)
+
+    def _sync_cancelled_exams(self, db: sqlmodel.Session, listed_exam_ids: Set[str]) -> int:
+        """Mark the future exams that are not listed anymore as cancelled. Returns the number of cancelled exams."""
+        if not listed_exam_ids:
+            logger.warning("No exams were listed on the exam site. Skip marking exams as cancelled.")
+            return 0
+
+        cancelled_exams = Exam.get_multi_not_listed(
+            db, listed_exam_ids=listed_exam_ids, exam_start__min=datetime.utcnow()
+        )
+        for exam in cancelled_exams:
+            db.add(ExamEvent(event_type=ExamEventType.cancelled, exam_id=exam.exam_id, details=exam.status))
+            exam.status = Exam.cancelled_status
+            db.add(exam)
 
-        logger.info("Parse exam detail table...")
-        soup = BeautifulSoup(self.exam_detail_response.content.decode("utf-8"), "html.parser")
-        tables = soup.select("#pruefungverwaltung > div:nth-child(2) > div.rf-p-b > div > div.rf-p-b")
-        logger.debug(f"Found {len(tables)} tables!")
+        return len(cancelled_exams)
 
-        rows = list()
-        for table in tables:
-            raw_table_data = self._extract_detail_table(table)
+    def iter_exams(self) -> Iterator[ExamRecord]:
+        """Parse the exams one by one from the saved pages.
+
+        With a streaming parser backend only the current exam table is kept in memory.
+        """
+        return self._iter_exams(
+            self._iter_page_chunks(self.exam_overview_page), self._iter_page_chunks(self.exam_detail_page)
+        )
+
+    def parse_exams(self, overview_content: bytes, detail_content: bytes) -> List[ExamRecord]:
+        """Parse the exams from the content of the overview page and the printing view."""
+        return list(self._iter_exams([overview_content], [detail_content]))
+
+    def _iter_exams(self, overview_chunks: Iterable[bytes], detail_chunks: Iterable[bytes]) -> Iterator[ExamRecord]:
+        logger.info(f"Parse exam overview table with {self.parser.name}...")
+        overview_index = self._index_overview_table(self.parser.iter_overview_table(overview_chunks))
+        logger.info("Parsed exam overview table!")
+
+        logger.info(f"Parse exam detail tables with {self.parser.name}...")
+        tables_count = 0
+        unmatched_tables = list()
+        for raw_table_data in self.parser.iter_detail_tables(detail_chunks):
+            tables_count += 1
 
             # get the district by exam overview table
-            district = self._match_overview_table_row(overview_values, raw_table_data)
+            district = overview_index.get(self._get_detail_table_key(raw_table_data))
+            if not district:
+                unmatched_tables.append(raw_table_data)
+                self.unmatched_exam_ids.add(raw_table_data["Prüfungs-Nr."])
+                continue
 
             # create exam datetime and localize it
             exam_start_str = f'{raw_table_data["Prüfungstermin"]} {raw_table_data["Prüfungsbeginn"]}'
@@ -460,72 +1310,67 @@ class ExamTableScraper:
             # exam_start = utils.localize_dt_to_utc(exam_start_dt)
             exam_start = exam_start_dt
 
-            rows.append(
-                Exam(
-                    exam_id=raw_table_data["Prüfungs-Nr."],
-                    name=raw_table_data["Prüfungslokal"],
-                    street=raw_table_data["Straße"],
-                    street_number=raw_table_data["Haus-Nr."],
-                    city=raw_table_data["Ort"],
-                    postal_code=raw_table_data["PLZ"],
-                    district=district,
-                    exam_start=exam_start,
-                    min_participants=int(raw_table_data["Min. Teilnehmer"]),
-                    max_participants=int(raw_table_data["Max. Teilnehmer"]),
-                    current_participants=int(raw_table_data["Aktuelle Teilnehmer"]),
-                    status=raw_table_data["Status"],
-                    disabled_access=bool(raw_table_data["Behindertengerecht"]),
-                    headphones=bool(raw_table_data["Kopfhörer"]),
-                )  # type: ignore
+            yield ExamRecord(
+                exam_id=raw_table_data["Prüfungs-Nr."],
+                name=raw_table_data["Prüfungslokal"],
+                street=raw_table_data["Straße"],
+                street_number=raw_table_data["Haus-Nr."],
+                city=raw_table_data["Ort"],
+                postal_code=raw_table_data["PLZ"],
+                district=district,
+                exam_start=exam_start,
+                min_participants=int(raw_table_data["Min. Teilnehmer"]),
+                max_participants=int(raw_table_data["Max. Teilnehmer"]),
+                current_participants=int(raw_table_data["Aktuelle Teilnehmer"]),
+                status=raw_table_data["Status"],
+                disabled_access=bool(raw_table_data["Behindertengerecht"]),
+                headphones=bool(raw_table_data["Kopfhörer"]),
             )
 
-        if len(tables) != len(rows):
-            raise Exception(f"Number of tables ({len(tables)}) does not match number of rows ({len(rows)})!")
+        logger.debug(f"Parsed {tables_count} exam tables!")
+        if unmatched_tables:
+            self._report_unmatched_tables(unmatched_tables)
 
-        return rows
+    @staticmethod
+    def _get_overview_row_key(row: Dict[str, str]) -> Tuple[str, str, str]:
+        return row["Prüfungslokal"], row["Ort"], row["Prüfungstermin"]
 
-    def _match_overview_table_row(self, overview_table: List[Dict[str, str]], detail_table: Dict[str, str]) -> District:
+    @staticmethod
+    def _get_detail_table_key(detail_table: Dict[str, str]) -> Tuple[str, str, str]:
+        return (
+            detail_table["Prüfungslokal"],
+            detail_table["Ort"],
+            f'{detail_table["Prüfungstermin"]}, {detail_table["Prüfungsbeginn"]}',
+        )
+
+    def _index_overview_table(self, overview_table: Iterable[Dict[str, str]]) -> Dict[Tuple[str, str, str], District]:
+        """Index the districts of the overview rows by (Prüfungslokal, Ort, Prüfungstermin).
+
+        Rows with the same key are common (e.g. several rooms at the same time) and are fine as long as they
+        share the district. Keys with conflicting districts can't be matched and are left out of the index.
+        """
+        index: Dict[Tuple[str, str, str], District] = dict()
+        ambiguous_keys = set()
         for row in overview_table:
-            if row["Prüfungslokal"] != detail_table["Prüfungslokal"]:
-                continue
-            if row["Ort"] != detail_table["Ort"]:
-                continue
-            if row["Prüfungstermin"] != f'{detail_table["Prüfungstermin"]}, {detail_table["Prüfungsbeginn"]}':
-                continue
-            return District(row["Regierungsbezirk"])
-        raise Exception(f"Could not match row {detail_table}")
-
-    def _extract_overview_table(self, table_soup: BeautifulSoup) -> List[Dict[str, str]]:
-        exam_table_selector = "#pruefungsterminSearch\:pruefungsterminList > tbody > tr"
-        table_rows = table_soup.select(exam_table_selector)
-        logger.info(f"Found {len(table_rows)} exams...")
-
-        rows = list()
-        for row in table_rows:
-            rows.append(self._extract_table_row(row))
-        return rows
-
-    def _extract_table_row(self, row) -> Dict[str, str]:
-        columns = row.select("td")
-        table_row = dict()
-        for name, col in zip(self.exam_overview_columns, columns):
-            table_row[name] = col.text.strip()
-        return table_row
-
-    def _extract_detail_table(self, table_soup) -> Dict[str, str]:
-        """Extract the details of an exam table"""
-        table_names = table_soup.select(".prop > .name")
-        table_values = table_soup.select(".prop > .value")
-        table_row = dict()
-        for name, value in zip(table_names, table_values):
-            val = value.text.strip()
-            if not val:
-                try:
-                    val = value.select(".checkbox")[0].get("checked", "")
-                except KeyError as e:
-                    val = None
-            table_row[name.text.strip()] = val
-        return table_row
+            key = self._get_overview_row_key(row)
+            district = District(row["Regierungsbezirk"])
+            if key in index and index[key] != district:
+                ambiguous_keys.add(key)
+            index[key] = district
+
+        if ambiguous_keys:
+            logger.warning(f"Found {len(ambiguous_keys)} overview rows with conflicting districts: {ambiguous_keys}")
+            for key in ambiguous_keys:
+                del index[key]
+
+        return index
+
+    def _report_unmatched_tables(self, unmatched_tables: List[Dict[str, str]]) -> None:
+        """Report all detail tables without a matching overview row at once. The tables are skipped."""
+        unmatched_keys = [self._get_detail_table_key(table) for table in unmatched_tables]
+        message = f"Could not match {len(unmatched_tables)} exam(s) to the overview table: {unmatched_keys}"
+        logger.warning(message)
+        utils.notify_admin_via_gchat(message)
 
 
 class GSheetTable:
@@ -1,50 +1,154 @@
+import hashlib
 import smtplib
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
 from email.message import EmailMessage
+from typing import Dict, Iterator, List, Optional
 
 import pandas as pd
+import requests
 from loguru import logger
 from mailersend import emails
 from sqlmodel import Session
 
 from fishing_exam_alert import db, models
+from fishing_exam_alert.render import MailRenderer
 from fishing_exam_alert.settings import setting
 
+GMX_SMTP_HOST = "mail.gmx.net"
+GMX_SMTP_PORT = 587
 
-def notify(email_to: str, exams: pd.DataFrame):
-    """Notify the email address with information"""
+_local = threading.local()  # the open delivery session of the thread, see `delivery_session`
 
-    # construct the message body
-    email_to_username = email_to.split("@")[0]  # removes for example @gmail.de
-    pre_message_plain = f"""
-    Hi {email_to_username},\n
-    es gibt {len(exams)} Prüfung(en), die deinen Filterkriterien entsprechen:\n\n
-    """
-    post_message_plain = f"""\n
-    Du kannst dich hier für die Fischerprüfungen anmelden: {setting.EXAM_SCRAP_URL}.
-    \n\n
-    Du bekommst diese Mail, weil du dich für die "Fischerprüfung Updates" angemeldet hast.\n
-    Wenn du keine Benachrichtigungen mehr erhalten möchtest 
-    oder du fälschlicherweise diese Mail erhalten hast, 
-    kannst du dich hier abmelden: {setting.UNSUBSCRIBE_URL}.
+
+class SmtpSession:
+    """An authenticated SMTP connection that sends many messages.
+
+    The connection is opened with the first message and reopened transparently if the server closed it in
+    between, e.g. after an idle timeout. The send latency of each message is logged.
     """
-    plain_message = pre_message_plain + exams.to_string() + post_message_plain
 
-    pre_message_html = f"""
-    Hi {email_to_username},<br/>
-    es gibt {len(exams)} Prüfung(en), die deinen Filterkriterien entsprechen:<br/><br/>
+    def __init__(
+        self,
+        host: str = GMX_SMTP_HOST,
+        port: int = GMX_SMTP_PORT,
+        user: Optional[str] = None,
+        password: Optional[str] = None,
+    ):
+        self.host = host
+        self.port = port
+        self.user = user or setting.NOTIFY_MAIL_FROM
+        self.password = password or setting.NOTIFY_MAIL_PASSWORD
+        self.connections_count = 0
+        self.sent_count = 0
+        self.send_seconds = 0.0
+        self._smtp: Optional[smtplib.SMTP] = None
+
+    def connect(self) -> None:
+        self._smtp = smtplib.SMTP(self.host, port=self.port)
+        self._smtp.starttls()
+        self._smtp.login(self.user, self.password)
+        self.connections_count += 1
+
+    def send_message(self, msg: EmailMessage) -> None:
+        """Send the message, reconnect once if the server closed the connection."""
+        for attempt in range(2):
+            if self._smtp is None:
+                self.connect()
+            start = time.perf_counter()
+            try:
+                self._smtp.send_message(msg)  # type: ignore # connected above
+            except smtplib.SMTPServerDisconnected:
+                self._smtp = None
+                if attempt:
+                    raise
+                logger.info(f"SMTP server {self.host} closed the connection. Reconnect...")
+                continue
+
+            seconds = time.perf_counter() - start
+            self.sent_count += 1
+            self.send_seconds += seconds
+            logger.debug(f"Sent mail to {msg['To']} in {seconds * 1000:.0f} ms")
+            return
+
+    def close(self) -> None:
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except smtplib.SMTPServerDisconnected:
+                pass
+            self._smtp = None
+        if self.sent_count:
+            logger.info(
+                f"Sent {self.sent_count} mails over {self.connections_count} SMTP connections "
+                f"({self.send_seconds / self.sent_count * 1000:.0f} ms per mail)"
+            )
+
+    def __enter__(self) -> "SmtpSession":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+@contextmanager
+def delivery_session() -> Iterator[None]:
+    """Send the mails of the current thread within the block over one SMTP session (GMX only)."""
+    if setting.MAIL_SERVICE != "GMX" or getattr(_local, "smtp_session", None) is not None:
+        yield
+        return
+
+    with SmtpSession() as smtp_session:
+        _local.smtp_session = smtp_session
+        try:
+            yield
+        finally:
+            _local.smtp_session = None
+
+
+def get_exams_fingerprint(exams: pd.DataFrame) -> str:
+    """Get a hash of the exams a notification reports: the sorted set of exam ids and seat states.
+
+    It doesn't depend on how the mail is rendered, so changing the wording or the columns doesn't resend mails.
     """
-    post_message_html = f"""<br/>
-    Du kannst dich hier für die Fischerprüfungen anmelden: <a href="{setting.EXAM_SCRAP_URL}">{setting.EXAM_SCRAP_URL}</a>.
-    <br/><br/>
-    Du bekommst diese Mail, weil du dich für die "Fischerprüfung Updates" angemeldet hast.
-    <br/>
-    Wenn du keine Benachrichtigungen mehr erhalten möchtest 
-    oder du fälschlicherweise diese Mail erhalten hast, 
-    kannst du dich <a href="{setting.UNSUBSCRIBE_URL}">hier</a> abmelden.
+    seat_states = sorted(
+        {
+            f"{exam_id}|{status}|{current_participants}/{max_participants}"
+            for exam_id, status, current_participants, max_participants in zip(
+                exams["exam_id"], exams["status"], exams["current_participants"], exams["max_participants"]
+            )
+        }
+    )
+    return hashlib.sha256("\n".join(seat_states).encode()).hexdigest()
+
+
+def notify(
+    db: Session, user: models.User, exams: pd.DataFrame, renderer: Optional[MailRenderer] = None
+) -> Optional[models.OutboxMessage]:
+    """Notify the user about the matched exams: enqueue the mail into the outbox (see `outbox.OutboxDelivery`).
+
+    Pass the renderer of the run, so the exams are rendered once for all users. The session is not committed, so
+    the caller can commit the mail together with what it reports. Returns None if the latest notification of the
+    user reported the same exams and seat states.
     """
-    html_message = pre_message_html + exams.to_html(render_links=True, col_space=100) + post_message_html
+    fingerprint = get_exams_fingerprint(exams)
+    if models.EmailLog.get_latest_fingerprint(db, user_id=user.id) == fingerprint:  # type: ignore
+        logger.info(f"Skip notifying '{user.email}' because the same exams were already sent.")
+        return None  # don't send duplicate notifications
 
-    send_mail(email_to, f"Fischerprüfung Updates - Es gibt {len(exams)} freie Termine!", plain_message, html_message)
+    subject, plain_message, html_message = (renderer or MailRenderer()).render(user.email, exams)
+    return models.OutboxMessage.enqueue(
+        db,
+        user.email,
+        subject,
+        plain_message,
+        html_message,
+        user_id=user.id,
+        fingerprint=fingerprint,
+        exam_ids=[int(exam_id) for exam_id in exams["id"]],
+    )
 
 
 def send_unsubscribe_mail(email_to: str):
@@ -123,10 +227,7 @@ def send_mail(email_to: str, subject: str, message: str, html_message: str = "",
             logger.info(f"Skip sending mail to '{email_to}' with {subject =} because it was already sent.")
             return  # don't send duplicate mail content
 
-    if setting.MAIL_SERVICE == "mailersend":
-        send_mail_with_mailersend(email_to, subject, message, html_message)
-    else:
-        send_mail_with_gmx(email_to, subject, message, html_message)
+    send_message(email_to, subject, message, html_message)
 
     with Session(db.engine) as session:
         user, created = models.User.get_or_create(session, email=email_to)
@@ -136,11 +237,19 @@ def send_mail(email_to: str, subject: str, message: str, html_message: str = "",
         session.commit()
 
 
-def send_mail_with_mailersend(email_to: str, subject: str, message: str, html_message: str = ""):
-    """Send a mail with mailersend. Optional with HTML content."""
+def send_message(email_to: str, subject: str, message: str, html_message: str = ""):
+    """Send a mail with the configured mail service, without the duplicate check and the log."""
+    if setting.MAIL_SERVICE == "mailersend":
+        send_mail_with_mailersend(email_to, subject, message, html_message)
+    else:
+        send_mail_with_gmx(email_to, subject, message, html_message)
+
+
+def get_mailersend_body(email_to: str, subject: str, message: str, html_message: str = "") -> dict:
+    """Get the mailersend API body of a mail. Optional with HTML content."""
     mailer = emails.NewEmail(setting.NOTIFY_MAIL_PASSWORD)
 
-    mail_body = {}
+    mail_body: dict = {}
     mail_from = {
         # "name": "Your Name",
         "email": setting.NOTIFY_MAIL_FROM,
@@ -168,8 +277,179 @@ def send_mail_with_mailersend(email_to: str, subject: str, message: str, html_me
         ]
         mailer.set_reply_to(reply_to, mail_body)
 
+    return mail_body
+
+
+def send_mail_with_mailersend(email_to: str, subject: str, message: str, html_message: str = ""):
+    """Send a mail with mailersend. Optional with HTML content."""
+    mailer = emails.NewEmail(setting.NOTIFY_MAIL_PASSWORD)
+    mailer.api_base = setting.MAILERSEND_API_BASE
+
     # using print() will also return status code and data
-    mailer.send(mail_body)
+    mailer.send(get_mailersend_body(email_to, subject, message, html_message))
+
+
+class BulkMail:
+    """A mail of a `MailersendBatch` with its delivery status: queued, submitted, sent or failed.
+
+    A submitted mail was accepted as message `index` of the bulk email `bulk_email_id`, but its result is not known
+    yet. It must not be sent again, only polled (see `MailersendBatch.poll`).
+    """
+
+    def __init__(self, email_to: str, body: dict, bulk_email_id: Optional[str] = None, index: Optional[int] = None):
+        self.email_to = email_to
+        self.body = body
+        self.bulk_email_id = bulk_email_id
+        self.index = index
+        self.status = "submitted" if bulk_email_id else "queued"
+        self.error = ""
+        self.attempts = 0
+
+
+class MailersendBatch:
+    """Collects mails and submits them through the bulk endpoint of mailersend in chunks of `chunk_size`.
+
+    The bulk endpoint accepts the mails asynchronously, so the status of each chunk is polled until it completed.
+    Only mails whose request failed (or whose bulk email failed) are retried with exponential backoff; mails of an
+    accepted chunk are never submitted again, so a chunk that completes late doesn't send duplicates. Mails
+    rejected by validation or suppressed recipients are not retried.
+    """
+
+    bulk_endpoint = "bulk-email"
+    final_states = ("completed", "failed")
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        api_base: Optional[str] = None,
+        chunk_size: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        backoff_seconds: float = 2.0,
+        poll_interval_seconds: float = 1.0,
+        poll_timeout_seconds: float = 120.0,
+    ):
+        self.headers = emails.NewEmail(api_key or setting.NOTIFY_MAIL_PASSWORD).headers_default
+        self.api_base = api_base or setting.MAILERSEND_API_BASE
+        self.chunk_size = chunk_size or setting.MAILERSEND_BULK_CHUNK_SIZE
+        self.max_retries = max_retries if max_retries is not None else setting.MAILERSEND_BULK_MAX_RETRIES
+        self.backoff_seconds = backoff_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+        self.poll_timeout_seconds = poll_timeout_seconds
+        self.mails: List[BulkMail] = []
+        self.requests_count = 0
+        self._session = requests.Session()
+
+    def add(self, email_to: str, subject: str, message: str, html_message: str = "") -> BulkMail:
+        mail = BulkMail(email_to, get_mailersend_body(email_to, subject, message, html_message))
+        self.mails.append(mail)
+        return mail
+
+    def flush(self) -> List[BulkMail]:
+        """Send the queued mails. Returns them with their status.
+
+        Mails whose bulk email did not complete within the poll timeout stay submitted; poll them later.
+        """
+        mails, self.mails = self.mails, []
+        pending = mails
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                logger.info(f"Retry {len(pending)} mails in {self.backoff_seconds * 2 ** (attempt - 1):.0f} s...")
+                time.sleep(self.backoff_seconds * 2 ** (attempt - 1))
+
+            for i in range(0, len(pending), self.chunk_size):
+                self._send_chunk(pending[i : i + self.chunk_size])
+            pending = [mail for mail in pending if mail.status == "queued"]
+            if not pending:
+                break
+
+        for mail in pending:
+            mail.status = "failed"
+        statuses = Counter(mail.status for mail in mails)
+        if mails:
+            logger.info(f"Sent {statuses['sent']} of {len(mails)} mails in {self.requests_count} mailersend requests")
+        if statuses["submitted"]:
+            logger.warning(f"The result of {statuses['submitted']} submitted mails is not known yet")
+        for mail in mails:
+            if mail.status == "failed":
+                logger.error(f"Could not send mail to {mail.email_to}: {mail.error}")
+        return mails
+
+    def poll(self, mails: List[BulkMail]) -> None:
+        """Poll the bulk emails of the submitted mails until they are final or the poll timeout expired.
+
+        Mails of a bulk email that is not final yet stay submitted; mails of a failed bulk email are queued again.
+        """
+        mails_by_bulk_email: Dict[str, List[BulkMail]] = defaultdict(list)
+        for mail in mails:
+            if mail.status == "submitted":
+                mails_by_bulk_email[mail.bulk_email_id].append(mail)  # type: ignore # submitted mails have an id
+
+        for bulk_email_id, bulk_mails in mails_by_bulk_email.items():
+            try:
+                bulk_email = self._get_bulk_email(bulk_email_id)
+            except (requests.RequestException, KeyError, ValueError) as e:
+                for mail in bulk_mails:
+                    mail.error = f"{type(e).__name__}: {e}"
+                continue
+            self._set_results(bulk_email_id, bulk_email, bulk_mails)
+
+    def _send_chunk(self, chunk: List[BulkMail]) -> None:
+        """Submit the chunk and poll its result. Mails of a failed request stay queued."""
+        for mail in chunk:
+            mail.attempts += 1
+        try:
+            response = self._request("post", self.bulk_endpoint, json=[mail.body for mail in chunk])
+            bulk_email_id = response["bulk_email_id"]
+        except (requests.RequestException, KeyError, ValueError) as e:
+            for mail in chunk:
+                mail.error = f"{type(e).__name__}: {e}"
+            return
+
+        for i, mail in enumerate(chunk):
+            mail.status, mail.bulk_email_id, mail.index, mail.error = "submitted", bulk_email_id, i, ""
+        self.poll(chunk)
+
+    def _get_bulk_email(self, bulk_email_id: str) -> dict:
+        bulk_email = self._request("get", f"{self.bulk_endpoint}/{bulk_email_id}")["data"]
+        deadline = time.monotonic() + self.poll_timeout_seconds
+        while bulk_email["state"] not in self.final_states and time.monotonic() < deadline:
+            time.sleep(self.poll_interval_seconds)
+            bulk_email = self._request("get", f"{self.bulk_endpoint}/{bulk_email_id}")["data"]
+        return bulk_email
+
+    @staticmethod
+    def _set_results(bulk_email_id: str, bulk_email: dict, mails: List[BulkMail]) -> None:
+        if bulk_email["state"] == "failed":
+            for mail in mails:
+                mail.status, mail.bulk_email_id, mail.index = "queued", None, None
+                mail.error = f"bulk email {bulk_email_id} failed"
+            return
+        if bulk_email["state"] != "completed":
+            for mail in mails:
+                mail.error = f"bulk email {bulk_email_id} is {bulk_email['state']}"
+            return
+
+        # the errors are keyed by the message index within the chunk, e.g. "message.1.to.0.email"
+        rejected: Dict[int, str] = dict()
+        for key, errors in (bulk_email.get("validation_errors") or dict()).items():
+            rejected[int(key.split(".")[1])] = "; ".join(errors)
+        suppressed_recipients = {
+            suppressed.get("email") for suppressed in bulk_email.get("suppressed_recipients") or []
+        }
+
+        for mail in mails:
+            if mail.index in rejected:
+                mail.status, mail.error = "failed", rejected[mail.index]  # type: ignore # index is set
+            elif mail.email_to in suppressed_recipients:
+                mail.status, mail.error = "failed", "suppressed recipient"
+            else:
+                mail.status, mail.error = "sent", ""
+
+    def _request(self, method: str, endpoint: str, **kwargs) -> dict:
+        self.requests_count += 1
+        response = self._session.request(method, f"{self.api_base}/{endpoint}", headers=self.headers, **kwargs)
+        response.raise_for_status()
+        return response.json()
 
 
 def send_mail_with_gmx(email_to: str, subject: str, message: str, html_message: str = ""):
@@ -183,7 +463,10 @@ def send_mail_with_gmx(email_to: str, subject: str, message: str, html_message:
     msg["To"] = email_to
     # TODO: add reply_to for gmx
 
-    with smtplib.SMTP("mail.gmx.net", port=587) as s:
-        s.starttls()
-        s.login(setting.NOTIFY_MAIL_FROM, setting.NOTIFY_MAIL_PASSWORD)
-        s.send_message(msg)
+    smtp_session = getattr(_local, "smtp_session", None)
+    if smtp_session is not None:
+        smtp_session.send_message(msg)
+        return
+
+    with SmtpSession() as smtp_session:
+        smtp_session.send_message(msg)
@@ -0,0 +1,171 @@
+import queue
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import sqlmodel
+from loguru import logger
+
+from fishing_exam_alert import models, notifier, utils
+from fishing_exam_alert.settings import setting
+
+OutboxJob = Tuple[int, str, str, str, str]  # (message id, email to, subject, content, HTML content)
+
+
+class OutboxDelivery:
+    """Drains the outbox: sends the due messages with a pool of worker threads.
+
+    Each worker sends over its own delivery session (see `notifier.delivery_session`), while only the calling
+    thread touches the database: it claims the messages, hands them to the workers and records each result as
+    soon as it arrives. Failed messages are retried with exponential backoff by later drains and dead-lettered
+    after the max. attempts. With mailersend bulk sending, the claimed messages are submitted in bulk instead;
+    messages whose bulk email did not complete yet stay submitted and are polled by the next drains. If it does
+    not complete within the lease, they are dead-lettered without sending them again.
+
+    A message is marked as sent right after it was sent. Only a crash between both sends it again once the
+    lease expired.
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        max_attempts: Optional[int] = None,
+        backoff_seconds: Optional[float] = None,
+        lease_minutes: Optional[float] = None,
+        claim_size: int = 100,
+    ):
+        self.max_workers = max_workers or setting.OUTBOX_MAX_WORKERS
+        self.max_attempts = max_attempts or setting.OUTBOX_MAX_ATTEMPTS
+        self.backoff = timedelta(
+            seconds=backoff_seconds if backoff_seconds is not None else setting.OUTBOX_BACKOFF_SECONDS
+        )
+        self.lease = timedelta(minutes=lease_minutes if lease_minutes is not None else setting.OUTBOX_LEASE_MINUTES)
+        self.claim_size = claim_size
+        self._dead_letters: List[str] = list()
+
+    def drain(self, db: sqlmodel.Session) -> Dict[models.OutboxStatus, int]:
+        """Send all due messages. Returns the number of attempts by their resulting status."""
+        released_count = models.OutboxMessage.release_stale(db, lease=self.lease)
+        if released_count:
+            logger.warning(f"Released {released_count} outbox messages whose delivery didn't finish")
+
+        results: Dict[models.OutboxStatus, int] = Counter()
+        self._dead_letters = list()
+        submitted_messages = models.OutboxMessage.get_submitted(db)
+        if submitted_messages:
+            results.update(self._poll_submitted(db, submitted_messages))
+        while True:
+            messages = models.OutboxMessage.claim_due(db, limit=self.claim_size)
+            if not messages:
+                break
+
+            if setting.MAIL_SERVICE == "mailersend" and setting.MAILERSEND_BULK:
+                results.update(self._deliver_bulk(db, messages))
+            else:
+                results.update(self._deliver_with_workers(db, messages))
+
+        if self._dead_letters:
+            report = "\n".join(self._dead_letters)
+            utils.notify_admin_via_gchat(
+                f"{len(self._dead_letters)} mails could not be sent and were dead-lettered:\n{report}"
+            )
+        return results
+
+    def _deliver_with_workers(
+        self, db: sqlmodel.Session, messages: List[models.OutboxMessage]
+    ) -> List[models.OutboxStatus]:
+        jobs: "queue.Queue[OutboxJob]" = queue.Queue()
+        for message in messages:
+            jobs.put((message.id, message.email_to, message.subject, message.content, message.html_content))
+        results: "queue.Queue[Tuple[int, Optional[str]]]" = queue.Queue()
+
+        messages_by_id = {message.id: message for message in messages}
+        statuses = list()
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(messages))) as executor:
+            for _ in range(min(self.max_workers, len(messages))):
+                executor.submit(self._work, jobs, results)
+
+            for _ in range(len(messages)):
+                message_id, error = results.get()
+                statuses.append(self._record(db, messages_by_id[message_id], error))
+                db.commit()
+        return statuses
+
+    @staticmethod
+    def _work(jobs: "queue.Queue[OutboxJob]", results: "queue.Queue[Tuple[int, Optional[str]]]") -> None:
+        with notifier.delivery_session():
+            while True:
+                try:
+                    message_id, email_to, subject, content, html_content = jobs.get_nowait()
+                except queue.Empty:
+                    return
+
+                try:
+                    notifier.send_message(email_to, subject, content, html_content)
+                except Exception as e:
+                    results.put((message_id, f"{type(e).__name__}: {e}"))
+                else:
+                    results.put((message_id, None))
+
+    def _deliver_bulk(self, db: sqlmodel.Session, messages: List[models.OutboxMessage]) -> List[models.OutboxStatus]:
+        batch = notifier.MailersendBatch(max_retries=0)  # the outbox retries the failed mails
+        for message in messages:
+            batch.add(message.email_to, message.subject, message.content, message.html_content)
+
+        statuses = [self._record_bulk_mail(db, message, mail) for message, mail in zip(messages, batch.flush())]
+        db.commit()
+        return statuses
+
+    def _poll_submitted(
+        self, db: sqlmodel.Session, messages: List[models.OutboxMessage], now: Optional[datetime] = None
+    ) -> List[models.OutboxStatus]:
+        """Poll the results of the messages submitted by earlier drains."""
+        batch = notifier.MailersendBatch(poll_timeout_seconds=0)
+        mails = [
+            notifier.BulkMail(message.email_to, dict(), message.bulk_email_id, message.bulk_email_index)
+            for message in messages
+        ]
+        batch.poll(mails)
+
+        now = now or datetime.utcnow()
+        statuses = list()
+        for message, mail in zip(messages, mails):
+            if mail.status == "submitted" and message.claimed_at > now - self.lease:  # type: ignore
+                continue  # poll it again by the next drain
+            statuses.append(self._record_bulk_mail(db, message, mail))
+        db.commit()
+        return statuses
+
+    def _record_bulk_mail(
+        self, db: sqlmodel.Session, message: models.OutboxMessage, mail: notifier.BulkMail
+    ) -> models.OutboxStatus:
+        """Record the result of a bulk mail. The changes are not committed."""
+        if mail.status == "sent":
+            return self._record(db, message, None)
+        if mail.status != "submitted":
+            return self._record(db, message, mail.error)
+        if message.status == models.OutboxStatus.sending:
+            message.set_submitted(db, mail.bulk_email_id, mail.index)  # type: ignore # submitted mails have both
+            return message.status
+
+        # it may have been sent, so it is not sent again
+        error = f"The result of bulk email {mail.bulk_email_id} is unknown: {mail.error}"
+        message.set_dead(db, error)
+        logger.error(f"Gave up polling the mail to {message.email_to}: {error}")
+        self._dead_letters.append(f"- {message.email_to}: {error}")
+        return message.status
+
+    def _record(self, db: sqlmodel.Session, message: models.OutboxMessage, error: Optional[str]) -> models.OutboxStatus:
+        """Record the result of an attempt. The changes are not committed."""
+        if error is None:
+            message.set_sent(db)
+            return message.status
+
+        message.set_failed(db, error, max_attempts=self.max_attempts, backoff=self.backoff)
+        if message.status == models.OutboxStatus.dead:
+            logger.error(f"Gave up sending mail to {message.email_to} after {message.attempts} attempts: {error}")
+            self._dead_letters.append(f"- {message.email_to}: {error}")
+        else:
+            logger.warning(f"Could not send mail to {message.email_to} (attempt {message.attempts}): {error}")
+        return message.status
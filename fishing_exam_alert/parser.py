@@ -0,0 +1,448 @@
+import codecs
+from abc import ABC, abstractmethod
+from html.parser import HTMLParser
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Type
+
+from bs4 import BeautifulSoup
+
+# selectors of the overview page and the "printing view" (detail page) of the exam site
+OVERVIEW_TABLE_ROW_SELECTOR = r"#pruefungsterminSearch\:pruefungsterminList > tbody > tr"
+DETAIL_TABLE_SELECTOR = "#pruefungverwaltung > div:nth-child(2) > div.rf-p-b > div > div.rf-p-b"
+SEARCH_FORM_ID = "pruefungsterminSearch"
+
+
+class SearchForm(NamedTuple):
+    """The values of the search form that are needed to request the printing view."""
+
+    csrf_token: str
+    submit_btn_name: str  # e.g. pruefungsterminSearch:j_idt195
+    action: str  # e.g. /fprApp/verwaltung/Pruefungssuche?execution=e1s1
+    view_state: str  # e.g. e1s1
+
+
+class ExamHtmlParser(ABC):
+    """Extracts the raw values of the exam tables from the HTML of the exam site.
+
+    Every backend must return exactly the same values, so the backend can be switched
+    with the setting `EXAM_PARSER_BACKEND` without changing the parsed exams.
+    """
+
+    name: str = ""
+    exam_overview_columns: List[str] = ["", "Prüfungstermin", "Prüfungslokal", "Ort", "Regierungsbezirk", "Teilnehmer"]
+
+    @abstractmethod
+    def extract_search_form(self, content: bytes) -> SearchForm:
+        """Get the CSRF-Token, the "Druckansicht" submit button, the action and the JSF view state of the form."""
+
+    @abstractmethod
+    def extract_overview_table(self, content: bytes) -> List[Dict[str, str]]:
+        """Get the rows of the exam overview table."""
+
+    @abstractmethod
+    def extract_detail_tables(self, content: bytes) -> List[Dict[str, Optional[str]]]:
+        """Get the values of each exam table of the printing view."""
+
+    def extract_search_form_from_chunks(self, chunks: Iterable[bytes]) -> SearchForm:
+        """Like `extract_search_form`, but for a page that is read in chunks.
+
+        Backends that build a DOM need the whole page, so by default the chunks are joined first.
+        """
+        return self.extract_search_form(b"".join(chunks))
+
+    def iter_overview_table(self, chunks: Iterable[bytes]) -> Iterator[Dict[str, str]]:
+        """Like `extract_overview_table`, but for a page that is read in chunks."""
+        yield from self.extract_overview_table(b"".join(chunks))
+
+    def iter_detail_tables(self, chunks: Iterable[bytes]) -> Iterator[Dict[str, Optional[str]]]:
+        """Like `extract_detail_tables`, but for a page that is read in chunks."""
+        yield from self.extract_detail_tables(b"".join(chunks))
+
+
+class BeautifulSoupExamParser(ExamHtmlParser):
+    """Parser backend based on BeautifulSoup with the given tree builder (e.g. "html.parser" or "lxml")."""
+
+    def __init__(self, features: str = "html.parser"):
+        self.name = features
+        self.features = features
+
+    def extract_search_form(self, content: bytes) -> SearchForm:
+        soup = self._get_soup(content)
+
+        csrf_input_field = soup.find("input", {"name": "_csrf"})
+        if not csrf_input_field:
+            raise Exception("CSRF input field not found!")
+
+        submit_btn_tag = soup.find("input", {"type": "submit", "value": "Druckansicht"})
+        if not submit_btn_tag:
+            raise Exception("Submit button not found!")
+
+        form_tag = soup.find("form", {"id": SEARCH_FORM_ID})
+        view_state_input_field = soup.find("input", {"name": "javax.faces.ViewState"})
+        if not form_tag or not view_state_input_field:
+            raise Exception("Search form not found!")
+
+        return SearchForm(
+            csrf_token=csrf_input_field["value"],
+            submit_btn_name=submit_btn_tag.attrs["name"],
+            action=form_tag.attrs["action"],
+            view_state=view_state_input_field["value"],
+        )
+
+    def extract_overview_table(self, content: bytes) -> List[Dict[str, str]]:
+        soup = self._get_soup(content)
+        return [self._extract_table_row(row) for row in soup.select(OVERVIEW_TABLE_ROW_SELECTOR)]
+
+    def extract_detail_tables(self, content: bytes) -> List[Dict[str, Optional[str]]]:
+        soup = self._get_soup(content)
+        return [self._extract_detail_table(table) for table in soup.select(DETAIL_TABLE_SELECTOR)]
+
+    def _get_soup(self, content: bytes) -> BeautifulSoup:
+        return BeautifulSoup(content.decode("utf-8"), self.features)
+
+    def _extract_table_row(self, row) -> Dict[str, str]:
+        columns = row.select("td")
+        table_row = dict()
+        for name, col in zip(self.exam_overview_columns, columns):
+            table_row[name] = col.text.strip()
+        return table_row
+
+    def _extract_detail_table(self, table_soup) -> Dict[str, Optional[str]]:
+        """Extract the details of an exam table"""
+        table_names = table_soup.select(".prop > .name")
+        table_values = table_soup.select(".prop > .value")
+        table_row: Dict[str, Optional[str]] = dict()
+        for name, value in zip(table_names, table_values):
+            val = value.text.strip()
+            if not val:
+                checkboxes = value.select(".checkbox")
+                val = checkboxes[0].get("checked", "") if checkboxes else None
+            table_row[name.text.strip()] = val
+        return table_row
+
+
+class SelectolaxExamParser(ExamHtmlParser):
+    """Parser backend based on selectolax (requires `pip install selectolax`)."""
+
+    name = "selectolax"
+
+    def __init__(self):
+        from selectolax.lexbor import LexborHTMLParser
+
+        self.html_parser = LexborHTMLParser
+
+    def extract_search_form(self, content: bytes) -> SearchForm:
+        tree = self.html_parser(content)
+
+        csrf_input_field = tree.css_first('input[name="_csrf"]')
+        if not csrf_input_field:
+            raise Exception("CSRF input field not found!")
+
+        submit_btn_tag = tree.css_first('input[type="submit"][value="Druckansicht"]')
+        if not submit_btn_tag:
+            raise Exception("Submit button not found!")
+
+        form_tag = tree.css_first(f"form#{SEARCH_FORM_ID}")
+        view_state_input_field = tree.css_first('input[name="javax.faces.ViewState"]')
+        if not form_tag or not view_state_input_field:
+            raise Exception("Search form not found!")
+
+        return SearchForm(
+            csrf_token=csrf_input_field.attributes["value"],
+            submit_btn_name=submit_btn_tag.attributes["name"],
+            action=form_tag.attributes["action"],
+            view_state=view_state_input_field.attributes["value"],
+        )
+
+    def extract_overview_table(self, content: bytes) -> List[Dict[str, str]]:
+        tree = self.html_parser(content)
+        return [self._extract_table_row(row) for row in tree.css(OVERVIEW_TABLE_ROW_SELECTOR)]
+
+    def extract_detail_tables(self, content: bytes) -> List[Dict[str, Optional[str]]]:
+        tree = self.html_parser(content)
+        return [self._extract_detail_table(table) for table in tree.css(DETAIL_TABLE_SELECTOR)]
+
+    def _extract_table_row(self, row) -> Dict[str, str]:
+        columns = row.css("td")
+        table_row = dict()
+        for name, col in zip(self.exam_overview_columns, columns):
+            table_row[name] = col.text().strip()
+        return table_row
+
+    def _extract_detail_table(self, table_node) -> Dict[str, Optional[str]]:
+        table_names = table_node.css(".prop > .name")
+        table_values = table_node.css(".prop > .value")
+        table_row: Dict[str, Optional[str]] = dict()
+        for name, value in zip(table_names, table_values):
+            val = value.text().strip()
+            if not val:
+                checkbox = value.css_first(".checkbox")
+                # a valueless "checked" attribute is None in selectolax but "" in BeautifulSoup
+                val = (checkbox.attributes.get("checked", "") or "") if checkbox else None
+            table_row[name.text().strip()] = val
+        return table_row
+
+
+class _Element:
+    __slots__ = ("tag", "id", "classes", "children")
+
+    def __init__(self, tag: str, attrs: Dict[str, Optional[str]]):
+        self.tag = tag
+        self.id = attrs.get("id") or ""
+        self.classes = (attrs.get("class") or "").split()
+        self.children = 0  # number of element children seen so far (for nth-child)
+
+
+class _StreamingHandler(HTMLParser):
+    """Keeps track of the open elements while the HTML is fed chunk by chunk."""
+
+    void_elements = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "wbr"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack: List[_Element] = []
+        self.child_index: List[int] = []  # 1-based index of each open element within its parent
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        attrs_dict = dict(attrs)
+        element = _Element(tag, attrs_dict)
+        if self.stack:
+            self.stack[-1].children += 1
+        self.stack.append(element)
+        self.child_index.append(self.stack[-2].children if len(self.stack) > 1 else 1)
+        self.on_start(element, attrs_dict)
+        if tag in self.void_elements:
+            self._pop()
+
+    def handle_startendtag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        self.handle_starttag(tag, attrs)
+        if tag not in self.void_elements:
+            self._pop()
+
+    def handle_endtag(self, tag: str) -> None:
+        if not any(element.tag == tag for element in self.stack):
+            return  # ignore stray end tags
+        while self.stack and self._pop().tag != tag:
+            pass
+
+    def _pop(self) -> _Element:
+        self.on_end(self.stack[-1])
+        self.child_index.pop()
+        return self.stack.pop()
+
+    def parent(self, level: int = 1) -> Optional[_Element]:
+        """Get an ancestor of the current element; level 1 is the parent."""
+        return self.stack[-1 - level] if len(self.stack) > level else None
+
+    def on_start(self, element: _Element, attrs: Dict[str, Optional[str]]) -> None:
+        pass
+
+    def on_end(self, element: _Element) -> None:
+        pass
+
+
+class _SearchFormHandler(_StreamingHandler):
+    def __init__(self):
+        super().__init__()
+        self.csrf_token: Optional[str] = None
+        self.submit_btn_name: Optional[str] = None
+        self.action: Optional[str] = None
+        self.view_state: Optional[str] = None
+
+    @property
+    def is_complete(self) -> bool:
+        return None not in (self.csrf_token, self.submit_btn_name, self.action, self.view_state)
+
+    def on_start(self, element: _Element, attrs: Dict[str, Optional[str]]) -> None:
+        if element.tag == "form" and self.action is None and element.id == SEARCH_FORM_ID:
+            self.action = attrs.get("action") or ""
+        if element.tag != "input":
+            return
+        if self.view_state is None and attrs.get("name") == "javax.faces.ViewState":
+            self.view_state = attrs.get("value") or ""
+        if self.csrf_token is None and attrs.get("name") == "_csrf":
+            self.csrf_token = attrs.get("value") or ""
+        if self.submit_btn_name is None and attrs.get("type") == "submit" and attrs.get("value") == "Druckansicht":
+            self.submit_btn_name = attrs.get("name") or ""
+
+
+class _OverviewTableHandler(_StreamingHandler):
+    """Emits the rows of `#pruefungsterminSearch:pruefungsterminList > tbody > tr`."""
+
+    def __init__(self, columns: List[str]):
+        super().__init__()
+        self.columns = columns
+        self.rows: List[Dict[str, str]] = []
+        self.row_depth: Optional[int] = None
+        self.cells: List[List[str]] = []
+        self.cell_depth: Optional[int] = None
+
+    def on_start(self, element: _Element, attrs: Dict[str, Optional[str]]) -> None:
+        if self.row_depth is None:
+            tbody, table = self.parent(1), self.parent(2)
+            if (
+                element.tag == "tr"
+                and tbody is not None
+                and tbody.tag == "tbody"
+                and table is not None
+                and table.id == "pruefungsterminSearch:pruefungsterminList"
+            ):
+                self.row_depth = len(self.stack)
+                self.cells = []
+        elif element.tag == "td" and self.cell_depth is None:
+            self.cell_depth = len(self.stack)
+            self.cells.append([])
+
+    def on_end(self, element: _Element) -> None:
+        if self.cell_depth == len(self.stack):
+            self.cell_depth = None
+        elif self.row_depth == len(self.stack):
+            self.row_depth = None
+            texts = ["".join(cell).strip() for cell in self.cells]
+            self.rows.append(dict(zip(self.columns, texts)))
+
+    def handle_data(self, data: str) -> None:
+        if self.cell_depth is not None:
+            self.cells[-1].append(data)
+
+
+class _DetailTablesHandler(_StreamingHandler):
+    """Emits the values of `#pruefungverwaltung > div:nth-child(2) > div.rf-p-b > div > div.rf-p-b`."""
+
+    def __init__(self):
+        super().__init__()
+        self.tables: List[Dict[str, Optional[str]]] = []
+        self.table_depth: Optional[int] = None
+        self.names: List[str] = []
+        self.values: List[Optional[str]] = []
+        self.prop_field: Optional[str] = None  # "name" or "value" while inside of a `.prop > .name/.value`
+        self.prop_field_depth: Optional[int] = None
+        self.texts: List[str] = []
+        self.checkbox: Optional[str] = None
+
+    def _is_detail_table(self, element: _Element) -> bool:
+        if element.tag != "div" or "rf-p-b" not in element.classes or len(self.stack) < 5:
+            return False
+        inner, outer_body, outer = self.parent(1), self.parent(2), self.parent(3)
+        root = self.parent(4)
+        return (
+            inner.tag == "div"
+            and outer_body.tag == "div"
+            and "rf-p-b" in outer_body.classes
+            and outer.tag == "div"
+            and self.child_index[-4] == 2
+            and root.id == "pruefungverwaltung"
+        )
+
+    def on_start(self, element: _Element, attrs: Dict[str, Optional[str]]) -> None:
+        if self.table_depth is None:
+            if self._is_detail_table(element):
+                self.table_depth = len(self.stack)
+                self.names, self.values = [], []
+            return
+
+        if self.prop_field is None:
+            parent = self.parent(1)
+            if parent is not None and "prop" in parent.classes:
+                for field in ("name", "value"):
+                    if field in element.classes:
+                        self.prop_field, self.prop_field_depth = field, len(self.stack)
+                        self.texts, self.checkbox = [], None
+                        break
+        elif self.prop_field == "value" and self.checkbox is None and "checkbox" in element.classes:
+            # a valueless "checked" attribute is "" like in BeautifulSoup
+            self.checkbox = (attrs.get("checked") or "") if "checked" in attrs else ""
+
+    def on_end(self, element: _Element) -> None:
+        if self.prop_field_depth == len(self.stack):
+            text = "".join(self.texts).strip()
+            if self.prop_field == "name":
+                self.names.append(text)
+            else:
+                self.values.append(text or self.checkbox)
+            self.prop_field, self.prop_field_depth = None, None
+        elif self.table_depth == len(self.stack):
+            self.tables.append(dict(zip(self.names, self.values)))
+            self.table_depth = None
+
+    def handle_data(self, data: str) -> None:
+        if self.prop_field is not None:
+            self.texts.append(data)
+
+
+class StreamingExamParser(ExamHtmlParser):
+    """Parser backend that walks the HTML chunk by chunk without building a DOM.
+
+    Only the values of the current exam table are kept in memory, so the memory usage does not grow
+    with the size of the page. Based on the `html.parser` module of the standard library.
+    """
+
+    name = "stream"
+
+    def extract_search_form(self, content: bytes) -> SearchForm:
+        return self.extract_search_form_from_chunks([content])
+
+    def extract_search_form_from_chunks(self, chunks: Iterable[bytes]) -> SearchForm:
+        handler = _SearchFormHandler()
+        for _ in self._feed(handler, chunks):
+            if handler.is_complete:
+                break
+
+        if handler.csrf_token is None:
+            raise Exception("CSRF input field not found!")
+        if handler.submit_btn_name is None:
+            raise Exception("Submit button not found!")
+        if handler.action is None or handler.view_state is None:
+            raise Exception("Search form not found!")
+
+        return SearchForm(handler.csrf_token, handler.submit_btn_name, handler.action, handler.view_state)
+
+    def extract_overview_table(self, content: bytes) -> List[Dict[str, str]]:
+        return list(self.iter_overview_table([content]))
+
+    def extract_detail_tables(self, content: bytes) -> List[Dict[str, Optional[str]]]:
+        return list(self.iter_detail_tables([content]))
+
+    def iter_overview_table(self, chunks: Iterable[bytes]) -> Iterator[Dict[str, str]]:
+        handler = _OverviewTableHandler(self.exam_overview_columns)
+        for _ in self._feed(handler, chunks):
+            yield from handler.rows
+            handler.rows.clear()
+
+    def iter_detail_tables(self, chunks: Iterable[bytes]) -> Iterator[Dict[str, Optional[str]]]:
+        handler = _DetailTablesHandler()
+        for _ in self._feed(handler, chunks):
+            yield from handler.tables
+            handler.tables.clear()
+
+    @staticmethod
+    def _feed(handler: _StreamingHandler, chunks: Iterable[bytes]) -> Iterator[None]:
+        """Feed the chunks to the handler. Yields after each chunk, so the caller can collect the results."""
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        for chunk in chunks:
+            handler.feed(decoder.decode(chunk))
+            yield
+        handler.feed(decoder.decode(b"", final=True))
+        handler.close()
+        yield
+
+
+PARSER_BACKENDS: Dict[str, Type[ExamHtmlParser]] = {
+    "html.parser": BeautifulSoupExamParser,
+    "lxml": BeautifulSoupExamParser,
+    "selectolax": SelectolaxExamParser,
+    "stream": StreamingExamParser,
+}
+
+
+def get_exam_parser(backend: str = "html.parser") -> ExamHtmlParser:
+    """Get the parser for the backend name. Raises an ImportError if the backend is not installed."""
+    if backend not in PARSER_BACKENDS:
+        raise ValueError(f"Parser backend must be one of {list(PARSER_BACKENDS)}; not {backend}!")
+
+    if PARSER_BACKENDS[backend] is BeautifulSoupExamParser:
+        if backend == "lxml":
+            import lxml  # noqa: F401 # fail early instead of on the first parse
+
+        return BeautifulSoupExamParser(features=backend)
+
+    return PARSER_BACKENDS[backend]()
@@ -0,0 +1,61 @@
+from datetime import date, datetime
+from typing import Optional
+
+import sqlmodel
+from loguru import logger
+from pytz import timezone
+
+from fishing_exam_alert import models
+from fishing_exam_alert.settings import setting
+
+QUOTA_TIMEZONE = timezone("America/Los_Angeles")  # the daily quotas of Google Maps reset at midnight Pacific Time
+
+
+class QuotaManager:
+    """Counts the billable Google Maps units per day: Distance Matrix elements and Geocoding requests.
+
+    The count is persisted in the `AppState` table, so it survives restarts. Lookups that don't fit into the
+    remaining budget are deferred; their number is kept until the next run picks them up.
+    A budget of 0 is unlimited.
+    """
+
+    def __init__(self, daily_budget: Optional[int] = None, state_key_prefix: str = "gmaps.quota"):
+        self.daily_budget = daily_budget if daily_budget is not None else setting.GMAP_DAILY_BUDGET
+        self.state_key_prefix = state_key_prefix
+
+    @property
+    def deferred_state_key(self) -> str:
+        return f"{self.state_key_prefix}.deferred"
+
+    def get_state_key(self, day: Optional[date] = None) -> str:
+        return f"{self.state_key_prefix}.{day or datetime.now(QUOTA_TIMEZONE).date()}"
+
+    def get_used(self, db: sqlmodel.Session) -> int:
+        return int(models.AppState.get_value(db, key=self.get_state_key(), default="0"))
+
+    def get_remaining(self, db: sqlmodel.Session) -> Optional[int]:
+        """Get the remaining units of today; None if the budget is unlimited."""
+        if not self.daily_budget:
+            return None
+        return max(0, self.daily_budget - self.get_used(db))
+
+    def consume(self, db: sqlmodel.Session, units: int) -> int:
+        """Count the units as used and return the units used today. Commits the session."""
+        used = models.AppState.increment(db, key=self.get_state_key(), by=units)
+        if self.daily_budget and used >= self.daily_budget:
+            logger.warning(f"The daily Google Maps budget of {self.daily_budget} units is used up ({used} units)")
+        return used
+
+    def defer(self, db: sqlmodel.Session, lookups: int) -> None:
+        """Count lookups that were deferred because the budget was used up. Commits the session."""
+        models.AppState.increment(db, key=self.deferred_state_key, by=lookups)
+
+    def pop_deferred(self, db: sqlmodel.Session) -> int:
+        """Get the number of deferred lookups and reset it. Commits the session."""
+        deferred = int(models.AppState.get_value(db, key=self.deferred_state_key, default="0"))
+        if deferred:
+            models.AppState.set_value(db, key=self.deferred_state_key, value="0")
+        return deferred
+
+
+quota_manager = QuotaManager()
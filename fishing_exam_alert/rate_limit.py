@@ -0,0 +1,50 @@
+import threading
+import time
+from typing import Optional
+
+from fishing_exam_alert.settings import setting
+
+
+class TokenBucket:
+    """A thread-safe token bucket rate limiter.
+
+    The bucket holds up to `capacity` tokens and is refilled with `rate` tokens per second. `acquire` takes one
+    token and blocks until one is available, so concurrent workers together stay within `rate` calls per second.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError(f"rate must be positive; not {rate}!")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def try_acquire(self) -> bool:
+        """Take a token if one is available."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def acquire(self) -> None:
+        """Take a token, wait for it if necessary."""
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_seconds = (1 - self._tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+# shared by all Google Maps requests, so they stay within the quota of the API key together
+maps_rate_limiter = TokenBucket(rate=setting.GMAP_QUERIES_PER_SECOND)
@@ -0,0 +1,161 @@
+import html
+from string import Template
+from typing import Callable, Dict, List, Tuple
+from urllib.parse import quote_plus
+
+import pandas as pd
+
+from fishing_exam_alert.settings import setting
+
+# (column of the matches, German header, formatter) in the order of the mail
+EXAM_COLUMNS: List[Tuple[str, str, Callable]] = [
+    ("exam_id", "Prüfungs-Nr", str),
+    ("name", "Prüfungslokal", str),
+    ("address_line", "Adresse", str),
+    ("district", "Regierungsbezirk", lambda district: getattr(district, "value", district)),
+    ("exam_start", "Prüfungsbeginn", lambda exam_start: exam_start.strftime("%d.%m.%Y %H:%M")),
+    ("min_participants", "Min. Teilnehmer", str),
+    ("participants", "Belegte Plätze", str),  # "<current participants> / <max. participants>"
+    ("status", "Status", str),
+    ("disabled_access", "Behindertengerecht", str),
+    ("headphones", "Kopfhörer", str),
+]
+TRAVEL_HEADERS = ["Entfernung Fahrzeit [min]", "Entfernung [km]", "Route"]
+
+PLAIN_TEMPLATE = Template(
+    """
+    Hi $username,\n
+    es gibt $count Prüfung(en), die deinen Filterkriterien entsprechen:\n\n
+$rows
+    Du kannst dich hier für die Fischerprüfungen anmelden: $exam_url.
+    \n\n
+    Du bekommst diese Mail, weil du dich für die "Fischerprüfung Updates" angemeldet hast.\n
+    Wenn du keine Benachrichtigungen mehr erhalten möchtest
+    oder du fälschlicherweise diese Mail erhalten hast,
+    kannst du dich hier abmelden: $unsubscribe_url.
+    """
+)
+HTML_TEMPLATE = Template(
+    """
+    Hi $username,<br/>
+    es gibt $count Prüfung(en), die deinen Filterkriterien entsprechen:<br/><br/>
+    <table border="1" class="dataframe">
+$header<tbody>
+$rows</tbody>
+</table><br/>
+    Du kannst dich hier für die Fischerprüfungen anmelden: <a href="$exam_url">$exam_url</a>.
+    <br/><br/>
+    Du bekommst diese Mail, weil du dich für die "Fischerprüfung Updates" angemeldet hast.
+    <br/>
+    Wenn du keine Benachrichtigungen mehr erhalten möchtest
+    oder du fälschlicherweise diese Mail erhalten hast,
+    kannst du dich <a href="$unsubscribe_url">hier</a> abmelden.
+    """
+)
+
+
+def get_html_header(headers: List[str]) -> str:
+    cells = "".join(f'<th style="min-width: 100px;">{html.escape(header)}</th>' for header in headers)
+    return f"<thead><tr>{cells}</tr></thead>\n"
+
+
+class MailRenderer:
+    """Renders the notification mails of a run from cached fragments.
+
+    The plain-text and HTML fragments of an exam are rendered once and shared by all users that matched it; only
+    the travel columns are rendered per user. The fragments are joined into templates whose static parts were
+    filled in advance. Create a renderer per run, so changed exams are rendered again.
+    """
+
+    def __init__(self):
+        static_values = dict(exam_url=setting.EXAM_SCRAP_URL, unsubscribe_url=setting.UNSUBSCRIBE_URL)
+        self.plain_template = Template(PLAIN_TEMPLATE.safe_substitute(static_values))
+        self.html_template = Template(
+            HTML_TEMPLATE.safe_substitute({key: html.escape(value) for key, value in static_values.items()})
+        )
+        self.html_headers = {
+            False: get_html_header([header for _, header, _ in EXAM_COLUMNS]),
+            True: get_html_header([header for _, header, _ in EXAM_COLUMNS] + TRAVEL_HEADERS),
+        }
+        self._fragments: Dict[int, Tuple[str, str]] = dict()  # (plain text, HTML cells) by exam id
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, email_to: str, exams: pd.DataFrame) -> Tuple[str, str, str]:
+        """Get the subject, the plain-text and the HTML message of the notification about the matched exams.
+
+        The exams are the matches of the user (see `matching.get_user_matches`), optional with travel columns.
+        """
+        fragments = self.get_fragments(exams)
+        with_travel = "travel_duration" in exams and "start_address_line" in exams
+        plain_rows, html_rows = list(), list()
+        if with_travel:
+            for (plain_row, html_cells), travel_values in zip(fragments, self.get_travel_values(exams)):
+                plain_rows.append(
+                    plain_row
+                    + "".join(f"    {header}: {value}\n" for header, value in zip(TRAVEL_HEADERS, travel_values))
+                )
+                html_rows.append(f"<tr>{html_cells}{self.get_html_travel_cells(travel_values)}</tr>\n")
+        else:
+            plain_rows = [plain_row for plain_row, _ in fragments]
+            html_rows = [f"<tr>{html_cells}</tr>\n" for _, html_cells in fragments]
+
+        username = email_to.split("@")[0]  # removes for example @gmail.de
+        plain_message = self.plain_template.substitute(username=username, count=len(exams), rows="\n".join(plain_rows))
+        html_message = self.html_template.substitute(
+            username=html.escape(username),
+            count=len(exams),
+            header=self.html_headers[with_travel],
+            rows="".join(html_rows),
+        )
+        return f"Fischerprüfung Updates - Es gibt {len(exams)} freie Termine!", plain_message, html_message
+
+    def get_fragments(self, exams: pd.DataFrame) -> List[Tuple[str, str]]:
+        fragments = list()
+        for i, exam_id in enumerate(exams["id"].tolist()):
+            if exam_id in self._fragments:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self._fragments[exam_id] = self.render_exam(exams.iloc[i])
+            fragments.append(self._fragments[exam_id])
+        return fragments
+
+    @staticmethod
+    def render_exam(exam: pd.Series) -> Tuple[str, str]:
+        values = list()
+        for column, _, formatter in EXAM_COLUMNS:
+            if column == "participants":
+                values.append(f"{exam['current_participants']} / {exam['max_participants']}")
+            else:
+                values.append(formatter(exam[column]))
+        plain_row = "".join(f"    {header}: {value}\n" for (_, header, _), value in zip(EXAM_COLUMNS, values))
+        html_cells = "".join(f"<td>{html.escape(value)}</td>" for value in values)
+        return plain_row, html_cells
+
+    @staticmethod
+    def get_travel_values(exams: pd.DataFrame) -> List[Tuple[str, str, str]]:
+        travel_values = list()
+        for travel_duration, travel_distance, start_address_line, address_line in zip(
+            exams["travel_duration"].tolist(),
+            exams["travel_distance"].tolist(),
+            exams["start_address_line"].tolist(),
+            exams["address_line"].tolist(),
+        ):
+            directions_url = (
+                f"https://www.google.com/maps/dir/{quote_plus(start_address_line)}/{quote_plus(address_line)}"
+            )
+            travel_values.append(
+                (
+                    str(int(travel_duration / 60)) if pd.notna(travel_duration) else "",
+                    str(int(travel_distance / 1000)) if pd.notna(travel_distance) else "",
+                    directions_url,
+                )
+            )
+        return travel_values
+
+    @staticmethod
+    def get_html_travel_cells(travel_values: Tuple[str, str, str]) -> str:
+        travel_duration, travel_distance, directions_url = travel_values
+        url = html.escape(directions_url)
+        return f'<td>{travel_duration}</td><td>{travel_distance}</td><td><a href="{url}" target="_blank">{url}</a></td>'
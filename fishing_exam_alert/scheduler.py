@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+import sqlmodel
+from loguru import logger
+
+from fishing_exam_alert import models
+from fishing_exam_alert.settings import setting
+
+
+class PollScheduler:
+    """Adapts the interval between two runs.
+
+    After a run that detected exam changes the interval drops to the minimum, after runs without changes it backs
+    off up to the maximum. If a free exam starts soon, the interval is additionally capped: the closer the exam,
+    the closer the cap gets to the minimum.
+    """
+
+    backoff_factor = 1.5
+
+    def __init__(
+        self,
+        min_interval: timedelta = timedelta(minutes=setting.RUN_INTERVAL_MIN_MINUTES),
+        base_interval: timedelta = timedelta(minutes=setting.RUN_INTERVAL_MINUTES),
+        max_interval: timedelta = timedelta(minutes=setting.RUN_INTERVAL_MAX_MINUTES),
+        urgent_window: timedelta = timedelta(days=setting.RUN_INTERVAL_URGENT_DAYS),
+    ):
+        if not min_interval <= base_interval <= max_interval:
+            raise ValueError(f"The base interval must be between {min_interval} and {max_interval}!")
+
+        self.min_interval = min_interval
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.urgent_window = urgent_window
+        self.interval = base_interval
+        self.last_event_id: Optional[int] = None
+
+    def get_next_interval(self, db: sqlmodel.Session) -> timedelta:
+        """Get the interval until the next run by the exam events of the last run and the next free exam."""
+        last_event_id = models.ExamEvent.get_last_id(db)
+        changed = None if self.last_event_id is None else last_event_id != self.last_event_id
+        self.last_event_id = last_event_id
+
+        now = datetime.now()
+        next_free_exam_start = models.Exam.get_next_start(db, status="Frei", exam_start__min=now)
+        return self.update(changed, next_free_exam_start, now=now)
+
+    def update(
+        self, changed: Optional[bool], next_free_exam_start: Optional[datetime], now: Optional[datetime] = None
+    ) -> timedelta:
+        """Update the interval after a run. `changed` is None if it is unknown (e.g. after the first run)."""
+        if changed:
+            self.interval = self.min_interval
+        elif changed is not None:
+            self.interval = min(self.interval * self.backoff_factor, self.max_interval)
+
+        interval = self.interval
+        if next_free_exam_start:
+            time_left = next_free_exam_start - (now or datetime.now())
+            if time_left < self.urgent_window:
+                urgent_interval = self.min_interval + (self.base_interval - self.min_interval) * (
+                    max(time_left, timedelta(0)) / self.urgent_window
+                )
+                interval = min(interval, urgent_interval)
+
+        interval = max(self.min_interval, min(interval, self.max_interval))
+        logger.debug(f"Next run in {interval} (changed: {changed}, next free exam: {next_free_exam_start})")
+        return interval
@@ -0,0 +1,91 @@
+import random
+import time
+
+import requests
+from loguru import logger
+from requests import Response
+from requests.adapters import HTTPAdapter
+
+from fishing_exam_alert.settings import setting
+
+
+class ScraperClient:
+    """A long-lived HTTP client for the exam site.
+
+    The session (connection pool and cookies) is kept between runs. Every request has a connect and
+    read timeout and is retried with exponential backoff and full jitter on connection errors and 5xx.
+    """
+
+    retry_status_codes = {500, 502, 503, 504}
+    user_agent = "fishing-exam-alert"
+
+    def __init__(
+        self,
+        connect_timeout: float = setting.HTTP_CONNECT_TIMEOUT_SECONDS,
+        read_timeout: float = setting.HTTP_READ_TIMEOUT_SECONDS,
+        max_retries: int = setting.HTTP_MAX_RETRIES,
+        backoff_seconds: float = setting.HTTP_BACKOFF_SECONDS,
+        max_backoff_seconds: float = 60,
+        pool_size: int = 2,
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.pool_size = pool_size
+        self.session = self._create_session()
+
+    def _create_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({"User-Agent": self.user_agent, "Accept-Encoding": "gzip, deflate"})
+        return session
+
+    def reset(self) -> None:
+        """Drop the connections and cookies."""
+        self.session.close()
+        self.session = self._create_session()
+
+    def get(self, url: str, **kwargs) -> Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> Response:
+        return self.request("POST", url, **kwargs)
+
+    def request(self, method: str, url: str, **kwargs) -> Response:
+        """Send a request. Retries on connection errors, timeouts and 5xx; raises for other error status codes."""
+        kwargs.setdefault("timeout", self.timeout)
+
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                logger.warning(f"{method} {url} failed with {e.__class__.__name__}: {e}")
+            else:
+                logger.debug(
+                    f"{method} {url}: {response.status_code} in {time.monotonic() - start:.2f}s "
+                    f"(Content-Encoding: {response.headers.get('Content-Encoding', 'none')})"
+                )
+                if response.status_code not in self.retry_status_codes or attempt >= self.max_retries:
+                    response.raise_for_status()
+                    return response
+                logger.warning(f"{method} {url} failed with status {response.status_code}")
+                response.close()
+
+            attempt += 1
+            backoff = self.get_backoff(attempt)
+            logger.info(f"Retry {method} {url} in {backoff:.1f}s ({attempt}/{self.max_retries})...")
+            time.sleep(backoff)
+
+    def get_backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter."""
+        return random.uniform(0, min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (attempt - 1)))
+
+
+scraper_client = ScraperClient()
@@ -4,10 +4,47 @@ import os
 class Settings:
     CONFIRMATION_INTERVAL_SECONDS: int = int(os.getenv("CONFIRMATION_INTERVAL_SECONDS", "10"))
     RUN_INTERVAL_MINUTES: int = int(os.getenv("RUN_INTERVAL_MINUTES", "60"))
+    # bounds of the adaptive interval: it tightens after changes and backs off if nothing changed
+    # the default bounds include RUN_INTERVAL_MINUTES, so intervals configured before them still work
+    RUN_INTERVAL_MIN_MINUTES: int = int(os.getenv("RUN_INTERVAL_MIN_MINUTES", str(min(5, RUN_INTERVAL_MINUTES))))
+    RUN_INTERVAL_MAX_MINUTES: int = int(os.getenv("RUN_INTERVAL_MAX_MINUTES", str(max(180, RUN_INTERVAL_MINUTES))))
+    # the interval tightens if a free exam starts within these days
+    RUN_INTERVAL_URGENT_DAYS: int = int(os.getenv("RUN_INTERVAL_URGENT_DAYS", "14"))
     EXAM_SCRAP_URL: str = (
         os.environ.get("EXAM_SCRAP_URL") or "https://fischerpruefung-online.bayern.de/fprApp/verwaltung/Pruefungssuche"
     )
+    EXAM_PARSER_BACKEND: str = os.getenv(
+        "EXAM_PARSER_BACKEND", "html.parser"
+    )  # html.parser, lxml, selectolax or stream
+    # max. size of a scraped page that is kept in memory, bigger pages are written to a temporary file
+    EXAM_PAGE_MAX_MEMORY_BYTES: int = int(os.getenv("EXAM_PAGE_MAX_MEMORY_BYTES", str(1024 * 1024)))
+    # for the HTTP client of the exam scraper
+    HTTP_CONNECT_TIMEOUT_SECONDS: float = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "10"))
+    HTTP_READ_TIMEOUT_SECONDS: float = float(os.getenv("HTTP_READ_TIMEOUT_SECONDS", "60"))
+    HTTP_MAX_RETRIES: int = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+    HTTP_BACKOFF_SECONDS: float = float(os.getenv("HTTP_BACKOFF_SECONDS", "2"))
+    # live: scrap the exam site, record: scrap and save the pages to the corpus, replay: parse the pages of the corpus
+    EXAM_SCRAPER_MODE: str = os.getenv("EXAM_SCRAPER_MODE", "live")
+    EXAM_CORPUS_DIR: str = os.getenv("EXAM_CORPUS_DIR", "db/corpus")
+    EXAM_CORPUS_SNAPSHOT: str = os.getenv("EXAM_CORPUS_SNAPSHOT", "")  # optional: snapshot to replay (default: latest)
     GMAP_API_KEY: str = os.environ["GMAP_API_KEY"]
+    DISTANCE_CACHE_SIZE: int = int(os.getenv("DISTANCE_CACHE_SIZE", "10000"))  # resolved distances kept in memory
+    # failed distance lookups are not repeated for these hours; reported to the admin after this many failures in a row
+    DISTANCE_NO_ROUTE_TTL_HOURS: float = float(os.getenv("DISTANCE_NO_ROUTE_TTL_HOURS", "168"))
+    DISTANCE_REQUEST_FAILED_TTL_HOURS: float = float(os.getenv("DISTANCE_REQUEST_FAILED_TTL_HOURS", "1"))
+    DISTANCE_FAILURE_REPORT_COUNT: int = int(os.getenv("DISTANCE_FAILURE_REPORT_COUNT", "3"))
+    # how the api response of a distance is stored: off, summary (distance and duration texts) or zlib (compressed)
+    DISTANCE_DETAILS_MODE: str = os.getenv("DISTANCE_DETAILS_MODE", "summary")
+    # optional: GeoNames postal code file (e.g. DE.txt), so the postal codes of the users don't need to be geocoded
+    PLZ_CENTROIDS_FILE: str = os.getenv("PLZ_CENTROIDS_FILE", "")
+    # exams farther away (straight line) than this speed x max. travel duration are not routed; 0 to disable
+    PREFILTER_MAX_SPEED_KMH: float = float(os.getenv("PREFILTER_MAX_SPEED_KMH", "130"))
+    GMAP_BASE_URL: str = os.getenv("GMAP_BASE_URL", "https://maps.googleapis.com")  # e.g. a local stand-in
+    # quota of the Google Maps API key and the number of concurrent requests to resolve missing distances
+    GMAP_QUERIES_PER_SECOND: float = float(os.getenv("GMAP_QUERIES_PER_SECOND", "50"))
+    GMAP_MAX_WORKERS: int = int(os.getenv("GMAP_MAX_WORKERS", "8"))
+    # billable units per day (Distance Matrix elements and Geocoding requests); 0 is unlimited
+    GMAP_DAILY_BUDGET: int = int(os.getenv("GMAP_DAILY_BUDGET", "0"))
     GSHEET_SPREADSHEET_ID: str = os.environ["GSHEET_SPREADSHEET_ID"]
     SUBSCRIBE_URL: str = os.environ["SUBSCRIBE_URL"]
     UNSUBSCRIBE_URL: str = os.environ["UNSUBSCRIBE_URL"]
@@ -15,6 +52,17 @@ class Settings:
     NOTIFY_MAIL_FROM: str = os.environ["NOTIFY_MAIL_FROM"]
     NOTIFY_MAIL_REPLY_TO: str = os.getenv("NOTIFY_MAIL_REPLY_TO", "")  # optional: reply_to mail address
     NOTIFY_MAIL_PASSWORD: str = os.environ["NOTIFY_MAIL_PASSWORD"]
+    MAILERSEND_API_BASE: str = os.getenv("MAILERSEND_API_BASE", "https://api.mailersend.com/v1")  # e.g. a stand-in
+    # collect the notifications of a run and submit them through the bulk endpoint of mailersend in chunks
+    MAILERSEND_BULK: bool = os.getenv("MAILERSEND_BULK", "false").lower() == "true"
+    MAILERSEND_BULK_CHUNK_SIZE: int = int(os.getenv("MAILERSEND_BULK_CHUNK_SIZE", "500"))  # max. of the endpoint
+    MAILERSEND_BULK_MAX_RETRIES: int = int(os.getenv("MAILERSEND_BULK_MAX_RETRIES", "2"))
+    # the outbox is drained by this many threads; a mail is retried with exponential backoff up to the max. attempts
+    OUTBOX_MAX_WORKERS: int = int(os.getenv("OUTBOX_MAX_WORKERS", "4"))
+    OUTBOX_MAX_ATTEMPTS: int = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+    OUTBOX_BACKOFF_SECONDS: float = float(os.getenv("OUTBOX_BACKOFF_SECONDS", "60"))
+    # a mail claimed longer ago than this (the delivery crashed) is attempted again
+    OUTBOX_LEASE_MINUTES: float = float(os.getenv("OUTBOX_LEASE_MINUTES", "30"))
 
     # for admin
     DISTANCE_THRESHOLD: int = int(os.getenv("DISTANCE_THRESHOLD", "500"))
@@ -32,5 +80,55 @@ class Settings:
         if self.MAIL_SERVICE not in allowed_mail_services:
             raise ValueError(f"MAIL_SERVICE must be one of {allowed_mail_services}; not {self.MAIL_SERVICE}!")
 
+        # validate the bounds of the run interval
+        if not self.RUN_INTERVAL_MIN_MINUTES <= self.RUN_INTERVAL_MINUTES <= self.RUN_INTERVAL_MAX_MINUTES:
+            raise ValueError(
+                "RUN_INTERVAL_MINUTES must be between RUN_INTERVAL_MIN_MINUTES and RUN_INTERVAL_MAX_MINUTES; "
+                f"not {self.RUN_INTERVAL_MINUTES}!"
+            )
+
+        # validate the concurrency of the Google Maps requests
+        if self.GMAP_QUERIES_PER_SECOND <= 0 or self.GMAP_MAX_WORKERS < 1:
+            raise ValueError(
+                "GMAP_QUERIES_PER_SECOND must be positive and GMAP_MAX_WORKERS at least 1; "
+                f"not {self.GMAP_QUERIES_PER_SECOND} and {self.GMAP_MAX_WORKERS}!"
+            )
+        if self.GMAP_DAILY_BUDGET < 0:
+            raise ValueError(f"GMAP_DAILY_BUDGET must not be negative; not {self.GMAP_DAILY_BUDGET}!")
+
+        # validate the bulk sending with mailersend
+        if not 1 <= self.MAILERSEND_BULK_CHUNK_SIZE <= 500 or self.MAILERSEND_BULK_MAX_RETRIES < 0:
+            raise ValueError(
+                "MAILERSEND_BULK_CHUNK_SIZE must be between 1 and 500 and MAILERSEND_BULK_MAX_RETRIES not negative; "
+                f"not {self.MAILERSEND_BULK_CHUNK_SIZE} and {self.MAILERSEND_BULK_MAX_RETRIES}!"
+            )
+
+        # validate the delivery of the outbox
+        if self.OUTBOX_MAX_WORKERS < 1 or self.OUTBOX_MAX_ATTEMPTS < 1:
+            raise ValueError(
+                "OUTBOX_MAX_WORKERS and OUTBOX_MAX_ATTEMPTS must be at least 1; "
+                f"not {self.OUTBOX_MAX_WORKERS} and {self.OUTBOX_MAX_ATTEMPTS}!"
+            )
+
+        # validate the storage of the distance details
+        allowed_distance_details_modes = ["off", "summary", "zlib"]
+        if self.DISTANCE_DETAILS_MODE not in allowed_distance_details_modes:
+            raise ValueError(
+                f"DISTANCE_DETAILS_MODE must be one of {allowed_distance_details_modes}; "
+                f"not {self.DISTANCE_DETAILS_MODE}!"
+            )
+
+        # validate the parser backend of the exam scraper
+        allowed_parser_backends = ["html.parser", "lxml", "selectolax", "stream"]
+        if self.EXAM_PARSER_BACKEND not in allowed_parser_backends:
+            raise ValueError(
+                f"EXAM_PARSER_BACKEND must be one of {allowed_parser_backends}; not {self.EXAM_PARSER_BACKEND}!"
+            )
+
+        # validate the mode of the exam scraper
+        allowed_scraper_modes = ["live", "record", "replay"]
+        if self.EXAM_SCRAPER_MODE not in allowed_scraper_modes:
+            raise ValueError(f"EXAM_SCRAPER_MODE must be one of {allowed_scraper_modes}; not {self.EXAM_SCRAPER_MODE}!")
+
 
 setting = Settings()
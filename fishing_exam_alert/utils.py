@@ -1,14 +1,18 @@
+import re
+import unicodedata
 from datetime import datetime
-from urllib.parse import quote_plus
+from functools import lru_cache
 
 import googlemaps
-import pandas as pd
 import requests
 from loguru import logger
 from pytz import timezone
+from requests.adapters import HTTPAdapter
 
 from fishing_exam_alert.settings import setting
 
+GMAPS_CLIENT_QUERIES_PER_SECOND = 1_000_000  # practically unlimited, see `get_gmaps_client`
+
 
 def localize_datetime(dt: datetime) -> datetime:
     local_tz = timezone("Europe/Berlin")
@@ -24,63 +28,33 @@ def localize_dt_to_utc(dt: datetime) -> datetime:
     return dt_to_utc(dt_localized)
 
 
-def transform_db_dataframe_for_mail(df: pd.DataFrame) -> pd.DataFrame:
-    transformed_df = df.copy()
-    german_mapping = {
-        "exam_id": "Prüfungs-Nr",
-        "name": "Prüfungslokal",
-        "address_line": "Adresse",
-        "district": "Regierungsbezirk",
-        "exam_start_german_time": "Prüfungsbeginn",
-        "min_participants": "Min. Teilnehmer",
-        "participants": "Belegte Plätze",  # calculated row in this func
-        "status": "Status",
-        "disabled_access": "Behindertengerecht",
-        "headphones": "Kopfhörer",
-        "address_line": "Adresse",
-        "travel_duration_in_min": "Entfernung Fahrzeit [min]",  # calculated row in this func
-        "travel_distance_in_km": "Entfernung [km]",  # calculated row in this func
-        "directions_url": "Route",  # calculated row in this func
-    }
-    if "travel_duration" in transformed_df:  # transform duration from second to minute
-        transformed_df["travel_duration_in_min"] = transformed_df["travel_duration"].apply(lambda x: int(x / 60))
-    if "travel_distance" in transformed_df:  # transform distance from meter to kilometer
-        transformed_df["travel_distance_in_km"] = transformed_df["travel_distance"].apply(lambda x: int(x / 1000))
-
-    # combine participant occupancy to one column
-    transformed_df["participants"] = transformed_df.apply(
-        lambda row: f"{row.current_participants} / {row.max_participants}", axis=1
+def normalize_address(address: str) -> str:
+    """Normalize an address, so trivially different spellings (case, whitespace, commas) get the same key."""
+    address = unicodedata.normalize("NFC", address).lower()
+    address = re.sub(r"\s*,\s*", ", ", address)
+    address = re.sub(r"\s+", " ", address)
+    return address.strip(" ,")
+
+
+@lru_cache(maxsize=None)
+def get_gmaps_client() -> googlemaps.Client:
+    """Get the Google Maps client. It is shared, so the connections are shared as well.
+
+    The connection pool fits the concurrent workers of the distance resolution. The requests are rate-limited by
+    `rate_limit.maps_rate_limiter` only: the limiter of the client is not thread-safe, so it is set out of reach.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=setting.GMAP_MAX_WORKERS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return googlemaps.Client(
+        key=setting.GMAP_API_KEY,
+        base_url=setting.GMAP_BASE_URL,
+        queries_per_second=GMAPS_CLIENT_QUERIES_PER_SECOND,
+        queries_per_minute=GMAPS_CLIENT_QUERIES_PER_SECOND * 60,
+        requests_session=session,
     )
 
-    # create directions link
-    if "start_address_line" in transformed_df and "address_line" in transformed_df:
-        transformed_df["directions_url"] = transformed_df.apply(
-            lambda row: f"https://www.google.com/maps/dir/{quote_plus(row.start_address_line)}/{quote_plus(row.address_line)}",
-            axis=1,
-        )
-
-    # transform datetime
-    transformed_df["exam_start_german_time"] = transformed_df["exam_start"].dt.strftime("%d.%m.%Y %H:%M")
-
-    # drop all columns that are not translated
-    cols_to_drop = list(set(transformed_df) - set(german_mapping))
-    transformed_df.drop(cols_to_drop, axis=1, inplace=True)
-
-    # rename the columns
-    transformed_df.rename(columns=german_mapping, inplace=True)
-
-    # reorder the columns
-    cols_to_reorder = list(set(german_mapping.values()) & set(transformed_df))
-    transformed_df = transformed_df[cols_to_reorder]
-
-    return transformed_df
-
-
-def get_distance_from_gmaps(start_address: str, end_address: str) -> dict:
-    gmaps = googlemaps.Client(key=setting.GMAP_API_KEY)
-    directions_result = gmaps.directions(start_address, end_address)  # type: ignore # directions is member of gmaps
-    return directions_result
-
 
 def notify_admin_via_gchat(message: str) -> None:
     logger.info(f"Sending message to admin via gchat: {message[:40]}{'...' if len(message) > 40 else ''}")
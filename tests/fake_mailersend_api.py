@@ -0,0 +1,143 @@
+"""A local stand-in for the email and bulk email endpoints of the mailersend API.
+
+So the tests and benchmarks run offline.
+"""
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import urlparse
+
+INVALID_RECIPIENT = "invalid"  # recipients containing this fail the validation
+SUPPRESSED_RECIPIENT = "suppressed"  # recipients containing this are suppressed
+
+
+class FakeMailersendApiHandler(BaseHTTPRequestHandler):
+    sent: List[dict] = []  # the accepted mails
+    requests: List[str] = []  # "<method> <path>" of each request
+    bulk_emails: Dict[str, dict] = dict()
+    latency_seconds = 0.0
+    processing_seconds = 0.0  # a bulk email is processing this long before it completes
+    failing_requests = 0  # the next requests fail with a server error
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        path = urlparse(self.path).path
+        if not self.start_request("POST", path):
+            return
+
+        if path == "/v1/email":
+            self.sent.append(body)
+            self.send_json(202, None)
+        elif path == "/v1/bulk-email":
+            bulk_email_id = uuid.uuid4().hex
+            self.bulk_emails[bulk_email_id] = {
+                **self.process_bulk_email(bulk_email_id, body),
+                "completes_at": time.monotonic() + self.server.processing_seconds,  # type: ignore
+            }
+            self.send_json(202, {"message": "The bulk email is being processed.", "bulk_email_id": bulk_email_id})
+        else:
+            self.send_error(404)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if not self.start_request("GET", path):
+            return
+
+        bulk_email_id = path.rsplit("/", 1)[-1]
+        if path.startswith("/v1/bulk-email/") and bulk_email_id in self.bulk_emails:
+            bulk_email = dict(self.bulk_emails[bulk_email_id])
+            if time.monotonic() < bulk_email.pop("completes_at"):
+                bulk_email = {"id": bulk_email_id, "state": "processing"}
+            self.send_json(200, {"data": bulk_email})
+        else:
+            self.send_error(404)
+
+    def start_request(self, method: str, path: str) -> bool:
+        self.requests.append(f"{method} {path}")
+        time.sleep(self.latency_seconds)
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            self.send_json(401, {"message": "Unauthenticated."})
+            return False
+        if self.server.failing_requests > 0:  # type: ignore
+            self.server.failing_requests -= 1  # type: ignore
+            self.send_json(500, {"message": "Server Error"})
+            return False
+        return True
+
+    def process_bulk_email(self, bulk_email_id: str, mails: List[dict]) -> dict:
+        validation_errors = dict()
+        suppressed_recipients = list()
+        for i, mail in enumerate(mails):
+            email_to = mail["to"][0]["email"]
+            if INVALID_RECIPIENT in email_to:
+                validation_errors[f"message.{i}.to.0.email"] = [f"The message.{i}.to.0.email must be valid."]
+            elif SUPPRESSED_RECIPIENT in email_to:
+                suppressed_recipients.append({"email": email_to})
+            else:
+                self.sent.append(mail)
+
+        return {
+            "id": bulk_email_id,
+            "state": "completed",
+            "total_recipients_count": len(mails),
+            "suppressed_recipients_count": len(suppressed_recipients),
+            "suppressed_recipients": suppressed_recipients,
+            "validation_errors_count": len(validation_errors),
+            "validation_errors": validation_errors or None,
+            "messages_id": [uuid.uuid4().hex for _ in range(len(mails) - len(validation_errors))],
+        }
+
+    def send_json(self, status: int, body) -> None:
+        content = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeMailersendApi:
+    """Runs the fake API in a background thread. Use `api_base` as the base URL of the mailersend API."""
+
+    def __init__(self, latency_seconds: float = 0.0):
+        handler = type(
+            "Handler",
+            (FakeMailersendApiHandler,),
+            {"sent": [], "requests": [], "bulk_emails": dict(), "latency_seconds": latency_seconds},
+        )
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.failing_requests = 0  # type: ignore
+        self.server.processing_seconds = 0.0  # type: ignore
+        self.api_base = f"http://127.0.0.1:{self.server.server_port}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def sent(self) -> List[dict]:
+        return self.server.RequestHandlerClass.sent  # type: ignore
+
+    @property
+    def requests(self) -> List[str]:
+        return self.server.RequestHandlerClass.requests  # type: ignore
+
+    def fail_next_requests(self, count: int) -> None:
+        self.server.failing_requests = count  # type: ignore
+
+    def process_bulk_emails_for(self, seconds: float) -> None:
+        """Let the next bulk emails be processing for the seconds before they complete."""
+        self.server.processing_seconds = seconds  # type: ignore
+
+    def clear(self) -> None:
+        self.sent.clear()
+        self.requests.clear()
+        self.server.failing_requests = 0  # type: ignore
+        self.server.processing_seconds = 0.0  # type: ignore
+
+    def shutdown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,134 @@
+"""A local stand-in for the Distance Matrix and Geocoding endpoints of the Google Maps API.
+
+So the tests and benchmarks run offline.
+"""
+import json
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import googlemaps
+import numpy as np
+
+from fishing_exam_alert.geo import haversine_km
+
+FAKE_API_KEY = "AIzaFakeKeyForTests"
+UNKNOWN_ADDRESS = "Unbekannt"  # addresses containing this (in any case) have no route
+
+
+def is_unknown_address(address: str) -> bool:
+    return UNKNOWN_ADDRESS.lower() in address.lower()
+
+
+def get_fake_coordinates(address: str) -> Tuple[float, float]:
+    """Get deterministic coordinates in Bavaria for the address."""
+    address_hash = zlib.crc32(address.encode())
+    return 47.4 + (address_hash % 3000) / 1000, 9.2 + (address_hash // 3000 % 4500) / 1000
+
+
+def get_fake_element(origin: str, destination: str) -> dict:
+    """Get a deterministic Distance Matrix element for the pair: 1.3 x the straight-line distance at 80 km/h."""
+    if is_unknown_address(origin) or is_unknown_address(destination):
+        return {"status": "NOT_FOUND"}
+
+    (latitude_1, longitude_1), (latitude_2, longitude_2) = get_fake_coordinates(origin), get_fake_coordinates(
+        destination
+    )
+    distance_km = haversine_km(np.array(latitude_1), np.array(longitude_1), np.array(latitude_2), np.array(longitude_2))
+    distance = 1000 + int(1.3 * 1000 * float(distance_km))  # in meters
+    duration = int(distance / (80 / 3.6))  # in seconds
+    return {
+        "status": "OK",
+        "distance": {"text": f"{distance / 1000:.1f} km", "value": distance},
+        "duration": {"text": f"{duration // 60} mins", "value": duration},
+    }
+
+
+class FakeMapsApiHandler(BaseHTTPRequestHandler):
+    requests: List[dict] = []
+    latency_seconds = 0.0
+    max_origins = 25
+    max_destinations = 25
+    max_elements = 100
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/maps/api/distancematrix/json":
+            body = self.get_distance_matrix(query)
+        elif url.path == "/maps/api/geocode/json":
+            body = self.get_geocode(query)
+        else:
+            self.send_error(404)
+            return
+
+        content = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def get_geocode(self, query: dict) -> dict:
+        address = query["address"][0]
+        self.requests.append({"address": address})
+        time.sleep(self.latency_seconds)
+
+        if is_unknown_address(address):
+            return {"status": "ZERO_RESULTS", "results": []}
+
+        latitude, longitude = get_fake_coordinates(address)
+        return {
+            "status": "OK",
+            "results": [{"formatted_address": address, "geometry": {"location": {"lat": latitude, "lng": longitude}}}],
+        }
+
+    def get_distance_matrix(self, query: dict) -> dict:
+        origins = query["origins"][0].split("|")
+        destinations = query["destinations"][0].split("|")
+        self.requests.append({"origins": origins, "destinations": destinations})
+        time.sleep(self.latency_seconds)
+
+        if (
+            len(origins) > self.max_origins
+            or len(destinations) > self.max_destinations
+            or len(origins) * len(destinations) > self.max_elements
+        ):
+            return {"status": "MAX_ELEMENTS_EXCEEDED", "rows": []}
+
+        return {
+            "status": "OK",
+            "origin_addresses": origins,
+            "destination_addresses": destinations,
+            "rows": [
+                {"elements": [get_fake_element(origin, destination) for destination in destinations]}
+                for origin in origins
+            ],
+        }
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeMapsApi:
+    """Runs the fake API in a background thread. Use `get_client` to get a Google Maps client for it."""
+
+    def __init__(self, latency_seconds: float = 0.0):
+        handler = type("Handler", (FakeMapsApiHandler,), {"requests": [], "latency_seconds": latency_seconds})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def requests(self) -> List[dict]:
+        return self.server.RequestHandlerClass.requests  # type: ignore
+
+    def get_client(self, queries_per_second: int = 1000) -> googlemaps.Client:
+        return googlemaps.Client(key=FAKE_API_KEY, base_url=self.base_url, queries_per_second=queries_per_second)
+
+    def shutdown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,54 @@
+import io
+import os
+import tempfile
+import unittest
+
+from fishing_exam_alert import models
+from fishing_exam_alert.corpus import ExamPageCorpus
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+class TestExamPageCorpus(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.corpus = ExamPageCorpus(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_save_and_open_snapshot(self):
+        name = self.corpus.save_snapshot(io.BytesIO(b"<html>overview</html>"), io.BytesIO(b"<html>detail</html>"))
+
+        self.assertEqual(self.corpus.list_snapshots(), [name])
+        overview_page, detail_page = self.corpus.open_snapshot()
+        self.assertEqual(overview_page.read(), b"<html>overview</html>")
+        self.assertEqual(detail_page.read(), b"<html>detail</html>")
+
+    def test_list_snapshots_ignores_incomplete_snapshots(self):
+        self.corpus.save_snapshot(io.BytesIO(b"overview"), io.BytesIO(b"detail"), name="20230101T000000")
+        self.corpus.save_snapshot(io.BytesIO(b"overview"), io.BytesIO(b"detail"), name="20230102T000000")
+        os.remove(os.path.join(self.tmp_dir.name, "20230102T000000", "detail.html.gz"))
+
+        self.assertEqual(self.corpus.list_snapshots(), ["20230101T000000"])
+        self.assertEqual(self.corpus.get_latest_snapshot(), "20230101T000000")
+
+    def test_open_snapshot_of_empty_corpus(self):
+        with self.assertRaises(FileNotFoundError):
+            self.corpus.open_snapshot()
+
+    def test_replay_scraper(self):
+        corpus = ExamPageCorpus(os.path.join(FIXTURES_DIR, "corpus"))
+
+        scraper = models.ExamTableScraper(parser_backend="stream", mode="replay", corpus=corpus, snapshot="example")
+
+        exams = scraper.exams
+        self.assertEqual(len(exams), 16)
+        self.assertEqual(exams[0].exam_id, "4711")
+
+    def test_replay_scraper_unmatched_exam_ids_before_parsing(self):
+        corpus = ExamPageCorpus(os.path.join(FIXTURES_DIR, "corpus"))
+
+        scraper = models.ExamTableScraper(parser_backend="stream", mode="replay", corpus=corpus, snapshot="example")
+
+        self.assertEqual(scraper.unmatched_exam_ids, set())
@@ -0,0 +1,299 @@
+import itertools
+import time
+import unittest
+import uuid
+from datetime import timedelta
+from unittest import mock
+
+from sqlmodel import Session
+
+from fishing_exam_alert import db, models, utils
+from fishing_exam_alert.distances import (
+    DistanceCache,
+    DistanceMatrixResolver,
+    TravelDistance,
+)
+from fishing_exam_alert.quota import QuotaManager
+from fishing_exam_alert.rate_limit import TokenBucket
+from fishing_exam_alert.settings import setting
+from tests.fake_maps_api import UNKNOWN_ADDRESS, FakeMapsApi, get_fake_element
+
+
+class TestDistanceMatrixResolver(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fake_maps_api = FakeMapsApi()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake_maps_api.shutdown()
+
+    def setUp(self):
+        self.fake_maps_api.requests.clear()
+        self.cache = DistanceCache(maxsize=1000)
+        self.resolver = DistanceMatrixResolver(client=self.fake_maps_api.get_client(), cache=self.cache)
+        self.prefix = uuid.uuid4().hex[:8]
+
+        patcher = mock.patch("fishing_exam_alert.utils.notify_admin_via_gchat")
+        self.notify_admin_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_pairs(self, origins_count: int, destinations_count: int):
+        return {
+            (f"{self.prefix} Start {i}", f"{self.prefix} Ziel {j}")
+            for i in range(origins_count)
+            for j in range(destinations_count)
+        }
+
+    def test_get_blocks_cover_pairs_within_limits(self):
+        pairs = self.get_pairs(30, 40)
+
+        blocks = self.resolver.get_blocks(pairs)
+
+        covered_pairs = set()
+        for origins, destinations in blocks:
+            self.assertLessEqual(len(origins), self.resolver.max_origins)
+            self.assertLessEqual(len(destinations), self.resolver.max_destinations)
+            self.assertLessEqual(len(origins) * len(destinations), self.resolver.max_elements)
+            covered_pairs |= {(origin, destination) for origin in origins for destination in destinations}
+        self.assertEqual(covered_pairs, pairs)
+        self.assertEqual(len(blocks), 8 + 5)  # 25 destinations x 4 origins and 15 destinations x 6 origins
+
+    def test_resolve_sparse_pairs_without_unneeded_elements(self):
+        # each origin needs 3 of 30 destinations, the first two origins the same ones
+        pairs = {
+            (f"{self.prefix} Start {i}", f"{self.prefix} Ziel {max(i - 1, 0) * 3 + j}")
+            for i in range(11)
+            for j in range(3)
+        }
+
+        with Session(db.engine) as session:
+            distances = self.resolver.resolve(session, pairs)
+
+            origins = {utils.normalize_address(origin) for origin, _ in pairs}
+            destinations = {utils.normalize_address(destination) for _, destination in pairs}
+            saved_distances = models.Distance.get_multi_by_addresses(
+                session, set(itertools.product(origins, destinations))
+            )
+
+        self.assertEqual(set(distances), pairs)
+        requested_elements = sum(
+            len(request["origins"]) * len(request["destinations"]) for request in self.fake_maps_api.requests
+        )
+        self.assertEqual(requested_elements, len(pairs))
+        self.assertEqual(len(saved_distances), len(pairs))
+        self.assertEqual(self.resolver.requests_count, 10)
+
+    def test_resolve(self):
+        pairs = self.get_pairs(5, 30)
+
+        with Session(db.engine) as session:
+            distances = self.resolver.resolve(session, pairs)
+
+        self.assertEqual(set(distances), pairs)
+        self.assertEqual(self.resolver.requests_count, 2 + 1)
+        start_address, end_address = next(iter(pairs))
+        expected_element = get_fake_element(
+            utils.normalize_address(start_address), utils.normalize_address(end_address)
+        )
+        self.assertEqual(distances[start_address, end_address].duration, expected_element["duration"]["value"])
+
+        # the distances are saved, so they are not requested again
+        with Session(db.engine) as session:
+            distances = self.resolver.resolve(session, pairs)
+            saved_distance = models.Distance.get_by_start_and_end_address(session, start_address, end_address)
+
+        self.assertEqual(set(distances), pairs)
+        self.assertEqual(self.resolver.requests_count, 3)
+        self.assertEqual(saved_distance.distance, expected_element["distance"]["value"])
+
+    def test_resolve_normalizes_addresses(self):
+        pairs = {
+            (f"{self.prefix} Start,  Deutschland", f"{self.prefix} ZIEL"),
+            (f"{self.prefix} start, deutschland ", f"{self.prefix} Ziel"),
+        }
+
+        with Session(db.engine) as session:
+            distances = self.resolver.resolve(session, pairs)
+
+        self.assertEqual(set(distances), pairs)
+        self.assertEqual(len(set(distances.values())), 1)
+        self.assertEqual(self.fake_maps_api.requests[0]["origins"], [f"{self.prefix} start, deutschland"])
+
+    def test_resolve_uses_cache(self):
+        pairs = self.get_pairs(2, 2)
+        with Session(db.engine) as session:
+            self.resolver.resolve(session, pairs)
+            self.assertEqual(self.cache.get_stats(), {"hits": 0, "misses": 4, "size": 4, "maxsize": 1000})
+
+            with mock.patch.object(models.Distance, "get_multi_by_addresses") as get_multi_mock:
+                distances = self.resolver.resolve(session, pairs)
+
+        get_multi_mock.assert_not_called()
+        self.assertEqual(set(distances), pairs)
+        self.assertEqual(self.cache.hits, 4)
+
+    def test_resolve_completes_unresolved_distances(self):
+        start_address, end_address = f"{self.prefix} Start", f"{self.prefix} Ziel"
+        with Session(db.engine) as session:
+            models.Distance.get_or_create(session, start_address=start_address, end_address=end_address)
+            distances = self.resolver.resolve(session, {(start_address, end_address)})
+            saved_distances = models.Distance.get_multi_by_addresses(
+                session, {(utils.normalize_address(start_address), utils.normalize_address(end_address))}
+            )
+
+        self.assertEqual(len(saved_distances), 1)
+        self.assertIsNotNone(saved_distances[0].duration)
+        self.assertEqual(distances[start_address, end_address].duration, saved_distances[0].duration)
+
+    def test_resolve_leaves_out_pairs_without_route(self):
+        unknown_pair = (f"{self.prefix} Start", f"{UNKNOWN_ADDRESS} {self.prefix}")
+        pairs = {(f"{self.prefix} Start", f"{self.prefix} Ziel"), unknown_pair}
+
+        with Session(db.engine) as session:
+            distances = self.resolver.resolve(session, pairs)
+
+        self.assertEqual(set(distances), {(f"{self.prefix} Start", f"{self.prefix} Ziel")})
+
+        # the failure is saved, so the pair is skipped until the TTL expired
+        with Session(db.engine) as session:
+            self.assertEqual(set(self.resolver.resolve(session, {unknown_pair})), set())
+            saved_distance = models.Distance.get_by_start_and_end_address(session, *unknown_pair)
+        self.assertEqual(self.resolver.requests_count, 1)
+        self.assertEqual(saved_distance.error_class, models.DistanceErrorClass.no_route)
+        self.assertEqual(saved_distance.error, "NOT_FOUND")
+
+        with Session(db.engine) as session:
+            saved_distance = models.Distance.get_by_start_and_end_address(session, *unknown_pair)
+            saved_distance.failed_at -= timedelta(hours=setting.DISTANCE_NO_ROUTE_TTL_HOURS)
+            session.add(saved_distance)
+            session.commit()
+            self.resolver.resolve(session, {unknown_pair})
+        self.assertEqual(self.resolver.requests_count, 2)
+
+    def test_resolve_reports_pairs_that_keep_failing(self):
+        unknown_pair = (f"{self.prefix} Start", f"{UNKNOWN_ADDRESS} {self.prefix}")
+
+        for _ in range(setting.DISTANCE_FAILURE_REPORT_COUNT + 1):
+            with Session(db.engine) as session, mock.patch.object(
+                models.Distance, "is_failure_cached", return_value=False
+            ):
+                self.resolver.resolve(session, {unknown_pair})
+
+        self.notify_admin_mock.assert_called_once()
+        message = self.notify_admin_mock.call_args.args[0]
+        self.assertIn(f"failed {setting.DISTANCE_FAILURE_REPORT_COUNT} times in a row", message)
+        self.assertIn(utils.normalize_address(unknown_pair[1]), message)
+
+    def test_resolve_defers_pairs_beyond_the_budget(self):
+        quota = QuotaManager(daily_budget=10, state_key_prefix=f"test.quota.{self.prefix}")
+        resolver = DistanceMatrixResolver(client=self.fake_maps_api.get_client(), cache=self.cache, quota=quota)
+        pairs = sorted(self.get_pairs(3, 4))
+        priorities = {pair: (len(pairs) - i, 0) for i, pair in enumerate(pairs)}  # the last pairs first
+
+        with Session(db.engine) as session:
+            distances = resolver.resolve(session, pairs, priorities=priorities)
+
+            # the blocks have no unneeded elements, so the budget covers the first 10 pairs
+            self.assertEqual(set(distances), set(pairs[-10:]))
+            self.assertEqual(quota.get_used(session), 10)
+            self.assertEqual(quota.pop_deferred(session), 2)
+
+            # the budget is used up
+            distances = resolver.resolve(session, pairs, priorities=priorities)
+
+            self.assertEqual(set(distances), set(pairs[-10:]))
+            self.assertEqual(quota.get_used(session), 10)
+            self.assertEqual(quota.pop_deferred(session), 2)
+
+    def test_resolve_reports_long_distances_at_once(self):
+        with Session(db.engine) as session:
+            self.resolver.resolve(session, self.get_pairs(2, 3))
+
+        self.notify_admin_mock.assert_called_once()
+        self.assertTrue(self.notify_admin_mock.call_args.args[0].startswith("6 resolved distances exceed"))
+
+
+class TestConcurrentDistanceMatrixResolver(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fake_maps_api = FakeMapsApi(latency_seconds=0.1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake_maps_api.shutdown()
+
+    def setUp(self):
+        self.prefix = uuid.uuid4().hex[:8]
+        self.pairs = {(f"{self.prefix} Start {i}", f"{self.prefix} Ziel {j}") for i in range(32) for j in range(25)}
+
+        patcher = mock.patch("fishing_exam_alert.utils.notify_admin_via_gchat")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def resolve(self, resolver: DistanceMatrixResolver):
+        start = time.monotonic()
+        with Session(db.engine) as session:
+            distances = resolver.resolve(session, self.pairs)
+        return distances, time.monotonic() - start
+
+    def test_resolve_blocks_concurrently(self):
+        resolver = DistanceMatrixResolver(
+            client=self.fake_maps_api.get_client(), cache=DistanceCache(), rate_limiter=TokenBucket(rate=1000)
+        )
+
+        distances, seconds = self.resolve(resolver)
+
+        self.assertEqual(set(distances), self.pairs)
+        self.assertEqual(resolver.requests_count, 8)
+        self.assertLess(seconds, 8 * 0.1 / 2)  # sequentially it takes at least 8 x latency
+
+    def test_resolve_within_rate_limit(self):
+        resolver = DistanceMatrixResolver(
+            client=self.fake_maps_api.get_client(), cache=DistanceCache(), rate_limiter=TokenBucket(rate=20, capacity=1)
+        )
+
+        distances, seconds = self.resolve(resolver)
+
+        self.assertEqual(set(distances), self.pairs)
+        self.assertGreaterEqual(seconds, 7 / 20)
+
+    def test_resolve_saves_distances_of_successful_requests(self):
+        client = self.fake_maps_api.get_client()
+        distance_matrix = client.distance_matrix
+        failing_origin = f"{self.prefix} start 0".lower()
+
+        def failing_distance_matrix(origins, destinations):
+            if failing_origin in origins:
+                raise RuntimeError("quota exceeded")
+            return distance_matrix(origins, destinations)
+
+        client.distance_matrix = failing_distance_matrix
+        resolver = DistanceMatrixResolver(client=client, cache=DistanceCache(), rate_limiter=TokenBucket(rate=1000))
+
+        distances, _ = self.resolve(resolver)
+
+        self.assertEqual(len(distances), 7 * 100)  # 8 blocks of 4 origins x 25 destinations
+        with Session(db.engine) as session:
+            saved_distances = models.Distance.get_multi_by_addresses(
+                session,
+                {(utils.normalize_address(start), utils.normalize_address(end)) for start, end in self.pairs},
+            )
+        self.assertEqual(len([distance for distance in saved_distances if distance.duration is not None]), 7 * 100)
+        failed_distances = [distance for distance in saved_distances if distance.error_class is not None]
+        self.assertEqual(len(failed_distances), 100)
+        self.assertEqual(failed_distances[0].error_class, models.DistanceErrorClass.request_failed)
+        self.assertEqual(failed_distances[0].error, "RuntimeError: quota exceeded")
+
+
+class TestDistanceCache(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = DistanceCache(maxsize=2)
+        cache.put(("a", "b"), TravelDistance(distance=1, duration=1))
+        cache.put(("a", "c"), TravelDistance(distance=2, duration=2))
+        cache.get(("a", "b"))
+        cache.put(("a", "d"), TravelDistance(distance=3, duration=3))
+
+        self.assertIsNone(cache.get(("a", "c")))
+        self.assertEqual(cache.get(("a", "b")), TravelDistance(distance=1, duration=1))
+        self.assertEqual(cache.get_stats(), {"hits": 2, "misses": 1, "size": 2, "maxsize": 2})
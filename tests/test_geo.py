@@ -0,0 +1,141 @@
+import os
+import tempfile
+import unittest
+import uuid
+from unittest import mock
+
+import googlemaps
+import numpy as np
+from sqlmodel import Session
+
+from fishing_exam_alert import db, geo, matching
+from fishing_exam_alert.quota import QuotaManager
+from tests.fake_maps_api import UNKNOWN_ADDRESS, FakeMapsApi, get_fake_coordinates
+from tests.utils import get_random_exam, get_random_user
+
+
+class TestGeo(unittest.TestCase):
+    def test_haversine_km(self):
+        munich, nuremberg = (48.137, 11.575), (49.452, 11.077)
+
+        distance_km = geo.haversine_km(
+            np.array(munich[0]), np.array(munich[1]), np.array(nuremberg[0]), np.array(nuremberg[1])
+        )
+
+        self.assertAlmostEqual(float(distance_km), 151, delta=1)
+
+    def test_load_postal_code_centroids(self):
+        rows = [
+            "DE\t95444\tBayreuth\tBayern\tBY\t\t00\tOberfranken\t094\t49.94\t11.58\t4",
+            "DE\t95444\tBayreuth Mitte\tBayern\tBY\t\t00\tOberfranken\t094\t49.96\t11.56\t4",
+            "DE\t80331\tMünchen\tBayern\tBY\t\t00\tOberbayern\t091\t48.1345\t11.571\t4",
+        ]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "DE.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n".join(rows) + "\n")
+
+            centroids = geo.load_postal_code_centroids(path)
+
+        self.assertEqual(set(centroids), {"95444", "80331"})
+        self.assertAlmostEqual(centroids["95444"][0], 49.95)
+        self.assertAlmostEqual(centroids["95444"][1], 11.57)
+
+
+class TestGeocoder(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fake_maps_api = FakeMapsApi()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake_maps_api.shutdown()
+
+    def setUp(self):
+        self.fake_maps_api.requests.clear()
+        self.geocoder = geo.Geocoder(client=self.fake_maps_api.get_client(), centroids={"95444": (49.95, 11.57)})
+        self.address = f"Hauptstrasse {uuid.uuid4().hex[:8]}, 95444 Bayreuth"
+
+    def test_geocode_postal_code_by_centroids(self):
+        with Session(db.engine) as session:
+            coordinates = self.geocoder.geocode(session, ["95444, Deutschland"])
+
+        self.assertEqual(coordinates, {"95444, Deutschland": (49.95, 11.57)})
+        self.assertEqual(self.geocoder.requests_count, 0)
+
+    def test_geocode_address_once(self):
+        with Session(db.engine) as session:
+            coordinates = self.geocoder.geocode(session, [self.address, self.address.upper()])
+            self.assertEqual(self.geocoder.requests_count, 1)
+
+            # a new geocoder reads the saved location
+            other_geocoder = geo.Geocoder(client=self.fake_maps_api.get_client(), centroids={})
+            other_coordinates = other_geocoder.geocode(session, [self.address])
+
+        self.assertEqual(coordinates[self.address], get_fake_coordinates(self.address.lower()))
+        self.assertEqual(coordinates[self.address.upper()], coordinates[self.address])
+        self.assertEqual(other_coordinates, {self.address: coordinates[self.address]})
+        self.assertEqual(other_geocoder.requests_count, 0)
+
+    def test_geocode_unknown_address(self):
+        address = f"{UNKNOWN_ADDRESS} {uuid.uuid4().hex[:8]}"
+        with Session(db.engine) as session:
+            self.assertEqual(self.geocoder.geocode(session, [address]), {address: None})
+            self.assertEqual(self.geocoder.geocode(session, [address]), {address: None})
+
+        self.assertEqual(self.geocoder.requests_count, 1)
+
+    def test_geocode_failed_request(self):
+        failing_address = f"Nebenstrasse {uuid.uuid4().hex[:8]}, 95444 Bayreuth"
+        client = self.fake_maps_api.get_client()
+
+        def geocode(address, **kwargs):
+            if address == failing_address.lower():
+                raise googlemaps.exceptions.TransportError("connection reset")
+            return client.geocode(address, **kwargs)
+
+        failing_client = mock.Mock(geocode=mock.Mock(side_effect=geocode))
+        quota = QuotaManager(daily_budget=10, state_key_prefix=f"test.{uuid.uuid4().hex}")
+        geocoder = geo.Geocoder(client=failing_client, centroids={}, quota=quota)
+        with Session(db.engine) as session:
+            coordinates = geocoder.geocode(session, [self.address, failing_address])
+
+            self.assertEqual(coordinates[self.address], get_fake_coordinates(self.address.lower()))
+            self.assertIsNone(coordinates[failing_address])
+            self.assertEqual(quota.get_used(session), 1)  # the failed request is not charged
+
+            # the failed address is not saved, so it is geocoded again
+            failing_client.geocode.side_effect = client.geocode
+            coordinates = geocoder.geocode(session, [self.address, failing_address])
+            self.assertEqual(quota.get_used(session), 2)
+
+        self.assertEqual(coordinates[failing_address], get_fake_coordinates(failing_address.lower()))
+        self.assertEqual(geocoder.requests_count, 3)
+
+
+class TestReachableMatrix(unittest.TestCase):
+    def test_get_reachable_matrix(self):
+        bayreuth, munich, nuremberg = (49.95, 11.57), (48.137, 11.575), (49.452, 11.077)
+        users = [
+            get_random_user(postal_code="95444", max_travel_duration=30),
+            get_random_user(postal_code="80331", max_travel_duration=120),
+        ]
+        exams = [
+            get_random_exam(postal_code="80331", city="München"),
+            get_random_exam(postal_code="90402", city="Nürnberg"),
+            get_random_exam(postal_code="12345", city=UNKNOWN_ADDRESS),
+        ]
+        exams_df = matching.get_exams_dataframe(exams)
+        coordinates = {
+            users[0].get_address_line(): bayreuth,
+            users[1].get_address_line(): munich,
+            exams[0].get_address_line(): munich,
+            exams[1].get_address_line(): nuremberg,
+            exams[2].get_address_line(): None,
+        }
+        geocoder = mock.Mock(geocode=lambda db, addresses: coordinates)
+
+        reachable = matching.get_reachable_matrix(None, users, exams_df, geocoder)
+
+        # 30 + 10 minutes at 130 km/h are ~87 km: Bayreuth - Nuremberg is ~65 km, Bayreuth - Munich ~200 km
+        np.testing.assert_array_equal(reachable, [[False, True, True], [True, True, True]])
@@ -0,0 +1,207 @@
+import random
+import unittest
+import uuid
+from datetime import datetime, timedelta
+from unittest import mock
+
+import numpy as np
+from sqlmodel import Session
+
+from fishing_exam_alert import db, matching, models, utils
+from fishing_exam_alert.distances import TravelDistance
+from fishing_exam_alert.settings import setting
+from tests.utils import (
+    create_random_exam,
+    create_random_user,
+    get_random_exam,
+    get_random_user,
+)
+
+
+class TestMatching(unittest.TestCase):
+    def setUp(self):
+        self.users = [
+            get_random_user(
+                email=f"user{i}@example.com",
+                postal_code="80331",
+                districts=random.choice(["", "Oberbayern", "Schwaben, Mittelfranken"]),
+                need_headphones=random.choice([True, False]),
+                need_disabled_access=random.choice([True, False]),
+            )
+            for i in range(30)
+        ]
+        self.exams = [
+            get_random_exam(
+                exam_id=str(i),
+                postal_code="80331",
+                status="Frei",
+                exam_start=datetime.utcnow() + timedelta(days=7),
+                district=random.choice(list(models.District)),
+                headphones=random.choice([True, False]),
+                disabled_access=random.choice([True, False]),
+            )
+            for i in range(20)
+        ]
+
+    def test_eligibility_matrix_matches_user_filters(self):
+        # the helpers pick random values for falsy arguments, so the filters are set afterwards
+        users = list()
+        for districts, need_headphones, need_disabled_access in (
+            ([], False, False),
+            ([models.District.Oberbayern], True, False),
+            ([models.District.Schwaben, models.District.Mittelfranken], False, True),
+        ):
+            user = get_random_user(postal_code="80331")
+            user.district_mask = models.District.get_mask(districts)
+            user.need_headphones, user.need_disabled_access = need_headphones, need_disabled_access
+            users.append(user)
+        exams = list()
+        for district, headphones, disabled_access in (
+            (models.District.Oberbayern, True, False),
+            (models.District.Schwaben, False, True),
+            (models.District.Mittelfranken, True, True),
+            (models.District.Oberbayern, False, True),
+        ):
+            exam = get_random_exam(postal_code="80331", district=district)
+            exam.headphones, exam.disabled_access = headphones, disabled_access
+            exams.append(exam)
+
+        eligible = matching.get_eligibility_matrix(
+            matching.get_users_dataframe(users), matching.get_exams_dataframe(exams)
+        )
+
+        expected = [
+            [True, True, True, True],  # no filters
+            [True, False, False, False],  # Oberbayern with headphones
+            [False, True, True, False],  # Schwaben or Mittelfranken with disabled access
+        ]
+        self.assertEqual(eligible.tolist(), expected)
+
+    def test_eligibility_matrix_without_exams(self):
+        users_df = matching.get_users_dataframe(self.users)
+        exams_df = matching.get_exams_dataframe([])
+
+        self.assertEqual(matching.get_eligibility_matrix(users_df, exams_df).shape, (len(self.users), 0))
+
+    def test_priorities_rank_soon_exams_and_users_with_few_candidates_first(self):
+        now = datetime.utcnow()
+        users = [
+            get_random_user(postal_code="80331", max_travel_duration=60),
+            get_random_user(postal_code="90402", max_travel_duration=60),
+            get_random_user(postal_code="95444"),
+        ]
+        users[2].max_travel_duration = None
+        exams = [
+            get_random_exam(postal_code="80331", exam_start=now + timedelta(days=30, hours=1)),
+            get_random_exam(postal_code="90402", exam_start=now + timedelta(days=2, hours=1)),
+        ]
+        exams_df = matching.get_exams_dataframe(exams)
+        candidates = np.array([[True, True], [False, True], [True, True]])
+
+        priorities = matching.get_priorities(users, exams_df, candidates, now=now)
+
+        start_1, start_2 = users[0].get_address_line(), users[1].get_address_line()
+        end_1, end_2 = exams[0].get_address_line(), exams[1].get_address_line()
+        self.assertEqual(priorities, {(start_1, end_1): (30, 2), (start_1, end_2): (2, 2), (start_2, end_2): (2, 1)})
+        self.assertEqual(sorted(priorities, key=priorities.get)[0], (start_2, end_2))
+
+
+class TestUserExamMatches(unittest.TestCase):
+    def setUp(self):
+        self.session = Session(db.engine)
+        self.addCleanup(self.session.close)
+        exam_start = datetime.utcnow() + timedelta(days=7)
+        self.exams = [
+            create_random_exam(
+                self.session, exam_id=uuid.uuid4().hex, district=district, exam_start=exam_start, street=street
+            )
+            for district, street in (
+                (models.District.Oberbayern, "Nahe Straße"),
+                (models.District.Oberbayern, "Ferne Straße"),
+                (models.District.Schwaben, "Nahe Straße"),
+            )
+        ]
+
+    def create_user(self, max_travel_duration: int = 0) -> models.User:
+        return create_random_user(
+            self.session,
+            districts="Oberbayern",
+            max_travel_duration=max_travel_duration,
+            need_headphones=False,
+            need_disabled_access=False,
+        )
+
+    def get_pending_exam_ids(self, user: models.User):
+        if user.id not in models.UserExamMatch.get_pending_user_ids(self.session):
+            return set()
+        return set(matching.get_user_matches(self.session, user)["id"])
+
+    def test_update_matches_incrementally(self):
+        user = self.create_user()
+
+        self.assertEqual(matching.update_matches(self.session, [user], exams=self.exams), 2)
+        self.assertEqual(self.get_pending_exam_ids(user), {self.exams[0].id, self.exams[1].id})
+
+        models.UserExamMatch.set_notified(self.session, user.id, [self.exams[0].id, self.exams[1].id])
+        self.assertEqual(self.get_pending_exam_ids(user), set())
+
+        # a recomputation keeps the notification, unless the exam changed
+        matching.update_matches(self.session, [user], exams=self.exams[:1])
+        self.assertEqual(self.get_pending_exam_ids(user), set())
+        matching.update_matches(self.session, [user], exams=self.exams[:1], reset_notified=True)
+        self.assertEqual(self.get_pending_exam_ids(user), {self.exams[0].id, self.exams[1].id})
+
+        # a taken exam loses its match
+        self.exams[1].status = "Belegt"
+        self.session.add(self.exams[1])
+        self.session.commit()
+        matching.update_matches(self.session, [user], exams=self.exams[1:2])
+        self.assertEqual(set(matching.get_user_matches(self.session, user)["id"]), {self.exams[0].id})
+
+    def test_update_matches_with_travel_duration(self):
+        user = self.create_user(max_travel_duration=30)
+        distances = {
+            (user.get_address_line(), self.exams[0].get_address_line()): TravelDistance(distance=9000, duration=600),
+            (user.get_address_line(), self.exams[1].get_address_line()): TravelDistance(distance=90000, duration=5400),
+        }
+        resolver = mock.Mock(resolve=mock.Mock(return_value=distances), cache=mock.Mock())
+
+        with mock.patch.object(setting, "PREFILTER_MAX_SPEED_KMH", 0):
+            matching.update_matches(self.session, [user], exams=self.exams, resolver=resolver)
+
+        matches = matching.get_user_matches(self.session, user)
+        self.assertEqual(list(matches["id"]), [self.exams[0].id])
+        self.assertEqual(matches.iloc[0]["travel_duration"], 600)
+        self.assertEqual(matches.iloc[0]["start_address_line"], user.get_address_line())
+        self.assertEqual(len(models.UserExamMatch.get_eligible_by_user(self.session, user.id)), 1)
+
+    def test_get_unresolved_user_ids_skips_cached_failures(self):
+        user = self.create_user(max_travel_duration=30)
+        resolver = mock.Mock(resolve=mock.Mock(return_value=dict()), cache=mock.Mock())
+        with mock.patch.object(setting, "PREFILTER_MAX_SPEED_KMH", 0):
+            matching.update_matches(self.session, [user], exams=self.exams, resolver=resolver)
+
+        # the lookups were deferred
+        self.assertIn(user.id, models.UserExamMatch.get_unresolved_user_ids(self.session))
+
+        distances = [
+            models.Distance(
+                start_address=utils.normalize_address(user.get_address_line()),
+                end_address=utils.normalize_address(exam.get_address_line()),
+            )
+            for exam in self.exams[:2]
+        ]
+        for distance in distances:
+            distance.set_failure(models.DistanceErrorClass.no_route, "ZERO_RESULTS")
+            self.session.add(distance)
+        self.session.commit()
+        self.addCleanup(self.session.commit)
+        for distance in distances:
+            self.addCleanup(self.session.delete, distance)
+        self.assertNotIn(user.id, models.UserExamMatch.get_unresolved_user_ids(self.session))
+
+        # the failure of one pair expired
+        distances[0].failed_at = datetime.utcnow() - timedelta(hours=setting.DISTANCE_NO_ROUTE_TTL_HOURS + 1)
+        self.session.add(distances[0])
+        self.session.commit()
+        self.assertIn(user.id, models.UserExamMatch.get_unresolved_user_ids(self.session))
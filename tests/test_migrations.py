@@ -0,0 +1,158 @@
+import json
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine, text
+
+from fishing_exam_alert import migrations, models
+from fishing_exam_alert.settings import setting
+
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        with self.engine.begin() as connection:
+            connection.execute(
+                text(
+                    "CREATE TABLE distance (id INTEGER PRIMARY KEY, start_address VARCHAR, end_address VARCHAR, duration INTEGER, details VARCHAR)"
+                )
+            )
+            connection.execute(
+                text(
+                    "INSERT INTO distance (id, start_address, end_address, duration) VALUES "
+                    "(1, '80335, Deutschland', 'Ziel', 60), (2, '80335 ,deutschland', 'Ziel', NULL), (3, '80336, Deutschland', 'Ziel', NULL)"
+                )
+            )
+            connection.execute(text('CREATE TABLE "user" (id INTEGER PRIMARY KEY, email VARCHAR, districts VARCHAR)'))
+            connection.execute(
+                text(
+                    """INSERT INTO "user" (id, email, districts) VALUES """
+                    """(1, 'a@example.com', 'Oberbayern, Schwaben'), (2, 'b@example.com', ''), (3, 'c@example.com', NULL)"""
+                )
+            )
+
+    def test_add_district_mask_to_user(self):
+        for _ in range(2):  # the migration must be idempotent
+            with self.engine.begin() as connection:
+                migrations.add_district_mask_to_user(connection)
+
+        with self.engine.connect() as connection:
+            rows = connection.execute(text('SELECT id, districts, district_mask FROM "user" ORDER BY id')).all()
+
+        expected_mask = models.District.Oberbayern.bit | models.District.Schwaben.bit
+        self.assertEqual([tuple(row) for row in rows], [(1, None, expected_mask), (2, "", 0), (3, None, 0)])
+
+    def test_add_unique_index_on_distance_addresses(self):
+        for _ in range(2):  # the migration must be idempotent
+            with self.engine.begin() as connection:
+                migrations.add_unique_index_on_distance_addresses(connection)
+
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                text("SELECT id, start_address, end_address, duration FROM distance ORDER BY id")
+            ).all()
+
+        self.assertEqual(
+            [tuple(row) for row in rows],
+            [(1, "80335, deutschland", "ziel", 60), (3, "80336, deutschland", "ziel", None)],
+        )
+
+    def test_compact_distance_details(self):
+        directions = [
+            {
+                "summary": "A9",
+                "legs": [{"distance": {"text": "12 km", "value": 12000}, "duration": {"text": "9 mins", "value": 540}}],
+            }
+        ]
+        element = {
+            "status": "OK",
+            "distance": {"text": "1 km", "value": 1000},
+            "duration": {"text": "2 mins", "value": 120},
+        }
+        with self.engine.begin() as connection:
+            connection.execute(
+                text("UPDATE distance SET details = :details WHERE id = :id"),
+                [{"id": 1, "details": json.dumps(directions)}, {"id": 2, "details": json.dumps(element)}],
+            )
+
+        for mode, expected_details in (
+            ("zlib", [directions, element, None]),
+            (
+                "summary",
+                [
+                    {"route": "A9", "distance": "12 km", "duration": "9 mins"},
+                    {"distance": "1 km", "duration": "2 mins"},
+                    None,
+                ],
+            ),
+            ("off", [None, None, None]),
+        ):
+            with mock.patch.object(setting, "DISTANCE_DETAILS_MODE", mode):
+                for _ in range(2):  # the migration must be idempotent
+                    with self.engine.begin() as connection:
+                        migrations.compact_distance_details(connection, batch_size=1)
+
+            with self.engine.connect() as connection:
+                rows = connection.execute(text("SELECT details FROM distance ORDER BY id")).all()
+            self.assertEqual([models.Distance.decode_details(row[0]) for row in rows], expected_details, mode)
+            if mode == "zlib":
+                self.assertTrue(all(row[0].startswith(models.DISTANCE_DETAILS_ZLIB_PREFIX) for row in rows[:2]))
+
+    def test_add_failure_columns_to_distance(self):
+        for _ in range(2):  # the migration must be idempotent
+            with self.engine.begin() as connection:
+                migrations.add_failure_columns_to_distance(connection)
+
+        with self.engine.connect() as connection:
+            rows = connection.execute(text("SELECT error_class, failure_count FROM distance")).all()
+
+        self.assertEqual([tuple(row) for row in rows], [(None, 0)] * 3)
+
+    def test_add_fingerprint_to_email_log(self):
+        with self.engine.begin() as connection:
+            connection.execute(
+                text(
+                    "CREATE TABLE emaillog (id INTEGER PRIMARY KEY, content VARCHAR, user_id INTEGER, created_at DATETIME)"
+                )
+            )
+            connection.execute(text("CREATE TABLE outbox_message (id INTEGER PRIMARY KEY, content VARCHAR)"))
+            connection.execute(text("INSERT INTO emaillog (id, content, user_id) VALUES (1, 'Test', 1)"))
+
+        for _ in range(2):  # the migration must be idempotent
+            with self.engine.begin() as connection:
+                migrations.add_fingerprint_to_email_log(connection)
+
+        with self.engine.connect() as connection:
+            rows = connection.execute(text("SELECT content, fingerprint FROM emaillog")).all()
+            indexes = {row[1] for row in connection.execute(text("PRAGMA index_list(emaillog)"))}
+            outbox_columns = {row[1] for row in connection.execute(text("PRAGMA table_info(outbox_message)"))}
+
+        self.assertEqual([tuple(row) for row in rows], [("Test", None)])
+        self.assertEqual(indexes, {"ix_emaillog_fingerprint", "ix_emaillog_user_id_created_at"})
+        self.assertIn("fingerprint", outbox_columns)
+
+    def test_add_bulk_email_to_outbox_message(self):
+        with self.engine.begin() as connection:
+            connection.execute(text("CREATE TABLE outbox_message (id INTEGER PRIMARY KEY, content VARCHAR)"))
+
+        for _ in range(2):  # the migration must be idempotent
+            with self.engine.begin() as connection:
+                migrations.add_bulk_email_to_outbox_message(connection)
+
+        with self.engine.connect() as connection:
+            columns = {row[1] for row in connection.execute(text("PRAGMA table_info(outbox_message)"))}
+
+        self.assertEqual(columns, {"id", "content", "bulk_email_id", "bulk_email_index"})
+
+    def test_add_exam_ids_to_outbox_message(self):
+        with self.engine.begin() as connection:
+            connection.execute(text("CREATE TABLE outbox_message (id INTEGER PRIMARY KEY, content VARCHAR)"))
+
+        for _ in range(2):  # the migration must be idempotent
+            with self.engine.begin() as connection:
+                migrations.add_exam_ids_to_outbox_message(connection)
+
+        with self.engine.connect() as connection:
+            columns = {row[1] for row in connection.execute(text("PRAGMA table_info(outbox_message)"))}
+
+        self.assertEqual(columns, {"id", "content", "exam_ids"})
@@ -1,9 +1,19 @@
+import os
 import unittest
+import uuid
+from datetime import datetime, timedelta
+from unittest import mock
 
 from sqlmodel import Session
 
 from fishing_exam_alert import db, models
-from tests.utils import create_random_user
+from fishing_exam_alert.parser import get_exam_parser
+from tests.utils import (
+    create_random_exam,
+    create_random_user,
+    get_random_exam,
+    get_random_user,
+)
 
 
 class TestUser(unittest.TestCase):
@@ -21,9 +31,204 @@ class TestUser(unittest.TestCase):
         self.assertEqual(user_in, user)
 
     def test_districts(self):
-        districts = [models.District.Mittelfranken, models.District.Oberbayern]
+        districts = [models.District.Oberbayern, models.District.Mittelfranken]
 
         with Session(db.engine) as session:
             user = create_random_user(session, districts=", ".join([d.value for d in districts]))
 
             self.assertEqual(user.district_list, districts)
+
+
+class TestDistrict(unittest.TestCase):
+    def test_mask(self):
+        districts = models.District.parse_list("Schwaben, Oberbayern")
+        mask = models.District.get_mask(districts)
+
+        self.assertEqual(mask, models.District.Oberbayern.bit | models.District.Schwaben.bit)
+        self.assertEqual(models.District.from_mask(mask), [models.District.Oberbayern, models.District.Schwaben])
+        self.assertEqual(models.District.get_mask(models.District.parse_list("")), 0)
+
+    def test_get_multi_exams_by_district_mask(self):
+        exam_id_prefix = uuid.uuid4().hex
+        with Session(db.engine) as session:
+            for district in models.District:
+                create_random_exam(session, exam_id=f"{exam_id_prefix}-{district.value}", district=district)
+
+            mask = models.District.get_mask([models.District.Oberpfalz, models.District.Unterfranken])
+            exams = [
+                exam
+                for exam in models.Exam.get_multi(session, district_mask=mask)
+                if exam.exam_id.startswith(exam_id_prefix)
+            ]
+
+        self.assertEqual({exam.district for exam in exams}, {models.District.Oberpfalz, models.District.Unterfranken})
+
+
+class TestAppState(unittest.TestCase):
+    def test_set_and_get_value(self):
+        key = f"test.{uuid.uuid4()}"
+        with Session(db.engine) as session:
+            self.assertEqual(models.AppState.get_value(session, key=key, default="missing"), "missing")
+            models.AppState.set_value(session, key=key, value="abc")
+            self.assertEqual(models.AppState.get_value(session, key=key), "abc")
+
+    def test_increment(self):
+        key = f"test.{uuid.uuid4()}"
+        with Session(db.engine) as session:
+            self.assertEqual(models.AppState.increment(session, key=key), 1)
+            self.assertEqual(models.AppState.increment(session, key=key, by=2), 3)
+
+
+class TestExamTableScraper(unittest.TestCase):
+    def test_normalize_content_ignores_volatile_values(self):
+        scraper = models.ExamTableScraper.__new__(models.ExamTableScraper)
+        first = b'<input type="hidden" name="_csrf" value="505c52c8" />\n<form action="/x?execution=e1s1">'
+        second = b'<input type="hidden" name="_csrf" value="f00ba12c" />  <form action="/x?execution=e2s3">'
+
+        self.assertEqual(scraper._normalize_content(first), scraper._normalize_content(second))
+
+    def test_normalize_content_keeps_exam_values(self):
+        scraper = models.ExamTableScraper.__new__(models.ExamTableScraper)
+        first = b"<td>19.02.2022, 14:15</td><td>Belegt</td>"
+        second = b"<td>19.02.2022, 14:15</td><td>Frei</td>"
+
+        self.assertNotEqual(scraper._normalize_content(first), scraper._normalize_content(second))
+
+    def test_get_exam_pages_fetches_search_form_fresh(self):
+        with open(os.path.join(os.path.dirname(__file__), "fixtures", "exam_overview.html"), "rb") as f:
+            overview_content = f.read()
+        scraper = models.ExamTableScraper.__new__(models.ExamTableScraper)
+        scraper.parser = get_exam_parser("html.parser")
+        scraper.client = mock.Mock()
+        scraper.client.get.return_value.iter_content.return_value = [overview_content]
+        scraper.client.post.return_value.iter_content.return_value = [b"<html></html>"]
+
+        scraper.get_exam_pages()
+        scraper.get_exam_pages()
+
+        self.assertEqual(scraper.client.get.call_count, 2)
+        self.assertEqual(scraper.client.post.call_args.kwargs["data"]["_csrf"], "505c52c8-1758-4607-9379-595071127965")
+
+    def test_sync_cancelled_exams_uses_utc(self):
+        scraper = models.ExamTableScraper.__new__(models.ExamTableScraper)
+
+        with mock.patch.object(models.Exam, "get_multi_not_listed", return_value=[]) as get_multi_mock:
+            scraper._sync_cancelled_exams(mock.Mock(), {"4711"})
+
+        exam_start_min = get_multi_mock.call_args.kwargs["exam_start__min"]
+        self.assertAlmostEqual(exam_start_min, datetime.utcnow(), delta=timedelta(seconds=5))
+
+    def test_index_overview_table(self):
+        scraper = models.ExamTableScraper.__new__(models.ExamTableScraper)
+        overview_table = [
+            {
+                "Prüfungstermin": "19.02.2022, 14:15",
+                "Prüfungslokal": "BFZ",
+                "Ort": "Bayreuth",
+                "Regierungsbezirk": "Oberfranken",
+            },
+            {
+                "Prüfungstermin": "19.02.2022, 14:15",
+                "Prüfungslokal": "BFZ",
+                "Ort": "Bayreuth",
+                "Regierungsbezirk": "Oberfranken",
+            },
+            {
+                "Prüfungstermin": "20.02.2022, 08:00",
+                "Prüfungslokal": "ASV",
+                "Ort": "Landshut",
+                "Regierungsbezirk": "Niederbayern",
+            },
+            {
+                "Prüfungstermin": "20.02.2022, 08:00",
+                "Prüfungslokal": "ASV",
+                "Ort": "Landshut",
+                "Regierungsbezirk": "Schwaben",
+            },
+        ]
+
+        index = scraper._index_overview_table(overview_table)
+
+        self.assertEqual(index, {("BFZ", "Bayreuth", "19.02.2022, 14:15"): models.District.Oberfranken})
+
+        detail_table = {
+            "Prüfungslokal": "BFZ",
+            "Ort": "Bayreuth",
+            "Prüfungstermin": "19.02.2022",
+            "Prüfungsbeginn": "14:15",
+        }
+        self.assertEqual(index[scraper._get_detail_table_key(detail_table)], models.District.Oberfranken)
+
+
+class TestExamRecord(unittest.TestCase):
+    def test_record_has_synced_exam_columns(self):
+        self.assertEqual(
+            set(models.ExamRecord._fields), set(models.Exam.__fields__) - {"id", "created_at", "updated_at"}
+        )
+
+    def test_to_exam(self):
+        exam = get_random_exam(postal_code="80331")
+        record = models.ExamRecord(**exam.dict(include=set(models.ExamRecord._fields)))
+
+        self.assertEqual(record.to_exam().dict(), exam.dict())
+
+
+class TestDistance(unittest.TestCase):
+    element = {
+        "status": "OK",
+        "distance": {"text": "1.2 km", "value": 1200},
+        "duration": {"text": "3 mins", "value": 180},
+    }
+
+    def test_encode_details(self):
+        self.assertIsNone(models.Distance.encode_details(self.element, mode="off"))
+        self.assertEqual(
+            models.Distance.decode_details(models.Distance.encode_details(self.element, mode="summary")),
+            {"distance": "1.2 km", "duration": "3 mins"},
+        )
+        self.assertEqual(
+            models.Distance.decode_details(models.Distance.encode_details(self.element, mode="zlib")), self.element
+        )
+
+
+class TestExamEvent(unittest.TestCase):
+    def setUp(self):
+        self.old_values = get_random_exam(
+            status="Belegt",
+            current_participants=10,
+            max_participants=10,
+            postal_code="80331",
+            district=models.District.Oberbayern,
+        ).dict()
+
+    def test_from_changes_new_exam(self):
+        events = models.ExamEvent.from_changes("0001", None, self.old_values)
+
+        self.assertEqual([event.event_type for event in events], [models.ExamEventType.new])
+
+    def test_from_changes_seats_freed(self):
+        new_values = {**self.old_values, "current_participants": 8, "status": "Frei"}
+
+        events = models.ExamEvent.from_changes("0001", self.old_values, new_values)
+
+        event_types = [event.event_type for event in events]
+        self.assertEqual(event_types, [models.ExamEventType.seats_freed, models.ExamEventType.status_free])
+        self.assertEqual(events[0].details, "10 -> 8")
+
+    def test_from_changes_start_moved(self):
+        new_values = {**self.old_values, "exam_start": self.old_values["exam_start"] + timedelta(hours=1)}
+
+        events = models.ExamEvent.from_changes("0001", self.old_values, new_values)
+
+        self.assertEqual([event.event_type for event in events], [models.ExamEventType.start_moved])
+
+    def test_from_changes_modified(self):
+        new_values = {**self.old_values, "current_participants": 11, "district": models.District.Schwaben}
+
+        events = models.ExamEvent.from_changes("0001", self.old_values, new_values)
+
+        self.assertEqual([event.event_type for event in events], [models.ExamEventType.modified])
+        self.assertEqual(events[0].details, "district, current_participants")
+
+    def test_from_changes_without_change(self):
+        self.assertEqual(models.ExamEvent.from_changes("0001", self.old_values, dict(self.old_values)), [])
@@ -0,0 +1,176 @@
+import smtplib
+import time
+import unittest
+from email.message import EmailMessage
+from typing import List
+from unittest import mock
+
+from fishing_exam_alert import notifier
+from tests.fake_mailersend_api import (
+    INVALID_RECIPIENT,
+    SUPPRESSED_RECIPIENT,
+    FakeMailersendApi,
+)
+
+
+class FakeSMTP:
+    """Records the logins and sent messages; closes the connection after `max_messages` messages."""
+
+    instances: List["FakeSMTP"] = []
+    max_messages = 1000
+
+    def __init__(self, host: str, port: int):
+        self.logins = 0
+        self.sent: List[EmailMessage] = []
+        self.instances.append(self)
+
+    def starttls(self):
+        pass
+
+    def login(self, user: str, password: str):
+        self.logins += 1
+
+    def send_message(self, msg: EmailMessage):
+        if len(self.sent) >= self.max_messages:
+            raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+        self.sent.append(msg)
+
+    def quit(self):
+        pass
+
+
+def get_message(email_to: str) -> EmailMessage:
+    msg = EmailMessage()
+    msg.set_content("Test")
+    msg["To"] = email_to
+    return msg
+
+
+class TestSmtpSession(unittest.TestCase):
+    def setUp(self):
+        FakeSMTP.instances = []
+        FakeSMTP.max_messages = 1000
+        patcher = mock.patch("fishing_exam_alert.notifier.smtplib.SMTP", FakeSMTP)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_send_messages_over_one_connection(self):
+        with notifier.SmtpSession() as smtp_session:
+            for i in range(5):
+                smtp_session.send_message(get_message(f"user{i}@example.com"))
+
+        self.assertEqual(len(FakeSMTP.instances), 1)
+        self.assertEqual(FakeSMTP.instances[0].logins, 1)
+        self.assertEqual(len(FakeSMTP.instances[0].sent), 5)
+
+    def test_reconnect_if_disconnected(self):
+        FakeSMTP.max_messages = 2
+
+        with notifier.SmtpSession() as smtp_session:
+            for i in range(5):
+                smtp_session.send_message(get_message(f"user{i}@example.com"))
+
+        self.assertEqual([len(smtp.sent) for smtp in FakeSMTP.instances], [2, 2, 1])
+        self.assertEqual(smtp_session.sent_count, 5)
+
+    def test_raise_if_reconnect_fails(self):
+        FakeSMTP.max_messages = 0
+
+        with notifier.SmtpSession() as smtp_session:
+            with self.assertRaises(smtplib.SMTPServerDisconnected):
+                smtp_session.send_message(get_message("user@example.com"))
+
+        self.assertEqual(len(FakeSMTP.instances), 2)
+
+    def test_delivery_session_shares_connection(self):
+        with mock.patch.object(notifier.setting, "MAIL_SERVICE", "GMX"):
+            with notifier.delivery_session():
+                for i in range(3):
+                    notifier.send_mail_with_gmx(f"user{i}@example.com", "Test", "Test")
+            notifier.send_mail_with_gmx("user@example.com", "Test", "Test")
+
+        self.assertEqual([len(smtp.sent) for smtp in FakeSMTP.instances], [3, 1])
+
+
+class TestMailersendBatch(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.fake_mailersend_api = FakeMailersendApi()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fake_mailersend_api.shutdown()
+
+    def setUp(self):
+        self.fake_mailersend_api.clear()
+        self.batch = notifier.MailersendBatch(
+            api_key="test", api_base=self.fake_mailersend_api.api_base, chunk_size=3, backoff_seconds=0
+        )
+
+    def test_send_in_chunks(self):
+        for i in range(7):
+            self.batch.add(f"user{i}@example.com", "Test", "Test", "<p>Test</p>")
+
+        mails = self.batch.flush()
+
+        self.assertEqual([mail.status for mail in mails], ["sent"] * 7)
+        self.assertEqual(
+            [mail["to"][0]["email"] for mail in self.fake_mailersend_api.sent],
+            [f"user{i}@example.com" for i in range(7)],
+        )
+        self.assertEqual(self.fake_mailersend_api.requests.count("POST /v1/bulk-email"), 3)
+        self.assertEqual(self.batch.mails, [])
+
+    def test_retry_failed_requests(self):
+        for i in range(4):
+            self.batch.add(f"user{i}@example.com", "Test", "Test")
+        self.fake_mailersend_api.fail_next_requests(1)  # the first chunk
+
+        mails = self.batch.flush()
+
+        self.assertEqual([mail.status for mail in mails], ["sent"] * 4)
+        self.assertEqual([mail.attempts for mail in mails], [2, 2, 2, 1])
+        self.assertEqual(len(self.fake_mailersend_api.sent), 4)
+
+    def test_track_rejected_mails(self):
+        self.batch.add("user@example.com", "Test", "Test")
+        self.batch.add(f"{INVALID_RECIPIENT}@example.com", "Test", "Test")
+        self.batch.add(f"{SUPPRESSED_RECIPIENT}@example.com", "Test", "Test")
+
+        mails = self.batch.flush()
+
+        # rejected mails are not retried
+        self.assertEqual([mail.status for mail in mails], ["sent", "failed", "failed"])
+        self.assertEqual([mail.attempts for mail in mails], [1, 1, 1])
+        self.assertIn("must be valid", mails[1].error)
+
+    def test_poll_bulk_email_that_completes_after_the_poll_timeout(self):
+        self.batch.poll_timeout_seconds, self.batch.poll_interval_seconds = 0.05, 0.01
+        self.fake_mailersend_api.process_bulk_emails_for(0.3)
+        for i in range(2):
+            self.batch.add(f"user{i}@example.com", "Test", "Test")
+
+        mails = self.batch.flush()
+
+        # the accepted chunk is not submitted again
+        self.assertEqual([mail.status for mail in mails], ["submitted"] * 2)
+        self.assertEqual([mail.index for mail in mails], [0, 1])
+        self.assertEqual(self.fake_mailersend_api.requests.count("POST /v1/bulk-email"), 1)
+
+        time.sleep(0.3)
+        self.batch.poll(mails)
+
+        self.assertEqual([mail.status for mail in mails], ["sent"] * 2)
+        self.assertEqual(len(self.fake_mailersend_api.sent), 2)
+        self.assertEqual(self.fake_mailersend_api.requests.count("POST /v1/bulk-email"), 1)
+
+    def test_give_up_after_max_retries(self):
+        self.batch.max_retries = 1
+        self.batch.add("user@example.com", "Test", "Test")
+        self.fake_mailersend_api.fail_next_requests(2)
+
+        mails = self.batch.flush()
+
+        self.assertEqual(mails[0].status, "failed")
+        self.assertEqual(mails[0].attempts, 2)
+        self.assertIn("500", mails[0].error)
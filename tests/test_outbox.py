@@ -0,0 +1,237 @@
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pandas as pd
+from sqlmodel import Session, SQLModel, create_engine
+
+from fishing_exam_alert import models, notifier, outbox
+from tests.fake_mailersend_api import INVALID_RECIPIENT, FakeMailersendApi
+from tests.utils import get_random_exam
+
+
+class TestOutboxDelivery(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine("sqlite://")
+        SQLModel.metadata.create_all(engine)
+        self.session = Session(engine)
+        self.addCleanup(self.session.close)
+
+        self.sent = list()
+        self.failing_emails = set()
+        self.threads = set()
+        patcher = mock.patch("fishing_exam_alert.notifier.send_message", side_effect=self.send_message)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("fishing_exam_alert.utils.notify_admin_via_gchat")
+        self.notify_admin_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.delivery = outbox.OutboxDelivery(max_workers=4, max_attempts=3, backoff_seconds=60, lease_minutes=30)
+
+    def send_message(self, email_to: str, subject: str, message: str, html_message: str = ""):
+        self.threads.add(threading.get_ident())
+        time.sleep(0.01)
+        if email_to in self.failing_emails:
+            raise ConnectionError("Connection refused")
+        self.sent.append(email_to)
+
+    def enqueue(self, count: int):
+        for i in range(count):
+            models.OutboxMessage.enqueue(self.session, f"user{i}@example.com", "Test", f"Test {i}", "<p>Test</p>")
+        self.session.commit()
+
+    def test_drain_sends_due_messages_with_workers(self):
+        self.enqueue(20)
+
+        results = self.delivery.drain(self.session)
+
+        self.assertEqual(results, {models.OutboxStatus.sent: 20})
+        self.assertEqual(sorted(self.sent), sorted(f"user{i}@example.com" for i in range(20)))
+        self.assertEqual(len(self.threads), 4)
+        self.assertEqual(models.OutboxMessage.count_by_status(self.session), {models.OutboxStatus.sent: 20})
+        self.assertEqual(len(self.session.exec(models.sqlmodel.select(models.EmailLog)).all()), 20)
+
+        # the sent messages are not sent again
+        self.assertEqual(self.delivery.drain(self.session), {})
+        self.assertEqual(len(self.sent), 20)
+
+    def test_drain_retries_failed_messages_with_backoff(self):
+        self.enqueue(3)
+        self.failing_emails = {"user1@example.com"}
+
+        results = self.delivery.drain(self.session)
+
+        self.assertEqual(results, {models.OutboxStatus.sent: 2, models.OutboxStatus.pending: 1})
+        message = self.session.exec(
+            models.sqlmodel.select(models.OutboxMessage).where(models.OutboxMessage.status == "pending")
+        ).one()
+        self.assertEqual(message.attempts, 1)
+        self.assertIn("Connection refused", message.last_error)
+        self.assertGreater(message.next_attempt_at, datetime.utcnow() + timedelta(seconds=50))
+
+        # the next drain after the backoff sends it
+        self.failing_emails = set()
+        message.next_attempt_at = datetime.utcnow()
+        self.session.add(message)
+        self.session.commit()
+        self.assertEqual(self.delivery.drain(self.session), {models.OutboxStatus.sent: 1})
+        self.assertEqual(self.sent.count("user1@example.com"), 1)
+
+    def test_drain_dead_letters_after_max_attempts(self):
+        self.delivery.backoff = timedelta(0)
+        self.enqueue(2)
+        self.failing_emails = {"user0@example.com"}
+
+        results = self.delivery.drain(self.session)
+
+        self.assertEqual(
+            results,
+            {models.OutboxStatus.sent: 1, models.OutboxStatus.pending: 2, models.OutboxStatus.dead: 1},
+        )
+        self.notify_admin_mock.assert_called_once()
+        self.assertIn("user0@example.com", self.notify_admin_mock.call_args.args[0])
+
+    def test_dead_letter_resets_notified_matches(self):
+        self.delivery.backoff = timedelta(0)
+        user, _ = models.User.get_or_create(self.session, email="user0@example.com")
+        for exam_id in (1, 2, 3):
+            self.session.add(
+                models.UserExamMatch(user_id=user.id, exam_id=exam_id, eligible=True, notified_at=datetime.utcnow())
+            )
+        models.OutboxMessage.enqueue(self.session, user.email, "Test", "Test", user_id=user.id, exam_ids=[1, 2])
+        self.session.commit()
+        self.failing_emails = {user.email}
+
+        for _ in range(3):
+            self.delivery.drain(self.session)
+
+        self.assertEqual(models.OutboxMessage.count_by_status(self.session), {models.OutboxStatus.dead: 1})
+        matches = self.session.exec(models.sqlmodel.select(models.UserExamMatch).order_by(models.UserExamMatch.exam_id))
+        self.assertEqual([match.notified_at is None for match in matches], [True, True, False])
+
+    def test_drain_releases_stale_claims(self):
+        self.enqueue(2)
+        models.OutboxMessage.claim_due(self.session, limit=1, now=datetime.utcnow() - timedelta(hours=1))
+
+        results = self.delivery.drain(self.session)
+
+        self.assertEqual(results, {models.OutboxStatus.sent: 2})
+        self.assertEqual(len(self.sent), 2)
+
+    def test_drain_keeps_fresh_claims(self):
+        self.enqueue(2)
+        models.OutboxMessage.claim_due(self.session, limit=1)
+
+        results = self.delivery.drain(self.session)
+
+        self.assertEqual(results, {models.OutboxStatus.sent: 1})
+        self.assertEqual(self.sent, ["user1@example.com"])
+
+    def test_drain_in_bulk(self):
+        fake_mailersend_api = FakeMailersendApi()
+        self.addCleanup(fake_mailersend_api.shutdown)
+        self.enqueue(3)
+        models.OutboxMessage.enqueue(self.session, f"{INVALID_RECIPIENT}@example.com", "Test", "Test")
+        self.session.commit()
+
+        with mock.patch.multiple(
+            outbox.setting,
+            MAIL_SERVICE="mailersend",
+            MAILERSEND_BULK=True,
+            MAILERSEND_API_BASE=fake_mailersend_api.api_base,
+        ):
+            results = self.delivery.drain(self.session)
+
+        self.assertEqual(results, {models.OutboxStatus.sent: 3, models.OutboxStatus.pending: 1})
+        self.assertEqual(len(fake_mailersend_api.sent), 3)
+        self.assertEqual(self.sent, [])
+
+    def drain_in_bulk(self, fake_mailersend_api: FakeMailersendApi):
+        original_init = notifier.MailersendBatch.__init__
+
+        def init(batch, *args, **kwargs):
+            kwargs.setdefault("poll_interval_seconds", 0.01)
+            kwargs.setdefault("poll_timeout_seconds", 0.05)
+            original_init(batch, *args, **kwargs)
+
+        with mock.patch.multiple(
+            outbox.setting,
+            MAIL_SERVICE="mailersend",
+            MAILERSEND_BULK=True,
+            MAILERSEND_API_BASE=fake_mailersend_api.api_base,
+        ), mock.patch.object(notifier.MailersendBatch, "__init__", init):
+            return self.delivery.drain(self.session)
+
+    def test_drain_in_bulk_polls_submitted_messages(self):
+        fake_mailersend_api = FakeMailersendApi()
+        self.addCleanup(fake_mailersend_api.shutdown)
+        fake_mailersend_api.process_bulk_emails_for(0.3)
+        self.enqueue(2)
+
+        # the bulk email completes after the poll timeout
+        self.assertEqual(self.drain_in_bulk(fake_mailersend_api), {models.OutboxStatus.submitted: 2})
+        self.assertEqual(
+            [
+                (message.bulk_email_index, message.attempts)
+                for message in models.OutboxMessage.get_submitted(self.session)
+            ],
+            [(0, 1), (1, 1)],
+        )
+
+        time.sleep(0.3)
+        self.assertEqual(self.drain_in_bulk(fake_mailersend_api), {models.OutboxStatus.sent: 2})
+        self.assertEqual(len(fake_mailersend_api.sent), 2)
+        self.assertEqual(fake_mailersend_api.requests.count("POST /v1/bulk-email"), 1)
+
+    def test_drain_in_bulk_dead_letters_submitted_messages_after_lease(self):
+        fake_mailersend_api = FakeMailersendApi()
+        self.addCleanup(fake_mailersend_api.shutdown)
+        fake_mailersend_api.process_bulk_emails_for(60)
+        self.enqueue(2)
+        self.assertEqual(self.drain_in_bulk(fake_mailersend_api), {models.OutboxStatus.submitted: 2})
+
+        for message in models.OutboxMessage.get_submitted(self.session):
+            message.claimed_at -= timedelta(minutes=31)
+            self.session.add(message)
+        self.session.commit()
+
+        self.assertEqual(self.drain_in_bulk(fake_mailersend_api), {models.OutboxStatus.dead: 2})
+        self.assertEqual(fake_mailersend_api.requests.count("POST /v1/bulk-email"), 1)
+        self.notify_admin_mock.assert_called_once()
+        self.assertIn("is unknown", self.notify_admin_mock.call_args.args[0])
+
+    def test_notify_enqueues_once(self):
+        user, _ = models.User.get_or_create(self.session, email="user@example.com")
+        exams = pd.DataFrame.from_records(
+            [get_random_exam(id=i + 1, exam_id=str(i), postal_code="95444", status="Frei").dict() for i in range(2)]
+        )
+        exams["address_line"] = "Prüfungsweg 1, 95444 Bayreuth, Deutschland"
+
+        message = notifier.notify(self.session, user, exams)
+        self.session.commit()
+
+        self.assertEqual(message.status, models.OutboxStatus.pending)
+        self.assertEqual(message.subject, "Fischerprüfung Updates - Es gibt 2 freie Termine!")
+        self.assertEqual(message.fingerprint, notifier.get_exams_fingerprint(exams))
+        self.assertEqual(message.get_exam_ids(), [1, 2])
+        self.delivery.drain(self.session)
+
+        # the same exams in another order are not enqueued again
+        self.assertIsNone(notifier.notify(self.session, user, exams.iloc[::-1]))
+
+        # a changed seat state is
+        exams.loc[0, "current_participants"] += 1
+        self.assertIsNotNone(notifier.notify(self.session, user, exams))
+
+    def test_exams_fingerprint_ignores_other_columns(self):
+        exams = pd.DataFrame.from_records(
+            [get_random_exam(id=i + 1, exam_id=str(i), postal_code="95444", status="Frei").dict() for i in range(2)]
+        )
+        other_exams = exams.copy()
+        other_exams["name"] = "Anderes Prüfungslokal"
+
+        self.assertEqual(notifier.get_exams_fingerprint(exams), notifier.get_exams_fingerprint(other_exams))
+        self.assertEqual(notifier.get_exams_fingerprint(exams.iloc[::-1]), notifier.get_exams_fingerprint(exams))
@@ -0,0 +1,167 @@
+import importlib.util
+import io
+import os
+import types
+import unittest
+
+from sqlmodel import Session
+
+from fishing_exam_alert import db, models
+from fishing_exam_alert.parser import PARSER_BACKENDS, ExamHtmlParser, get_exam_parser
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def read_fixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURES_DIR, name), "rb") as f:
+        return f.read()
+
+
+def get_installed_backends():
+    installed = ["html.parser", "stream"]
+    for backend in ("lxml", "selectolax"):
+        if importlib.util.find_spec(backend):
+            installed.append(backend)
+    return installed
+
+
+class TestExamHtmlParser(unittest.TestCase):
+    def setUp(self):
+        self.overview_content = read_fixture("exam_overview.html")
+        self.detail_content = read_fixture("exam_detail.html")
+
+    def test_extract_overview_table(self):
+        parser = get_exam_parser("html.parser")
+        rows = parser.extract_overview_table(self.overview_content)
+
+        self.assertEqual(len(rows), 16)
+        self.assertEqual(rows[0]["Prüfungstermin"], "19.02.2022, 14:15")
+        self.assertEqual(rows[0]["Prüfungslokal"], "BFZ Bayreuth")
+        self.assertEqual(rows[0]["Regierungsbezirk"], "Oberfranken")
+
+    def test_extract_detail_tables(self):
+        parser = get_exam_parser("html.parser")
+        tables = parser.extract_detail_tables(self.detail_content)
+
+        self.assertEqual(len(tables), 16)
+        self.assertEqual(tables[0]["Prüfungs-Nr."], "4711")
+        self.assertEqual(tables[0]["Behindertengerecht"], "checked")
+        self.assertEqual(tables[1]["Behindertengerecht"], "")
+
+    def test_extract_search_form(self):
+        parser = get_exam_parser("html.parser")
+        search_form = parser.extract_search_form(self.overview_content)
+
+        self.assertEqual(search_form.csrf_token, "505c52c8-1758-4607-9379-595071127965")
+        self.assertEqual(search_form.submit_btn_name, "pruefungsterminSearch:j_idt190")
+        self.assertEqual(search_form.action, "/fprApp/verwaltung/Pruefungssuche?execution=e1s1")
+        self.assertEqual(search_form.view_state, "e1s1")
+
+    def test_incomplete_backend(self):
+        class IncompleteExamParser(ExamHtmlParser):
+            def extract_search_form(self, content):
+                return None
+
+        with self.assertRaises(TypeError):
+            IncompleteExamParser()
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            get_exam_parser("regex")
+
+    def test_backend_parity(self):
+        """Every installed backend must extract the same values as the default backend."""
+        default_parser = get_exam_parser("html.parser")
+        expected_overview = default_parser.extract_overview_table(self.overview_content)
+        expected_details = default_parser.extract_detail_tables(self.detail_content)
+        expected_form = default_parser.extract_search_form(self.overview_content)
+
+        for backend in get_installed_backends():
+            with self.subTest(backend=backend):
+                parser = get_exam_parser(backend)
+                self.assertEqual(parser.extract_overview_table(self.overview_content), expected_overview)
+                self.assertEqual(parser.extract_detail_tables(self.detail_content), expected_details)
+                self.assertEqual(parser.extract_search_form(self.overview_content), expected_form)
+
+    def test_backend_parity_of_exams(self):
+        """Every installed backend must result in the same exams."""
+        expected_exams = None
+        for backend in get_installed_backends():
+            with self.subTest(backend=backend):
+                scraper = models.ExamTableScraper.__new__(models.ExamTableScraper)
+                scraper.parser = get_exam_parser(backend)
+                exams = [exam.to_row() for exam in scraper.parse_exams(self.overview_content, self.detail_content)]
+
+                self.assertEqual(len(exams), 16)
+                expected_exams = expected_exams or exams
+                self.assertEqual(exams, expected_exams)
+
+    def test_streaming_backend_with_small_chunks(self):
+        parser = get_exam_parser("stream")
+        expected_details = get_exam_parser("html.parser").extract_detail_tables(self.detail_content)
+
+        chunks = (self.detail_content[i : i + 17] for i in range(0, len(self.detail_content), 17))
+        tables = parser.iter_detail_tables(chunks)
+
+        self.assertIsInstance(tables, types.GeneratorType)
+        self.assertEqual(list(tables), expected_details)
+
+    def test_all_backends_are_known(self):
+        self.assertEqual(set(get_installed_backends()) - set(PARSER_BACKENDS), set())
+
+
+class TestExamTableScraperPages(unittest.TestCase):
+    def setUp(self):
+        self.scraper = models.ExamTableScraper.__new__(models.ExamTableScraper)
+        self.scraper.parser = get_exam_parser("stream")
+        self.scraper.exam_overview_page = io.BytesIO(read_fixture("exam_overview.html"))
+        self.scraper.exam_detail_page = io.BytesIO(read_fixture("exam_detail.html"))
+
+    def test_iter_exams(self):
+        exams = self.scraper.iter_exams()
+
+        self.assertIsInstance(exams, types.GeneratorType)
+        first_exam = next(exams)
+        self.assertEqual(first_exam.exam_id, "4711")
+        self.assertEqual(first_exam.district, models.District.Oberfranken)
+        self.assertEqual(len(list(exams)), 15)
+
+    def test_fingerprint_ignores_csrf_token(self):
+        fingerprint = self.scraper.get_fingerprint()
+
+        overview_content = read_fixture("exam_overview.html").replace(b"505c52c8", b"0000aaaa")
+        self.scraper.exam_overview_page = io.BytesIO(overview_content)
+        self.assertEqual(self.scraper.get_fingerprint(), fingerprint)
+
+        detail_content = read_fixture("exam_detail.html").replace(b">Belegt<", b">Frei<", 1)
+        self.scraper.exam_detail_page = io.BytesIO(detail_content)
+        self.assertNotEqual(self.scraper.get_fingerprint(), fingerprint)
+
+    def test_sync_exams_to_db_skips_unchanged_exams(self):
+        with Session(db.engine) as session:
+            self.scraper.sync_exams_to_db(session)
+            exam = models.Exam.get_exam_by_exam_id(session, exam_id="4711")
+            first_updated_at = exam.updated_at
+
+            # sync again with one changed exam
+            detail_content = read_fixture("exam_detail.html").replace(
+                'Aktuelle Teilnehmer</span><span class="value">30<'.encode(),
+                'Aktuelle Teilnehmer</span><span class="value">29<'.encode(),
+                1,
+            )
+            self.scraper.exam_detail_page = io.BytesIO(detail_content)
+            self.scraper.sync_exams_to_db(session)
+
+            exams = models.Exam.get_multi_by_exam_ids(session, exam_ids=[str(4711 + i) for i in range(16)])
+            self.assertEqual(len(exams), 16)
+
+            changed_exam = models.Exam.get_exam_by_exam_id(session, exam_id="4711")
+            self.assertEqual(changed_exam.current_participants, 29)
+            self.assertGreater(changed_exam.updated_at, first_updated_at)
+
+            unchanged_exam = models.Exam.get_exam_by_exam_id(session, exam_id="4712")
+            self.assertLessEqual(unchanged_exam.updated_at, first_updated_at)
+
+            last_event = models.ExamEvent.get_since(session, last_event_id=0)[-1]
+            self.assertEqual(last_event.exam_id, "4711")
+            self.assertEqual(last_event.event_type, models.ExamEventType.seats_freed)
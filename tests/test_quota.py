@@ -0,0 +1,56 @@
+import unittest
+import uuid
+from datetime import date
+
+from sqlmodel import Session
+
+from fishing_exam_alert import db, models
+from fishing_exam_alert.quota import QuotaManager
+
+
+class TestQuotaManager(unittest.TestCase):
+    def setUp(self):
+        self.state_key_prefix = f"test.quota.{uuid.uuid4().hex[:8]}"
+
+    def test_consume_counts_units_per_day(self):
+        quota = QuotaManager(daily_budget=100, state_key_prefix=self.state_key_prefix)
+
+        with Session(db.engine) as session:
+            self.assertEqual(quota.get_remaining(session), 100)
+            quota.consume(session, 30)
+            self.assertEqual(quota.consume(session, 20), 50)
+
+            # a new manager reads the persisted count
+            self.assertEqual(
+                QuotaManager(daily_budget=100, state_key_prefix=self.state_key_prefix).get_used(session), 50
+            )
+            self.assertEqual(quota.get_remaining(session), 50)
+            self.assertEqual(
+                models.AppState.get_value(session, key=quota.get_state_key(date(2000, 1, 1)), default="0"), "0"
+            )
+
+    def test_consume_beyond_budget(self):
+        quota = QuotaManager(daily_budget=10, state_key_prefix=self.state_key_prefix)
+
+        with Session(db.engine) as session:
+            quota.consume(session, 12)
+
+            self.assertEqual(quota.get_remaining(session), 0)
+
+    def test_unlimited_budget(self):
+        quota = QuotaManager(daily_budget=0, state_key_prefix=self.state_key_prefix)
+
+        with Session(db.engine) as session:
+            quota.consume(session, 10**6)
+
+            self.assertIsNone(quota.get_remaining(session))
+
+    def test_pop_deferred(self):
+        quota = QuotaManager(daily_budget=10, state_key_prefix=self.state_key_prefix)
+
+        with Session(db.engine) as session:
+            quota.defer(session, 3)
+            quota.defer(session, 2)
+
+            self.assertEqual(quota.pop_deferred(session), 5)
+            self.assertEqual(quota.pop_deferred(session), 0)
@@ -0,0 +1,33 @@
+import threading
+import time
+import unittest
+
+from fishing_exam_alert.rate_limit import TokenBucket
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_try_acquire_within_capacity(self):
+        bucket = TokenBucket(rate=1, capacity=3)
+
+        self.assertEqual([bucket.try_acquire() for _ in range(4)], [True, True, True, False])
+
+    def test_acquire_limits_concurrent_callers(self):
+        bucket = TokenBucket(rate=100, capacity=1)
+
+        def acquire_tokens():
+            for _ in range(10):
+                bucket.acquire()
+
+        start = time.monotonic()
+        threads = [threading.Thread(target=acquire_tokens) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # 40 tokens: 1 from the full bucket and 39 refilled at 100 per second
+        self.assertGreaterEqual(time.monotonic() - start, 0.38)
+
+    def test_rate_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            TokenBucket(rate=0)
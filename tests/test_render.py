@@ -0,0 +1,59 @@
+import unittest
+from datetime import datetime
+
+from fishing_exam_alert import matching
+from fishing_exam_alert.render import MailRenderer
+from tests.utils import get_random_exam
+
+
+class TestMailRenderer(unittest.TestCase):
+    def setUp(self):
+        self.exams = [
+            get_random_exam(
+                id=i + 1,
+                exam_id=f"00{i}",
+                name="Gasthof <Zur Post>",
+                postal_code="95444",
+                status="Frei",
+                exam_start=datetime(2030, 5, 4, 9, 30),
+            )
+            for i in range(3)
+        ]
+        self.exams_df = matching.get_exams_dataframe(self.exams)
+        self.renderer = MailRenderer()
+
+    def test_render(self):
+        subject, plain_message, html_message = self.renderer.render("max@example.com", self.exams_df)
+
+        self.assertEqual(subject, "Fischerprüfung Updates - Es gibt 3 freie Termine!")
+        self.assertIn("Hi max,", plain_message)
+        for exam in self.exams:
+            self.assertIn(f"Prüfungs-Nr: {exam.exam_id}\n", plain_message)
+            self.assertIn(f"Belegte Plätze: {exam.current_participants} / {exam.max_participants}\n", plain_message)
+            self.assertIn(f"<td>{exam.exam_id}</td>", html_message)
+        self.assertIn("Prüfungsbeginn: 04.05.2030 09:30\n", plain_message)
+        self.assertIn("Gasthof <Zur Post>", plain_message)
+        self.assertIn("<td>Gasthof &lt;Zur Post&gt;</td>", html_message)
+        self.assertEqual(html_message.count("<tr>"), 1 + 3)
+        self.assertNotIn("Route", html_message)
+
+    def test_render_travel_columns_per_user(self):
+        exams_df = self.exams_df.copy()
+        exams_df["start_address_line"] = "80331, Deutschland"
+        exams_df["travel_duration"] = [3600, 1800, None]
+        exams_df["travel_distance"] = [60000, 30000, None]
+
+        _, plain_message, html_message = self.renderer.render("max@example.com", exams_df)
+        _, other_plain_message, _ = self.renderer.render("erika@example.com", self.exams_df)
+
+        self.assertIn("Entfernung Fahrzeit [min]: 60\n    Entfernung [km]: 60\n", plain_message)
+        self.assertIn("Entfernung Fahrzeit [min]: 30\n    Entfernung [km]: 30\n", plain_message)
+        self.assertIn("https://www.google.com/maps/dir/80331%2C+Deutschland/", html_message)
+        self.assertNotIn("Entfernung", other_plain_message)
+
+    def test_render_exams_once(self):
+        for i in range(3):
+            self.renderer.render(f"user{i}@example.com", self.exams_df.iloc[: i + 1])
+
+        self.assertEqual(self.renderer.misses, 3)
+        self.assertEqual(self.renderer.hits, 0 + 1 + 2)
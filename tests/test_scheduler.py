@@ -0,0 +1,49 @@
+import unittest
+from datetime import datetime, timedelta
+
+from sqlmodel import Session
+
+from fishing_exam_alert import db
+from fishing_exam_alert.scheduler import PollScheduler
+
+
+class TestPollScheduler(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime(2023, 3, 1, 12)
+        self.scheduler = PollScheduler(
+            min_interval=timedelta(minutes=5),
+            base_interval=timedelta(minutes=60),
+            max_interval=timedelta(minutes=180),
+            urgent_window=timedelta(days=10),
+        )
+
+    def test_unknown_change_keeps_base_interval(self):
+        self.assertEqual(self.scheduler.update(None, None, now=self.now), timedelta(minutes=60))
+
+    def test_change_tightens_interval(self):
+        self.assertEqual(self.scheduler.update(True, None, now=self.now), timedelta(minutes=5))
+
+    def test_backoff_is_bounded(self):
+        intervals = [self.scheduler.update(False, None, now=self.now) for _ in range(5)]
+
+        self.assertEqual(intervals[0], timedelta(minutes=90))
+        self.assertEqual(intervals[-1], timedelta(minutes=180))
+        self.assertEqual(self.scheduler.update(True, None, now=self.now), timedelta(minutes=5))
+
+    def test_free_exam_close_to_date_tightens_interval(self):
+        in_five_days = self.now + timedelta(days=5)
+        self.assertEqual(self.scheduler.update(False, in_five_days, now=self.now), timedelta(minutes=32, seconds=30))
+
+        in_twenty_days = self.now + timedelta(days=20)
+        self.assertEqual(self.scheduler.update(False, in_twenty_days, now=self.now), timedelta(minutes=135))
+
+    def test_invalid_bounds(self):
+        with self.assertRaises(ValueError):
+            PollScheduler(min_interval=timedelta(minutes=30), base_interval=timedelta(minutes=10))
+
+    def test_get_next_interval(self):
+        with Session(db.engine) as session:
+            interval = self.scheduler.get_next_interval(session)
+
+        self.assertTrue(timedelta(minutes=5) <= interval <= timedelta(minutes=60))
+        self.assertIsNotNone(self.scheduler.last_event_id)
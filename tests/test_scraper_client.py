@@ -0,0 +1,71 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+import requests
+
+from fishing_exam_alert.scraper_client import ScraperClient
+
+
+class FakeExamSiteHandler(BaseHTTPRequestHandler):
+    # status codes that are returned in order, the last one is repeated
+    status_codes: List[int] = [200]
+    requests: List[dict] = []
+
+    def do_GET(self):
+        self.requests.append({"path": self.path, "headers": dict(self.headers)})
+        status_code = self.status_codes.pop(0) if len(self.status_codes) > 1 else self.status_codes[0]
+
+        self.send_response(status_code)
+        body = f"response {len(self.requests)}".encode()
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestScraperClient(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeExamSiteHandler)
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}/Pruefungssuche"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        FakeExamSiteHandler.requests = []
+        self.client = ScraperClient(max_retries=2, backoff_seconds=0)
+
+    def test_retry_on_server_error(self):
+        FakeExamSiteHandler.status_codes = [503, 502, 200]
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(FakeExamSiteHandler.requests), 3)
+
+    def test_raise_after_max_retries(self):
+        FakeExamSiteHandler.status_codes = [503]
+
+        with self.assertRaises(requests.HTTPError):
+            self.client.get(self.url)
+        self.assertEqual(len(FakeExamSiteHandler.requests), 3)
+
+    def test_raise_on_connection_error(self):
+        client = ScraperClient(connect_timeout=1, max_retries=1, backoff_seconds=0)
+
+        with self.assertRaises(requests.ConnectionError):
+            client.get("http://127.0.0.1:1/Pruefungssuche")
+
+    def test_backoff_is_bounded(self):
+        client = ScraperClient(backoff_seconds=2, max_backoff_seconds=5)
+
+        for attempt in range(1, 10):
+            self.assertLessEqual(client.get_backoff(attempt), 5)
@@ -35,7 +35,9 @@ def get_random_user(
         email=email or get_random_email(locale=locale),
         max_travel_duration=max_travel_duration or fake.random_int(min=0, max=120),
         postal_code=postal_code or fake.postalcode(),
-        districts=districts or ",".join(get_random_districts()),
+        district_mask=models.District.get_mask(
+            models.District.parse_list(districts or ",".join(get_random_districts()))
+        ),
         need_headphones=need_headphones or fake.boolean(),
         need_disabled_access=need_disabled_access or fake.boolean(),
         active=active or fake.boolean(),
@@ -60,7 +62,7 @@ def create_random_user(
     defaults = {
         "max_travel_duration": max_travel_duration,
         "postal_code": postal_code,
-        "districts": districts,
+        "district_mask": models.District.get_mask(models.District.parse_list(districts)),
         "need_headphones": need_headphones,
         "need_disabled_access": need_disabled_access,
         "active": active,